@@ -0,0 +1,261 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import re
+from typing import Dict, List
+
+from adapters.log import get_logger
+
+LOG = get_logger(__name__)
+
+# labels put on the containers and networks of an instance; the compose ones let docker-compose see them too
+LABEL_INSTANCE = 'org.elastest.esm.instance-id'
+LABEL_SERVICE = 'org.elastest.esm.service'
+LABEL_PROJECT = 'com.docker.compose.project'
+LABEL_COMPOSE_SERVICE = 'com.docker.compose.service'
+
+# compose service keys that map directly to a docker API parameter
+CONTAINER_KEYS = {'hostname': 'hostname', 'domainname': 'domainname', 'entrypoint': 'entrypoint',
+                  'working_dir': 'working_dir', 'user': 'user', 'tty': 'tty', 'stdin_open': 'stdin_open',
+                  'stop_signal': 'stop_signal'}
+HOST_CONFIG_KEYS = {'privileged': 'privileged', 'dns': 'dns', 'dns_search': 'dns_search', 'cap_add': 'cap_add',
+                    'cap_drop': 'cap_drop', 'mem_limit': 'mem_limit', 'shm_size': 'shm_size',
+                    'devices': 'devices', 'security_opt': 'security_opt', 'volumes_from': 'volumes_from',
+                    'pid': 'pid_mode', 'ipc': 'ipc_mode', 'tmpfs': 'tmpfs', 'sysctls': 'sysctls'}
+# keys handled by ComposeService itself or without effect here
+HANDLED_KEYS = {'image', 'command', 'environment', 'ports', 'expose', 'volumes', 'networks', 'network_mode',
+                'links', 'depends_on', 'container_name', 'labels', 'restart', 'extra_hosts', 'logging'}
+
+
+def project_name(instance_id: str) -> str:
+    """The docker-compose project name of an instance: what compose made of the name of its directory."""
+    return re.sub(r'[^-_a-z0-9]', '', instance_id.lower())
+
+
+def as_list(value) -> List[str]:
+    # compose accepts both 'KEY=value' lists and {KEY: value} mappings for environment, labels, extra_hosts
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        return ['{}={}'.format(k, '' if v is None else v) for k, v in value.items()]
+    return [str(v) for v in value]
+
+
+def as_dict(value, sep='=') -> Dict[str, str]:
+    if isinstance(value, dict):
+        return {str(k): '' if v is None else str(v) for k, v in value.items()}
+    out = dict()
+    for item in value or []:
+        k, _, v = str(item).partition(sep)
+        out[k] = v
+    return out
+
+
+def _port_range(spec: str) -> List[str]:
+    if '-' in spec:
+        start, end = spec.split('-', 1)
+        return [str(p) for p in range(int(start), int(end) + 1)]
+    return [spec]
+
+
+def parse_ports(ports) -> Dict[str, object]:
+    """
+    Turns compose ports ('8080', '8080:80', '127.0.0.1:8080:80/udp', '9000-9001:9000-9001' or the long syntax)
+    into the port bindings of the docker API: {'80/tcp': 8080, '81/tcp': None, ...}.
+    """
+    bindings = dict()
+    for port in ports or []:
+        if isinstance(port, dict):
+            proto = port.get('protocol', 'tcp')
+            published = port.get('published')
+            bindings['{}/{}'.format(port['target'], proto)] = int(published) if published else None
+            continue
+
+        spec, _, proto = str(port).partition('/')
+        proto = proto or 'tcp'
+        parts = spec.rsplit(':', 2)
+        container = _port_range(parts[-1])
+        host_ip = parts[0] if len(parts) == 3 else None
+        host = _port_range(parts[-2]) if len(parts) > 1 and parts[-2] else [None] * len(container)
+        if len(host) != len(container):
+            raise Exception('Port ranges do not match in {}'.format(port))
+        for c, h in zip(container, host):
+            h = int(h) if h else None
+            bindings['{}/{}'.format(c, proto)] = (host_ip, h) if host_ip else h
+    return bindings
+
+
+class ComposeService(object):
+    """
+    The docker API parameters of one service of a compose manifest, prepared once when the manifest is parsed.
+    """
+    def __init__(self, project: 'ComposeProject', name: str, definition: dict) -> None:
+        self.name = name
+        self.definition = definition
+        if 'image' not in definition:
+            raise Exception('Service {} has no image; building images is not supported'.format(name))
+        self.image = definition['image']
+        if ':' not in self.image.rsplit('/', 1)[-1] and '@' not in self.image:
+            self.image += ':latest'
+        self.container_name = definition.get('container_name', '{}_{}_1'.format(project.name, name))
+        self.environment = as_list(definition.get('environment'))
+
+        ignored = set(definition) - HANDLED_KEYS - set(CONTAINER_KEYS) - set(HOST_CONFIG_KEYS)
+        if ignored:
+            LOG.warning('Ignoring the unsupported keys {} of service {}'.format(sorted(ignored), name))
+
+        # start order: compose starts the services a service depends on or links to first
+        depends_on = definition.get('depends_on', [])
+        links = [link.split(':')[0] for link in definition.get('links', [])]
+        self.depends_on = list(dict.fromkeys(list(depends_on) + links))
+
+        self.labels = {**as_dict(definition.get('labels')), LABEL_INSTANCE: project.instance_id,
+                       LABEL_SERVICE: name, LABEL_PROJECT: project.name, LABEL_COMPOSE_SERVICE: name,
+                       'com.docker.compose.container-number': '1', 'com.docker.compose.oneoff': 'False'}
+
+        self.port_bindings = parse_ports(definition.get('ports'))
+        self.exposed = list(self.port_bindings) + ['{}/tcp'.format(p) if '/' not in str(p) else str(p)
+                                                   for p in definition.get('expose', [])]
+
+        self.binds, self.volumes = self._volumes(project, definition.get('volumes', []))
+
+        # networks: name on the docker host -> aliases of the container on it
+        self.network_mode = definition.get('network_mode')
+        self.networks = dict()
+        if not self.network_mode:
+            networks = definition.get('networks') or {'default': None}
+            if isinstance(networks, list):
+                networks = {n: None for n in networks}
+            for net, net_conf in networks.items():
+                aliases = [name] + list((net_conf or {}).get('aliases', []))
+                self.networks[project.network_name(net)] = aliases
+
+        self.host_config = {HOST_CONFIG_KEYS[k]: v for k, v in definition.items() if k in HOST_CONFIG_KEYS}
+        self.host_config.update(port_bindings=self.port_bindings, binds=self.binds)
+        if self.network_mode:
+            self.host_config['network_mode'] = self.network_mode
+        elif self.networks:
+            self.host_config['network_mode'] = next(iter(self.networks))
+        if 'restart' in definition:
+            policy, _, retries = definition['restart'].partition(':')
+            self.host_config['restart_policy'] = {'Name': '' if policy == 'no' else policy,
+                                                  'MaximumRetryCount': int(retries or 0)}
+        if 'extra_hosts' in definition:
+            self.host_config['extra_hosts'] = as_dict(definition['extra_hosts'], sep=':')
+        if 'logging' in definition:
+            self.host_config['log_config'] = {'Type': definition['logging'].get('driver', ''),
+                                              'Config': definition['logging'].get('options', {})}
+
+    def _volumes(self, project, volumes):
+        binds, anonymous = [], []
+        for volume in volumes:
+            if isinstance(volume, dict):
+                volume = '{}:{}{}'.format(volume['source'], volume['target'],
+                                          ':ro' if volume.get('read_only') else '')
+            parts = volume.split(':')
+            if len(parts) == 1:
+                anonymous.append(parts[0])
+                continue
+            source = parts[0]
+            if source.startswith('.') or source.startswith('~'):
+                source = os.path.abspath(os.path.join(project.working_dir, os.path.expanduser(source)))
+            elif not source.startswith('/'):
+                source = project.volume_name(source)
+            binds.append(':'.join([source] + parts[1:]))
+        return binds, anonymous
+
+    def create_args(self) -> dict:
+        """Arguments of APIClient.create_container, less host_config and networking_config."""
+        args = {arg: self.definition[key] for key, arg in CONTAINER_KEYS.items() if key in self.definition}
+        args.update(image=self.image, name=self.container_name, command=self.definition.get('command'),
+                    environment=self.environment, labels=self.labels, ports=self.exposed,
+                    volumes=self.volumes)
+        return args
+
+
+class ComposeProject(object):
+    """
+    A compose manifest parsed once into what is needed to run it with the docker API: the networks to create
+    and the containers of its services, in an order that respects depends_on and links.
+    """
+    def __init__(self, instance_id: str, manifest: dict, working_dir: str = '.') -> None:
+        self.instance_id = instance_id
+        self.name = project_name(instance_id)
+        self.working_dir = working_dir
+        self.manifest = manifest
+
+        # networks: name on the docker host -> create arguments or None for an external network
+        self.networks = dict()
+        declared = manifest.get('networks') or {}
+        for net, net_conf in declared.items():
+            net_conf = net_conf or {}
+            external = net_conf.get('external')
+            if external:
+                self.networks[self.network_name(net)] = None
+            else:
+                self.networks[self.network_name(net)] = {
+                    'driver': net_conf.get('driver', 'bridge'), 'options': net_conf.get('driver_opts'),
+                    'labels': {**as_dict(net_conf.get('labels')), LABEL_INSTANCE: instance_id,
+                               LABEL_PROJECT: self.name, 'com.docker.compose.network': net}}
+
+        self.services = {name: ComposeService(self, name, definition or {})
+                         for name, definition in (manifest.get('services') or {}).items()}
+        if not self.services:
+            raise Exception('The manifest of {} has no services'.format(instance_id))
+        for service in self.services.values():
+            for dep in service.depends_on:
+                if dep not in self.services:
+                    raise Exception('Service {} depends on the unknown service {}'.format(service.name, dep))
+            # a link alias makes the linked service reachable under that name too
+            for link in service.definition.get('links', []):
+                target, _, alias = link.partition(':')
+                if alias:
+                    for aliases in self.services[target].networks.values():
+                        aliases.append(alias)
+            for net in service.networks:
+                if net not in self.networks:
+                    # the implicit default network
+                    self.networks[net] = {'driver': 'bridge', 'options': None,
+                                          'labels': {LABEL_INSTANCE: instance_id, LABEL_PROJECT: self.name,
+                                                     'com.docker.compose.network': 'default'}}
+
+    def network_name(self, net: str) -> str:
+        conf = (self.manifest.get('networks') or {}).get(net) or {}
+        external = conf.get('external')
+        if external:
+            return external.get('name', net) if isinstance(external, dict) else conf.get('name', net)
+        return '{}_{}'.format(self.name, net)
+
+    def volume_name(self, vol: str) -> str:
+        conf = (self.manifest.get('volumes') or {}).get(vol) or {}
+        external = conf.get('external')
+        if external:
+            return external.get('name', vol) if isinstance(external, dict) else conf.get('name', vol)
+        return '{}_{}'.format(self.name, vol)
+
+    def start_order(self) -> List[str]:
+        """The services, each after the ones it depends on."""
+        order, done = [], set()
+        remaining = dict(self.services)
+        while remaining:
+            ready = [name for name, svc in remaining.items() if all(d in done for d in svc.depends_on)]
+            if not ready:
+                raise Exception('The services {} depend on each other'.format(sorted(remaining)))
+            for name in ready:
+                order.append(name)
+                done.add(name)
+                del remaining[name]
+        return order
@@ -14,27 +14,212 @@
 #    under the License.
 
 
-from threading import Thread
+import time
+from queue import Queue
+from threading import Lock, Thread
 
+import config
+from adapters.log import get_logger
 
-class AsychExe(Thread):
+LOG = get_logger(__name__)
+
+
+class WorkerPool:
     """
-    Only purpose of this thread is to execute a list of tasks sequentially
-    as a background "thread".
+    Fixed set of daemon worker threads that execute lists of tasks sequentially, taken from a
+    bounded queue. submit() never blocks: when the queue is full the job is rejected so the caller
+    can push back on the client.
     """
-    def __init__(self, tasks, store=None):
-        super(AsychExe, self).__init__()
-        self.store = store
-        self.tasks = tasks
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        # the bound is enforced by submit(), so shutdown() can always post its sentinels
+        self._queue = Queue()
+        self._threads = []
+        self._lock = Lock()
+        self._stopped = False
+        self._pending = dict()  # key -> operation ids of its jobs queued or running, in submission order
 
-    def run(self):
-        super(AsychExe, self).run()
-        print('Starting AsychExe thread')
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self.wait_time = 0.0  # seconds jobs spent queued
+        self.max_wait_time = 0.0
+        self.run_time = 0.0  # seconds jobs spent executing
+        self.max_run_time = 0.0
 
-        for task in self.tasks:
-            entity, extras = task.run()
-            if self.store:
-                print('Updating entity in store')
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            worker = Thread(target=self._work, name='{}-worker-{}'.format(self.name, len(self._threads)),
+                            daemon=True)
+            worker.start()
+            self._threads.append(worker)
+
+    def submit(self, tasks, key: str = None, operation: str = None) -> bool:
+        with self._lock:
+            if self._stopped:
+                return False
+            self._start_workers()
+            if self._queue.qsize() >= self.queue_size:
+                self.rejected += 1
+                return False
+            self._queue.put_nowait((time.monotonic(), tasks, key, operation))
+            self.submitted += 1
+            if key is not None:
+                self._pending.setdefault(key, []).append(operation)
+            return True
+
+    def pending(self, key: str):
+        """
+        (True, operation id) while a job submitted under key is queued or running, else (False, None).
+        With several such jobs, the operation is the one of the latest submitted.
+        """
+        with self._lock:
+            if key in self._pending:
+                return True, self._pending[key][-1]
+            return False, None
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            queued_at, tasks, key, operation = job
+            started = time.monotonic()
+            with self._lock:
+                self.running += 1
+            failed = False
+            try:
+                for task in tasks:
+                    task.run()
+            except Exception as e:
+                failed = True
+                LOG.error('Background task failed on the {} pool: {}'.format(self.name, e), exc_info=True)
+            finished = time.monotonic()
+            with self._lock:
+                self.running -= 1
+                if key is not None:
+                    self._forget(key, operation)
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                self.wait_time += started - queued_at
+                self.max_wait_time = max(self.max_wait_time, started - queued_at)
+                self.run_time += finished - started
+                self.max_run_time = max(self.max_run_time, finished - started)
+            self._queue.task_done()
+
+    def _forget(self, key: str, operation: str):
+        # only this job's entry: other jobs of the same key are still queued or running
+        operations = self._pending.get(key, [])
+        if operation in operations:
+            operations.remove(operation)
+        if not operations:
+            self._pending.pop(key, None)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._stopped = True
+            threads = list(self._threads)
+        for _ in threads:
+            # queued jobs are still drained before the workers see the sentinel
+            self._queue.put(None)
+        if wait:
+            for worker in threads:
+                worker.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'queue_depth': self._queue.qsize(),
+                'running': self.running,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_time': round(self.wait_time / done, 6) if done else 0.0,
+                'max_wait_time': round(self.max_wait_time, 6),
+                'avg_run_time': round(self.run_time / done, 6) if done else 0.0,
+                'max_run_time': round(self.max_run_time, 6),
+            }
+
+
+class Executor:
+    """
+    Runs background (accept_incomplete) operations on one WorkerPool per backend type, so a slow
+    backend can only tie up its own workers. Backends without an explicit limit share the default pool.
+    """
+    DEFAULT = 'default'
+    # manifest types that run on the same backend
+    ALIASES = {'docker-compose': 'docker', 'kubernetes': 'k8s'}
+
+    def __init__(self, workers: int, queue_size: int, backend_limits: dict = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.backend_limits = backend_limits or dict()
+        self._pools = dict()
+        self._lock = Lock()
+
+    @staticmethod
+    def parse_limits(limits: str) -> dict:
+        """Parse 'docker=4,k8s=4,epm=2' into a dict."""
+        parsed = dict()
+        for item in limits.split(','):
+            if '=' in item:
+                backend, limit = item.split('=', 1)
+                parsed[backend.strip()] = int(limit)
+        return parsed
+
+    def pool_name(self, backend: str = None) -> str:
+        backend = self.ALIASES.get(backend, backend)
+        return backend if backend in self.backend_limits else self.DEFAULT
+
+    def pool(self, backend: str = None) -> WorkerPool:
+        name = self.pool_name(backend)
+        with self._lock:
+            if name not in self._pools:
+                workers = self.backend_limits.get(name, self.workers)
+                self._pools[name] = WorkerPool(name, workers, self.queue_size)
+            return self._pools[name]
+
+    def submit(self, tasks, backend: str = None, key: str = None, operation: str = None) -> bool:
+        """
+        Queue tasks to run in order in the background. Returns False if the backend's queue is full.
+        key (e.g. the instance id) and operation let pending() report the job until it has finished.
+        """
+        accepted = self.pool(backend).submit(tasks, key=key, operation=operation)
+        if not accepted:
+            LOG.warning('Rejected background operation: the {} queue is full.'.format(self.pool_name(backend)))
+        return accepted
+
+    def pending(self, key: str):
+        """(True, operation id) if a job submitted under key has not finished yet, else (False, None)."""
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            found, operation = pool.pending(key)
+            if found:
+                return found, operation
+        return False, None
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.shutdown(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pools = dict(self._pools)
+        return {name: pool.stats() for name, pool in pools.items()}
 
 
 # TODO look into asyncio and asyncio.Task
@@ -62,3 +247,7 @@ class SynchExe(Task):
 
         for task in self.entity:
             entity, extras = task.run()
+
+
+EXECUTOR = Executor(workers=config.esm_exec_workers, queue_size=config.esm_exec_queue_size,
+                    backend_limits=Executor.parse_limits(config.esm_exec_backend_limits))
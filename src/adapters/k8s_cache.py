@@ -0,0 +1,174 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+import kubernetes
+from kubernetes.client.rest import ApiException
+
+from adapters.compose import LABEL_INSTANCE
+from adapters.log import get_logger
+
+LOG = get_logger(__name__)
+
+
+class Informer(object):
+    """
+    Keeps the objects of one kind current in memory: it lists them once, then watches the changes from the
+    resourceVersion of the list, and from the one of the last event after a stream ends. Only when the API server
+    answers that this version is gone (410) are the objects listed again.
+    """
+    def __init__(self, kind: str, list_func, label_selector: str, watch_timeout: int = 300,
+                 max_backoff: float = 30) -> None:
+        self.kind = kind
+        self.list_func = list_func
+        self.label_selector = label_selector
+        self.watch_timeout = watch_timeout
+        self.max_backoff = max_backoff
+        self.objects = dict()  # namespace ('' for cluster objects) -> name -> object
+        self.resource_version = None
+        self.synced = threading.Event()
+        self.lists = 0
+        self.watches = 0
+        self.events = 0
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._watch = None
+
+    @staticmethod
+    def _key(obj):
+        return obj.metadata.namespace or '', obj.metadata.name
+
+    def get(self, namespace: str = ''):
+        """The objects of a namespace by name."""
+        with self._lock:
+            return dict(self.objects.get(namespace, {}))
+
+    def find(self, name: str, namespace: str = ''):
+        with self._lock:
+            return self.objects.get(namespace, {}).get(name)
+
+    def _list(self):
+        response = self.list_func(label_selector=self.label_selector)
+        objects = dict()
+        for obj in response.items:
+            namespace, name = self._key(obj)
+            objects.setdefault(namespace, dict())[name] = obj
+        with self._lock:
+            self.objects = objects
+            self.resource_version = response.metadata.resource_version
+            self.lists += 1
+        self.synced.set()
+        LOG.debug('Listed {} {} at version {}'.format(len(response.items), self.kind, self.resource_version))
+
+    def _apply(self, event):
+        if event['type'] == 'ERROR':
+            status = event.get('raw_object') or {}
+            raise ApiException(status=status.get('code'), reason=status.get('message'))
+        obj = event['object']
+        namespace, name = self._key(obj)
+        with self._lock:
+            if event['type'] == 'DELETED':
+                objects = self.objects.get(namespace, {})
+                objects.pop(name, None)
+                if not objects:
+                    self.objects.pop(namespace, None)
+            else:
+                self.objects.setdefault(namespace, dict())[name] = obj
+            self.resource_version = obj.metadata.resource_version
+            self.events += 1
+
+    def _stream(self):
+        self._watch = kubernetes.watch.Watch()
+        self.watches += 1
+        for event in self._watch.stream(self.list_func, label_selector=self.label_selector,
+                                        resource_version=self.resource_version,
+                                        timeout_seconds=self.watch_timeout):
+            self._apply(event)
+            if self._stopped:
+                self._watch.stop()
+
+    def run(self):
+        backoff = 1
+        while not self._stopped:
+            try:
+                if self.resource_version is None:
+                    self._list()
+                self._stream()
+                backoff = 1
+            except ApiException as e:
+                if e.status == 410:
+                    LOG.info('Version {} of the {} is gone, listing them again'.format(self.resource_version,
+                                                                                      self.kind))
+                    self.resource_version = None
+                    continue
+                LOG.warning('Watching the {} failed: {}'.format(self.kind, e))
+            except Exception as e:
+                LOG.warning('Watching the {} failed: {}'.format(self.kind, e))
+            else:
+                continue
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self):
+        threading.Thread(target=self.run, name='esm-k8s-{}'.format(self.kind), daemon=True).start()
+
+    def stop(self):
+        self._stopped = True
+        if self._watch is not None:
+            self._watch.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'synced': self.synced.is_set(), 'objects': sum(len(o) for o in self.objects.values()),
+                    'resource_version': self.resource_version, 'lists': self.lists, 'watches': self.watches,
+                    'events': self.events}
+
+
+class ClusterCache(object):
+    """
+    The namespaces, deployments and services created by the ESM (the ones carrying the instance label), kept
+    current by one informer each. Reading an instance from it takes no API server call.
+    """
+    def __init__(self, core_api, extensions_api, watch_timeout: int = 300) -> None:
+        self.namespaces = Informer('namespaces', core_api.list_namespace, LABEL_INSTANCE, watch_timeout)
+        self.deployments = Informer('deployments', extensions_api.list_deployment_for_all_namespaces,
+                                    LABEL_INSTANCE, watch_timeout)
+        self.services = Informer('services', core_api.list_service_for_all_namespaces, LABEL_INSTANCE,
+                                 watch_timeout)
+        self.informers = [self.namespaces, self.deployments, self.services]
+
+    def start(self) -> None:
+        for informer in self.informers:
+            informer.start()
+
+    def stop(self) -> None:
+        for informer in self.informers:
+            informer.stop()
+
+    def wait_synced(self, timeout: float = None) -> bool:
+        return all(informer.synced.wait(timeout) for informer in self.informers)
+
+    @property
+    def synced(self) -> bool:
+        return all(informer.synced.is_set() for informer in self.informers)
+
+    def has_namespace(self, namespace: str) -> bool:
+        """True if the namespace is known to the cache, i.e. its objects can be read from it."""
+        return self.synced and self.namespaces.find(namespace) is not None
+
+    def stats(self) -> dict:
+        return {informer.kind: informer.stats() for informer in self.informers}
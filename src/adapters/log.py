@@ -13,9 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import atexit
 import jsonpickle
 import logging
-from time import sleep
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue, Full
+from threading import Lock, Thread
+from time import sleep, time
 
 import docker
 import json
@@ -25,28 +29,96 @@ import requests
 import config
 
 
-def get_logger(name, level=logging.DEBUG, space=None, series=None, sentinel=False):  # pragma: sentinel NO cover
-    if config.sen_kafka_ep != '' and sentinel:
-        logger = logging.getLogger(name)
-        logger.setLevel(level)
+LOG_FORMAT = logging.BASIC_FORMAT
+
+_listener = None
+_setup_lock = Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most rate records per second from each call site (logger, file and line), with bursts
+    of up to burst records. WARNING and above always pass. The number of records dropped since the last one
+    let through is appended to the next one.
+    """
+    def __init__(self, rate: float, burst: int = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._buckets = dict()  # call site -> [tokens, last refill, dropped]
+        self._lock = Lock()
+
+    def filter(self, record):
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record.msg = '{} ({} similar messages suppressed)'.format(record.msg, dropped)
+        return True
+
+
+def setup_logging():
+    """
+    Configures the root logger once. With ESM_LOG_ASYNC records are put on a queue by the logging thread
+    and written out by a listener thread, so request threads do not wait on the console.
+    ESM_LOG_RATE_LIMIT applies with or without it.
+    """
+    global _listener
+    with _setup_lock:
+        root = logging.getLogger()
+        if _listener is not None or root.handlers:
+            return
+        root.setLevel(config.esm_log_level)
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler = console
+        if config.esm_log_async == 'YES':
+            records = Queue()
+            handler = QueueHandler(records)
+            _listener = QueueListener(records, console, respect_handler_level=True)
+        if config.esm_log_rate_limit > 0:
+            handler.addFilter(RateLimitFilter(config.esm_log_rate_limit, config.esm_log_rate_burst))
+        root.addHandler(handler)
+        if _listener is None:
+            return
+        _listener.start()
+        # registered after logging's own shutdown hook, so it runs first and the queue is drained
+        atexit.register(_listener.stop)
 
+
+def get_logger(name, level=None, space=None, series=None, sentinel=False):  # pragma: sentinel NO cover
+    level = level or config.esm_log_level
+    setup_logging()
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+
+    if config.sen_kafka_ep != '' and sentinel:
         logger.info('Adding Sentinel logging handler')
         handler = SentinelLogHandler(backup_file='backup.log', space=space, series=series)
         handler.setLevel(level)
         logger.addHandler(handler)
 
-        print('reading...', config.sen_topic)
-    else:
-        logging.basicConfig(level=level)
-        logger = logging.getLogger(name)
-
-    logger.setLevel(level)
     return logger
 
 
 class SentinelLogHandler(logging.Handler):  # pragma: sentinel NO cover
     """Kafka logger handler attempts to write python logs directly
     into specified kafka topic instead of writing them into file.
+
+    emit() only queues the record; a sender thread publishes it through one long-lived, batching
+    KafkaProducer. Records that do not fit in the queue go to the backup file.
     """
 
     def setLevel(self, level):
@@ -60,6 +132,11 @@ class SentinelLogHandler(logging.Handler):  # pragma: sentinel NO cover
         self.fail_fh = backup_file
         if self.fail_fh is not None:
             self.fail_fh = open(backup_file, 'w')
+        self.fail_lock = Lock()
+        self.producer = None
+        self.queue = Queue(maxsize=config.sen_queue_size)
+        self.sender = Thread(target=self._send_queued, name='sentinel-log-sender', daemon=True)
+        self.sender.start()
 
     @staticmethod
     def format_msg(record):
@@ -74,41 +151,85 @@ class SentinelLogHandler(logging.Handler):  # pragma: sentinel NO cover
         if record.name == 'kafka':
             return
         try:
-            print('emitting...', record.msg)
-            msg_dict = {'msg': record.msg}
-            if '#' in record.msg:
-                msg_dict['instance_id'], msg_dict['msg'] = record.msg.split('#')
+            # callers log with lazy %-args, record.msg alone is the template
+            msg = record.getMessage()
+            msg_dict = {'msg': msg}
+            if '#' in msg:
+                msg_dict['instance_id'], msg_dict['msg'] = msg.split('#', 1)
             msg_dict['level'] = logging.getLevelName(self.level)
             msg_dict['file'] = __file__
 
             # msg = self.format_msg(record)
-            print('Preparing to send log-payload: ', msg_dict)
-            self._send_msg(msg_dict)
+            self.queue.put_nowait(msg_dict)
 
-        except AttributeError:
-            self.write_backup("Kafka Error!")
+        except Full:
+            # the sender cannot keep up (or kafka is down): keep the record in the backup file
             self.write_backup(record)
-            pass
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
-            # Log errors due queue full
             self.write_backup(record)
             self.handleError(record)
 
+    def _send_queued(self):
+        while True:
+            payload = self.queue.get()
+            try:
+                if payload is None:
+                    return
+                self._send_msg(payload)
+            except AttributeError:
+                self.write_backup("Kafka Error!")
+                self.write_backup(payload)
+            except Exception:
+                # the producer is rebuilt on the next message
+                self.write_backup(payload)
+                self._close_producer()
+            finally:
+                self.queue.task_done()
+
     def write_backup(self, record):
         if self.fail_fh:
-            self.fail_fh.write(str(record) + "\n")
+            with self.fail_lock:
+                if not self.fail_fh.closed:
+                    self.fail_fh.write(str(record) + "\n")
+
+    def flush(self):
+        # wait for the queued records to be handed to the producer, then for the producer to send them
+        deadline = time() + config.sen_kafka_close_timeout
+        while self.queue.unfinished_tasks and self.sender.is_alive() and time() < deadline:
+            sleep(0.01)
+        if self.producer is not None:
+            self.producer.flush(timeout=config.sen_kafka_close_timeout)
 
     def close(self):
+        if self.sender.is_alive():
+            try:
+                self.queue.put(None, timeout=config.sen_kafka_close_timeout)
+            except Full:
+                pass
+            self.sender.join(config.sen_kafka_close_timeout)
+        self._close_producer()
         if self.fail_fh:
-            self.fail_fh.close()
+            with self.fail_lock:
+                self.fail_fh.close()
         logging.Handler.close(self)
 
+    def _close_producer(self):
+        producer, self.producer = self.producer, None
+        if producer is not None:
+            try:
+                producer.close(timeout=config.sen_kafka_close_timeout)  # flushes pending batches
+            except Exception:
+                pass
+
     def _get_kafka_producer(self, endpoint, key_serializer, value_serializer):
-        if key_serializer == "StringSerializer" and value_serializer == "StringSerializer":
-            return KafkaProducer(linger_ms=1, acks='all', retries=0, key_serializer=str.encode,
-                                 value_serializer=str.encode, bootstrap_servers=[endpoint])
+        if self.producer is None and key_serializer == "StringSerializer" and value_serializer == "StringSerializer":
+            self.producer = KafkaProducer(linger_ms=config.sen_kafka_linger_ms,
+                                          batch_size=config.sen_kafka_batch_size,
+                                          acks='all', retries=0, key_serializer=str.encode,
+                                          value_serializer=str.encode, bootstrap_servers=[endpoint])
+        return self.producer
 
     def _send_msg(self, payload):
         msg_dict = dict()
@@ -119,17 +240,14 @@ class SentinelLogHandler(logging.Handler):  # pragma: sentinel NO cover
         elif type(payload) == str:
             msg_dict['msg'] = payload
 
-        print('sending...', msg_dict)
         msg = jsonpickle.encode(msg_dict)
         kafka_producer = self._get_kafka_producer(config.sen_kafka_ep, config.sen_key_ser, config.sen_val_ser)
+        # sent in batches of up to linger_ms by the producer, so delivery errors only reach the returned future
         if self.space is not None and self.series is not None:
-            kafka_producer.send(self.space, key=self.series, value=msg)
+            future = kafka_producer.send(self.space, key=self.series, value=msg)
         else:
-            kafka_producer.send(config.sen_topic, key=config.sen_series, value=msg) # space, series
-
-        # time required for kafka to get the value
-        sleep(0.05)
-        kafka_producer.close()
+            future = kafka_producer.send(config.sen_topic, key=config.sen_series, value=msg) # space, series
+        future.add_errback(lambda exc: self.write_backup(msg))
 
 
 class SentinelAgentInjector: # pragma: no cover
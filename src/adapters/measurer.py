@@ -14,9 +14,18 @@
 #    under the License.
 
 
+import heapq
+import itertools
+import math
+import random
+import threading
 import time
+from array import array
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-import threading
+from requests.adapters import HTTPAdapter
 
 import config
 from adapters.log import get_logger
@@ -30,18 +39,193 @@ LOG = get_logger(__name__, 'WARN', space=config.esm_hc_sen_topic, series=config.
 class MeasurerFactory:  # pragma: no cover
 
     def __init__(self):
-        self.measurers = {}
+        self.scheduler = HealthCheckScheduler(workers=config.esm_hc_workers, interval=float(config.esm_hc_interval),
+                                              jitter=config.esm_hc_jitter)
+        self.measurers = self.scheduler.measurers
 
     def start_heartbeat_measurer(self, cache):
-        measurer = Measurer(cache)
-        measurer.start()
-        self.measurers[cache['instance_id']] = measurer
+        measurer = Measurer(cache, session=self.scheduler.session)
+        self.scheduler.add(measurer)
 
     def stop_heartbeat_measurer(self, instance_id):
-        self.measurers[instance_id].stop()
+        self.scheduler.remove(instance_id)
+
+    def health(self, instance_id):
+        measurer = self.measurers.get(instance_id)
+        summary = measurer.history.summary() if measurer is not None else None
+        if summary is not None:
+            summary['circuit'] = measurer.circuit
+        return summary
+
+    def stats(self):
+        return self.scheduler.stats()
+
+    def shutdown(self, wait=True):
+        self.scheduler.shutdown(wait=wait)
+
+
+def _utc(timestamp):
+    return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class HealthHistory:
+    """
+    The status and latency of the last `size` health checks of an instance, kept in fixed-size arrays used as
+    a ring buffer (13 bytes per check).
+    """
+    ALIVE, DOWN, UNREACHABLE = 0, 1, 2
+    STATUSES = ('alive', 'down', 'unreachable')
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.times = array('d', [0.0]) * size
+        self.latencies = array('f', [0.0]) * size  # ms, nan if the endpoint did not answer
+        self.statuses = bytearray(size)
+        self.count = 0
+        self.last_transition = None
+        self._lock = threading.Lock()
+
+    def record(self, status: int, latency: float = float('nan'), at: float = None) -> None:
+        at = time.time() if at is None else at
+        with self._lock:
+            if not self.count or self.statuses[(self.count - 1) % self.size] != status:
+                self.last_transition = at
+            i = self.count % self.size
+            self.times[i] = at
+            self.latencies[i] = latency
+            self.statuses[i] = status
+            self.count += 1
+
+    @staticmethod
+    def _percentile(ordered, p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    def summary(self):
+        with self._lock:
+            n = min(self.count, self.size)
+            if not n:
+                return None
+            last = (self.count - 1) % self.size
+            statuses = self.statuses[:n]
+            latencies = sorted(l for l in self.latencies[:n] if not math.isnan(l))
+            summary = {
+                'status': self.STATUSES[statuses[last]],
+                'checks': n,
+                'uptime': round(100 * statuses.count(self.ALIVE) / n, 2),
+                'latency_p50_ms': None,
+                'latency_p99_ms': None,
+                'last_check': _utc(self.times[last]),
+                'last_transition': _utc(self.last_transition),
+            }
+        if latencies:
+            summary['latency_p50_ms'] = round(self._percentile(latencies, 50), 2)
+            summary['latency_p99_ms'] = round(self._percentile(latencies, 99), 2)
+        return summary
+
+
+class HealthCheckScheduler:
+    """
+    Runs the health checks of all measured instances on one scheduler thread and a small pool of workers.
+
+    Measurers are kept in a heap keyed by the time their next check is due. The scheduler thread hands due
+    measurers to the workers, and a measurer is put back in the heap once its check is done, so an instance
+    is never checked twice at once. Intervals are jittered so that instances added together do not keep
+    probing at the same time. The checks share one HTTP session, so connections to the instances are reused.
+    Measurers can be added and removed at any time.
+    """
+
+    def __init__(self, workers: int, interval: float, jitter: float = 0.1, max_hosts: int = 1000) -> None:
+        self.workers = workers
+        self.interval = interval
+        self.jitter = jitter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='esm-health')
+        # instance_id -> Measurer; a heap entry whose measurer is no longer in here is dropped when due
+        self.measurers = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.checks = 0
+        self.errors = 0
+
+    def add(self, measurer: 'Measurer') -> None:
+        with self._cond:
+            previous = self.measurers.get(measurer.instance_id)
+            if previous is not None:
+                previous.stop()
+            self.measurers[measurer.instance_id] = measurer
+            # the first check is spread over one interval
+            self._push(measurer, random.uniform(0, self.interval))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='esm-health-scheduler', daemon=True)
+                self._thread.start()
+
+    def remove(self, instance_id: str) -> bool:
+        with self._cond:
+            measurer = self.measurers.pop(instance_id, None)
+        if measurer is None:
+            return False
+        measurer.stop()
+        return True
+
+    def _push(self, measurer, delay):
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), measurer))
+        self._cond.notify()
+
+    def _jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
 
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, measurer = self._heap[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+                if self.measurers.get(measurer.instance_id) is measurer:
+                    self.executor.submit(self._check, measurer)
 
-class Measurer(threading.Thread):  # pragma: no cover
+    def _check(self, measurer):
+        delay = None
+        failed = False
+        try:
+            delay = measurer.step()
+        except Exception as e:
+            failed = True
+            LOG.error('{}#Health check failed: {}'.format(measurer.instance_id, e))
+        finally:
+            with self._cond:
+                # the counters are shared by all workers
+                self.checks += 1
+                self.errors += failed
+                if not self._stopped and self.measurers.get(measurer.instance_id) is measurer:
+                    self._push(measurer, self._jittered(self.interval if delay is None else delay))
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {'instances': len(self.measurers), 'workers': self.workers, 'interval': self.interval,
+                    'scheduled': len(self._heap), 'checks': self.checks, 'errors': self.errors,
+                    'open_circuits': sum(m.circuit == Measurer.OPEN for m in self.measurers.values())}
+
+    def shutdown(self, wait=True) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.executor.shutdown(wait=wait)
+        self.session.close()
+
+
+class Measurer:  # pragma: no cover
 
     """
         Measurer Sequence
@@ -56,21 +240,45 @@ class Measurer(threading.Thread):  # pragma: no cover
 
         > validate_endpoint
         :exception InvalidEndpoint
+
+        Each call of step() does one stage of the sequence and returns when the next one is due; it is driven
+        by the HealthCheckScheduler.
+
+        Checks are adaptive: while the endpoint stays healthy the interval doubles up to max_interval, and it
+        drops back to interval on the first failure. Failed checks back off exponentially; after
+        failure_threshold failures in a row the circuit opens and the endpoint is only checked every
+        max_interval, until a check succeeds again.
     """
 
-    def __init__(self, cache):
-        super(Measurer, self).__init__()
+    ENDPOINT_RETRY_DELAY = 2
+    CLOSED, OPEN = 'closed', 'open'
+
+    def __init__(self, cache, session=None, interval=None, max_interval=None, failure_threshold=None):
         self.cache = cache
         self.instance_id = cache['instance_id']
         self._stop_event = threading.Event()
+        self.session = session or requests
         self.endpoint = None
-        self.max_retries = config.esm_hc_sen_max_retries
+        self.max_retries = int(config.esm_hc_sen_max_retries)
+        self.retries = 0
+        self.created = False
+        self.polling = True
+        self.base_interval = float(interval if interval is not None else config.esm_hc_interval)
+        self.max_interval = max(self.base_interval,
+                                float(max_interval if max_interval is not None else config.esm_hc_max_interval))
+        self.failure_threshold = failure_threshold or config.esm_hc_failure_threshold
+        self.interval = self.base_interval
+        self.failures = 0
+        self.circuit = self.CLOSED
+        self.history = HealthHistory(config.esm_hc_history_size)
+        self.persisted = time.monotonic()
 
     def get_endpoint(self):
         try:
             endpoint = None  # endpoint = 'http://localhost:56567/health'  # .format(endpoint)
-            inst_info = self.cache['RM'].info(instance_id=self.cache['instance_id'], manifest_type=self.cache['mani'].manifest_type)
-            LOG.debug("inst_info: {}".format(inst_info))
+            inst_info = self.cache['RM'].info(instance_id=self.cache.get('backend_id', self.instance_id),
+                                              manifest_type=self.cache['mani'].manifest_type)
+            LOG.debug("inst_info: %s", inst_info)
             for k, v in inst_info.items():
                 if 'Ip' in k:
                     endpoint = v
@@ -80,52 +288,107 @@ class Measurer(threading.Thread):  # pragma: no cover
         except MeasurerException as e:
             LOG.warning(e)
 
-    def __poll_endpoint(self):
-        # Attempt to find Endpoint...
-        endpoint = self.get_endpoint()
-
-        while not endpoint and self.max_retries:
-            LOG.warning('{}#Endpoint could not be retrieved!'.format(self.cache['instance_id']))
-            time.sleep(2)
-            endpoint = self.get_endpoint()
+    def _poll_endpoint(self):
+        # Attempt to find Endpoint...; returns the delay before the next attempt or None once done
+        self.endpoint = self.get_endpoint()
+        if not self.endpoint and self.max_retries:
+            LOG.warning('{}#Endpoint could not be retrieved!'.format(self.instance_id))
             self.max_retries = self.max_retries - 1
-        return endpoint
+            self.retries += 1
+            return min(self.ENDPOINT_RETRY_DELAY * 2 ** (self.retries - 1), self.max_interval)
+        self.polling = False
+        LOG.debug("running measurer, endpoint found %s", self.endpoint)
+        return None
 
-    def __endpoint_is_healthy(self):
+    def _endpoint_is_healthy(self):
         if self.endpoint is not None:
-            response = requests.get(self.endpoint, timeout=5)
+            response = self.session.get(self.endpoint, timeout=config.esm_hc_timeout)
             data = response.json()
             return data.get('status') == 'up'
 
         else:
             return False
 
-    def __measure_health(self):
+    def _measure_health(self):
         LOG.info('Checking instance...')
+        started = time.monotonic()
         try:
-            if not self.__endpoint_is_healthy():
+            healthy = self._endpoint_is_healthy()
+            latency = (time.monotonic() - started) * 1000 if self.endpoint is not None else float('nan')
+            if not healthy:
+                self.history.record(HealthHistory.DOWN, latency)
                 LOG.warning('{}#Endpoint \'{}\' is down!'
                         .format(self.instance_id, self.endpoint))
+                return HealthHistory.DOWN
             else:
+                self.history.record(HealthHistory.ALIVE, latency)
                 LOG.warning('{}#Endpoint \'{}\' is alive!'
                         .format(self.instance_id, self.endpoint))
+                return HealthHistory.ALIVE
         except:
+            self.history.record(HealthHistory.UNREACHABLE)
             LOG.warning('{}#Endpoint \'{}\' is unreachable!'
                         .format(self.instance_id, self.endpoint))
+            return HealthHistory.UNREACHABLE
+
+    def _next_interval(self, status):
+        if status == HealthHistory.ALIVE:
+            if self.circuit == self.OPEN:
+                LOG.warning('{}#Circuit closed'.format(self.instance_id))
+                self.circuit = self.CLOSED
+            self.interval = self.base_interval if self.failures else min(self.interval * 2, self.max_interval)
+            self.failures = 0
+            return self.interval
+
+        self.failures += 1
+        if self.failures < self.failure_threshold:
+            self.interval = min(self.base_interval * 2 ** (self.failures - 1), self.max_interval)
+        else:
+            if self.circuit == self.CLOSED:
+                LOG.warning('{}#Circuit open after {} failed checks'.format(self.instance_id, self.failures))
+                self.circuit = self.OPEN
+                self._refresh_endpoint()
+            self.interval = self.max_interval
+        return self.interval
+
+    def _refresh_endpoint(self):
+        # the instance may have been moved or restarted with another address; info() is served from the cache
+        try:
+            endpoint = self.get_endpoint()
+        except Exception as e:
+            LOG.debug('Could not refresh the endpoint of %s: %s', self.instance_id, e)
+            return
+        if endpoint and endpoint != self.endpoint:
+            LOG.warning('{}#Endpoint changed to \'{}\''.format(self.instance_id, endpoint))
+            self.endpoint = endpoint
+
+    def _persist_health(self):
+        # keep the summary with the stored instance, so that it survives a restart of the ESM
+        store = self.cache.get('STORE')
+        if store is None or not config.esm_hc_persist_interval or \
+                time.monotonic() - self.persisted < config.esm_hc_persist_interval:
+            return
+        self.persisted = time.monotonic()
+        srv_inst = store.get_service_instance(self.instance_id)
+        if srv_inst:
+            srv_inst[0].context['health'] = self.history.summary()
+            store.add_service_instance(srv_inst[0])
 
-    def run(self):
-        super().run()
-        LOG.warning('{}#Measurer created'.format(self.instance_id))
-        self.endpoint = self.__poll_endpoint()
-        LOG.debug("running measurer, endpoint found {}".format(self.endpoint))
+    def step(self):
+        if not self.created:
+            LOG.warning('{}#Measurer created'.format(self.instance_id))
+            self.created = True
+        if self.polling:
+            delay = self._poll_endpoint()
+            if delay is not None:
+                return delay
 
         # VALIDATE ENDPOINT
         # valid = MeasurerUtils.validate_endpoint(self.endpoint) or True
         # valid = True
-        while not self.is_stopped():
-            periodicity = config.esm_hc_interval
-            self.__measure_health()
-            time.sleep(int(periodicity))
+        status = self._measure_health()
+        self._persist_health()
+        return self._next_interval(status)
 
     def stop(self):
         self._stop_event.set()
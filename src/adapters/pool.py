@@ -0,0 +1,282 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from adapters.log import get_logger
+from adapters.resources import RM
+from adapters.store import STORE
+from esm.models import Manifest
+
+LOG = get_logger(__name__)
+
+
+class PooledInstance(object):
+    def __init__(self, backend_id: str, fingerprint: str) -> None:
+        self.backend_id = backend_id
+        self.fingerprint = fingerprint
+        self.created = time.monotonic()
+
+
+class WarmPool(object):
+    """
+    Keeps idle instances of plans pre-created, so that provisioning one of them only takes a store write.
+
+    A plan gets a pool when the config of its manifest has a `warm_pool` entry:
+
+        {"warm_pool": {"size": 2, "ttl": 3600, "eviction": "replace"}}
+
+    - size: idle instances kept
+    - ttl: seconds an idle instance is kept before it is deleted, 0 to keep it until it is used
+    - eviction: 'replace' creates a new instance for each one deleted after its ttl; 'drain' only refills the
+      pool when the plan is provisioned, so that the pool of a plan that is not used empties itself
+
+    Pooled instances are created with their own backend id, which is kept in the context of the service
+    instance they are handed out as. Instances created from an older version of a manifest are not handed out,
+    and instances of backends that report readiness only join the pool once they are ready.
+
+    The backend ids of the pooled instances are kept in the store until they are handed out or deleted, so that
+    the ones left behind by a run that did not shut down cleanly are deleted by reap() on the next start.
+    """
+    REPLACE, DRAIN = 'replace', 'drain'
+    BACKEND_REF = 'warm_pool'  # backend under which the store keeps the manifest type of each pooled instance
+
+    def __init__(self, rm, workers: int, store=None) -> None:
+        self.rm = rm
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='esm-warm-pool')
+        self.idle = dict()  # manifest id -> deque of PooledInstance, oldest first
+        self.creating = dict()  # manifest id -> instances being created
+        self.demand = dict()  # manifest id -> provisions since the pool was last refilled
+        self.manifests = dict()  # manifest id -> Manifest the pool was last maintained with
+        self.acquired = dict()  # backend id -> (Manifest, PooledInstance) handed out, until claimed or released
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+
+    @staticmethod
+    def settings(mani: Manifest):
+        conf = mani.config.get('warm_pool') if isinstance(mani.config, dict) else None
+        if not conf or int(conf.get('size', 0)) <= 0:
+            return None
+        return {'size': int(conf['size']), 'ttl': float(conf.get('ttl', 0)),
+                'eviction': conf.get('eviction', WarmPool.REPLACE)}
+
+    @staticmethod
+    def fingerprint(mani: Manifest) -> str:
+        return hashlib.sha1((mani.manifest_type + mani.manifest_content).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _expired(pooled, settings):
+        return settings['ttl'] and time.monotonic() - pooled.created > settings['ttl']
+
+    def acquire(self, mani: Manifest):
+        """The backend id of an idle instance of the manifest, or None if there is none."""
+        settings = self.settings(mani)
+        if settings is None:
+            return None
+        fingerprint = self.fingerprint(mani)
+        stale = list()
+        backend_id = None
+        with self._lock:
+            idle = self.idle.get(mani.id, deque())
+            while idle:
+                pooled = idle.popleft()
+                if pooled.fingerprint == fingerprint and not self._expired(pooled, settings):
+                    backend_id = pooled.backend_id
+                    self.acquired[backend_id] = (mani, pooled)
+                    break
+                stale.append(pooled)
+            self.demand[mani.id] = self.demand.get(mani.id, 0) + 1
+            if backend_id is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for pooled in stale:
+            self.executor.submit(self._delete, mani.manifest_type, pooled.backend_id)
+        # replenish now rather than at the next interval
+        self._wake.set()
+        return backend_id
+
+    def claim(self, backend_id: str) -> None:
+        """An instance from acquire() is stored as a service instance, the pool no longer deletes it."""
+        with self._lock:
+            self.acquired.pop(backend_id, None)
+        self._forget(backend_id)
+
+    def release(self, backend_id: str) -> None:
+        """Takes back an instance from acquire() that could not be used, e.g. as its service instance was not stored."""
+        with self._lock:
+            mani, pooled = self.acquired.pop(backend_id)
+            if not self._stopped and mani.id in self.idle:
+                self.idle[mani.id].appendleft(pooled)
+                return
+        self._delete(mani.manifest_type, backend_id)
+
+    def maintain(self, manifests) -> None:
+        """Deletes stale idle instances and creates the missing ones, for all manifests."""
+        create, delete = list(), list()
+        with self._lock:
+            current = {mani.id: mani for mani in manifests}
+            for mani_id in list(self.idle):
+                if mani_id not in current or self.settings(current[mani_id]) is None:
+                    # the manifest is gone, or does not want a pool any more
+                    delete.extend((self.manifests[mani_id], p) for p in self.idle.pop(mani_id))
+                    self.demand.pop(mani_id, None)
+            for mani in current.values():
+                settings = self.settings(mani)
+                if settings is None:
+                    continue
+                self.manifests[mani.id] = mani
+                fingerprint = self.fingerprint(mani)
+                idle = self.idle.setdefault(mani.id, deque())
+                keep = deque(p for p in idle if p.fingerprint == fingerprint and not self._expired(p, settings))
+                evicted = [p for p in idle if p not in keep]
+                delete.extend((mani, p) for p in evicted)
+                while len(keep) > settings['size']:
+                    delete.append((mani, keep.pop()))
+                self.idle[mani.id] = keep
+
+                missing = settings['size'] - len(keep) - self.creating.get(mani.id, 0)
+                if settings['eviction'] == self.DRAIN:
+                    missing = min(missing, self.demand.get(mani.id, 0))
+                self.demand[mani.id] = 0
+                if missing > 0:
+                    self.creating[mani.id] = self.creating.get(mani.id, 0) + missing
+                    create.extend([mani] * missing)
+        for mani, pooled in delete:
+            self.executor.submit(self._delete, mani.manifest_type, pooled.backend_id)
+        for mani in create:
+            self.executor.submit(self._create, mani)
+
+    def _create(self, mani):
+        backend_id = 'pool-{}'.format(uuid.uuid4().hex)
+        pooled = PooledInstance(backend_id, self.fingerprint(mani))
+        reported = threading.Lock()
+
+        def on_state(state, description):
+            # once: from the readiness watch of the backend, or from here
+            if not reported.acquire(blocking=False):
+                return
+            if state != 'succeeded':
+                LOG.warning('The pooled instance {} of manifest {} failed: {}'.format(backend_id, mani.id,
+                                                                                     description))
+            self._created(mani, pooled, state == 'succeeded')
+
+        try:
+            # recorded first, so that it is found even if this run ends while it is created
+            self._record(backend_id, mani.manifest_type)
+            LOG.info('Creating the pooled instance {} of manifest {}'.format(backend_id, mani.id))
+            readiness = self.rm.reports_readiness_of(mani.manifest_type)
+            self.rm.create(instance_id=backend_id, content=mani.manifest_content, c_type=mani.manifest_type,
+                           on_state=on_state if readiness else None)
+        except Exception as e:
+            on_state('failed', 'could not be created: {}'.format(e))
+            return
+        if not readiness:
+            on_state('succeeded', 'created')
+
+    def _created(self, mani, pooled, ready):
+        with self._lock:
+            self.creating[mani.id] -= 1
+            if ready and not self._stopped and mani.id in self.idle:
+                self.idle[mani.id].append(pooled)
+                return
+        self._delete(mani.manifest_type, pooled.backend_id)
+
+    def _delete(self, manifest_type, backend_id):
+        try:
+            LOG.info('Deleting the pooled instance {}'.format(backend_id))
+            self.rm.delete(instance_id=backend_id, manifest_type=manifest_type)
+        except Exception as e:
+            # still recorded, so deleted again by the next reap()
+            LOG.warning('Could not delete the pooled instance {}: {}'.format(backend_id, e))
+            return
+        self._forget(backend_id)
+
+    def _record(self, backend_id, manifest_type):
+        if self.store is not None:
+            self.store.add_backend_ref(backend_id, self.BACKEND_REF, manifest_type)
+
+    def _forget(self, backend_id):
+        if self.store is None:
+            return
+        try:
+            self.store.delete_backend_ref(backend_id, self.BACKEND_REF)
+        except Exception as e:
+            LOG.warning('Could not remove the pooled instance {} from the store: {}'.format(backend_id, e))
+
+    def reap(self) -> None:
+        """Deletes the pooled instances recorded in the store by an earlier run that did not delete them."""
+        if self.store is None:
+            return
+        recorded = self.store.get_backend_refs(self.BACKEND_REF)
+        if not recorded:
+            return
+        # handed out just before that run ended, but not yet forgotten
+        in_use = {inst.context.get('backend_id') for inst in self.store.get_service_instance()}
+        for backend_id, manifest_type in recorded.items():
+            if backend_id in in_use:
+                self._forget(backend_id)
+            else:
+                LOG.info('Reaping the pooled instance {} left by an earlier run'.format(backend_id))
+                self._delete(manifest_type, backend_id)
+
+    def start(self, manifests, interval: float) -> None:
+        """
+        Reaps the instances of an earlier run, then maintains the pools of the manifests returned by manifests()
+        every interval seconds, and on demand.
+        """
+        def run():
+            try:
+                self.reap()
+            except Exception as e:
+                LOG.warning('Could not reap the pooled instances of an earlier run: {}'.format(e))
+            while not self._stopped:
+                try:
+                    self.maintain(manifests())
+                except Exception as e:
+                    LOG.warning('Could not maintain the warm pools: {}'.format(e))
+                self._wake.wait(interval)
+                self._wake.clear()
+
+        threading.Thread(target=run, name='esm-warm-pool-maintainer', daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'pools': {mani_id: {'idle': len(idle), 'creating': self.creating.get(mani_id, 0)}
+                              for mani_id, idle in self.idle.items()}}
+
+    def shutdown(self) -> None:
+        """Deletes the idle instances; the ones being created are deleted once they are."""
+        with self._lock:
+            self._stopped = True
+            idle, self.idle = self.idle, dict()
+        self._wake.set()
+        for mani_id, pooled in ((m, p) for m, instances in idle.items() for p in instances):
+            self.executor.submit(self._delete, self.manifests[mani_id].manifest_type, pooled.backend_id)
+        self.executor.shutdown(wait=True)
+
+
+POOL = WarmPool(RM, workers=config.esm_pool_workers, store=STORE)
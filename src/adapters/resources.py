@@ -14,23 +14,27 @@
 #    under the License.
 
 import os
+import re
 import shutil
 from typing import Dict
 import yaml
 import tarfile
 import tempfile
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import docker
-# XXX these docker imports are internal and not supported to be used by external processes
-from compose.cli.main import TopLevelCommand
-from compose.cli.command import project_from_options
 
+from epm_client.api_client import ApiClient
 from epm_client.apis.package_api import PackageApi
 from epm_client.apis.resource_group_api import ResourceGroupApi
 
 import config
+from adapters import compose
+from adapters.k8s_cache import ClusterCache
 from adapters.log import get_logger, SentinelAgentInjector
+from adapters.store import STORE
 
 LOG = get_logger(__name__)
 
@@ -40,6 +44,10 @@ import itertools
 
 
 class DeployerBackend(object):
+    # True if create() reports when the instance is ready through its on_state(state, description) callback,
+    # rather than the instance being ready once create() returns
+    reports_readiness = False
+
     def create(self, instance_id: str, content: str, c_type: str, **kwargs) -> None:
         pass
 
@@ -52,6 +60,10 @@ class DeployerBackend(object):
     def is_ok(self, **kwargs) -> bool:
         pass
 
+    def warm(self, content: str, refresh: bool = False) -> None:
+        """Prepares the backend for instances of a manifest ahead of time, e.g. by pulling its images."""
+        pass
+
     def _reconcile_state(self, info):
         states = set([v for k, v in info.items() if k.endswith('state')])
         # states from compose.container.Container: 'Paused', 'Restarting', 'Ghost', 'UpUp', 'Exit %s'
@@ -73,42 +85,114 @@ class DeployerBackend(object):
                 info['srv_inst.state.description'] = 'The service instance has been created successfully'
 
 
+class ImageWarmer(object):
+    """
+    Pulls the images of docker-compose manifests in the background, up to `workers` at a time, so that
+    provisioning finds them on the host. An image is pulled once when a manifest using it is stored and
+    refreshed when the registered manifests are warmed periodically. The status of every image is kept
+    for stats().
+    """
+    QUEUED, PULLING, READY, FAILED = 'queued', 'pulling', 'ready', 'failed'
+
+    def __init__(self, pull, workers: int) -> None:
+        self.pull = pull
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='esm-image-warmer')
+        self.images = dict()  # image -> {'status': ..., 'updated': time, 'seconds': ..., 'error': ...}
+        self.futures = dict()  # image -> Future of its current pull
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def images_of(content: str) -> set:
+        try:
+            project = compose.ComposeProject('warmer', yaml.safe_load(content))
+        except Exception as e:
+            LOG.warning('Cannot read the images of the manifest: {}'.format(e))
+            return set()
+        return {service.image for service in project.services.values()}
+
+    def warm(self, content: str, refresh: bool = False) -> list:
+        """Queues the pull of the images of a manifest that are not pulled yet, or all of them on refresh."""
+        queued = list()
+        with self._lock:
+            for image in sorted(self.images_of(content)):
+                status = self.images.get(image, {}).get('status')
+                if status in (self.QUEUED, self.PULLING) or (status == self.READY and not refresh):
+                    continue
+                self.images[image] = {**self.images.get(image, {}), 'status': self.QUEUED}
+                self.futures[image] = self.executor.submit(self._pull, image)
+                queued.append(image)
+        return queued
+
+    def _pull(self, image):
+        with self._lock:
+            self.images[image]['status'] = self.PULLING
+        started = time.monotonic()
+        try:
+            self.pull(image)
+            entry = {'status': self.READY, 'error': None}
+        except Exception as e:
+            LOG.warning('Could not pull the image {}: {}'.format(image, e))
+            entry = {'status': self.FAILED, 'error': str(e)}
+        with self._lock:
+            self.images[image].update(entry, updated=time.time(), seconds=round(time.monotonic() - started, 3))
+
+    def ready(self, image: str) -> bool:
+        """True if the image was pulled; waits for a pull of it that is already under way."""
+        with self._lock:
+            future = self.futures.get(image)
+        if future is not None and not future.done():
+            LOG.info('Waiting for the background pull of {}'.format(image))
+            future.result()
+        with self._lock:
+            return self.images.get(image, {}).get('status') == self.READY
+
+    def stats(self) -> dict:
+        with self._lock:
+            images = {image: dict(entry) for image, entry in self.images.items()}
+        counts = {status: 0 for status in (self.QUEUED, self.PULLING, self.READY, self.FAILED)}
+        for entry in images.values():
+            counts[entry['status']] += 1
+        return {'workers': self.workers, **counts, 'images': images}
+
+    def shutdown(self, wait=True) -> None:
+        self.executor.shutdown(wait=wait)
+
+
 class DockerBackend(DeployerBackend):  # pragma: docker NO cover
+    """
+    Runs docker compose manifests with the docker engine API. The manifest is parsed once into a ComposeProject;
+    its networks and containers are created directly and labelled with the instance id, so info() and delete()
+    find them with one label-filtered list call. Containers carry the docker-compose labels too.
+
+    Images are pulled, and services started, up to ESM_DOCKER_PARALLELISM at a time; a service is started
+    once the services it depends on are.
+    """
     def __init__(self) -> None:
         super().__init__()
         LOG.info('Adding DockerBackend')
-        self.options = {
-            "--no-deps": False,
-            "--abort-on-container-exit": False,  # do not set to True
-            "SERVICE": "",
-            "--remove-orphans": False,
-            "--no-recreate": True,
-            "--always-recreate-deps": False,
-            "--force-recreate": False,
-            "--build": False,
-            '--no-build': False,
-            '--no-color': False,
-            "--volumes": "/private",
-            "-d": True,  # currently with docker-compose 1.20.1 this is ignored! resolved by supplying --detach
-            "--detach": True,
-            "-q": False,  # quiet
-            "--scale": [],  # don't need this but have to supply
-        }
         self.manifest_cache = config.esm_dock_tmp_dir
+        self.projects = dict()  # instance_id -> ComposeProject
+        self.timings = dict()  # instance_id -> {service: {'pull': seconds, 'start': seconds}}
+        self._client = None
+        self.warmer = ImageWarmer(self._pull, workers=config.esm_dock_warm_workers)
+
+    @property
+    def client(self) -> docker.DockerClient:
+        if self._client is None:
+            self._client = docker.from_env()
+        return self._client
 
     def create(self, instance_id: str, content: str, c_type: str, **kwargs) -> None:
         """
-        This creates a set of containers using docker compose.
-        Note: the use of the docker compose python module is unsupported by docker inc.
+        This creates the networks and containers of a docker compose manifest.
         :param content: the docker compose file as a yaml string
         :return:
         """
         if c_type != 'docker-compose':
             raise NotImplementedError('The type ({type}) of cluster manager is unknown'.format(type=c_type))
 
-        # when we get the manifest, we have to dump it to a temporary file
-        # to allow for multiple stack instances we need to have multiple projects!
-        # this means multiple directories
+        # the final manifest is kept, so that the instance can be found again after a restart of the ESM
         mani_dir = self.manifest_cache + '/' + instance_id
 
         if not os.path.exists(mani_dir):
@@ -130,10 +214,6 @@ class DockerBackend(DeployerBackend):  # pragma: docker NO cover
         # add optionally supplied parameters as environment variables
         parameters = kwargs.get('parameters', dict())
         if parameters and len(parameters) > 0:
-            # if 'all' in parameters and len(parameters['all']) > 0:
-            #     LOG.warning('Common AND service specific environment variables not implemented at the moment')
-            # all_env_list = self.dict_to_list(parameters['all'])
-
             extra_env_list = self.dict_to_list(parameters)
 
             # update each service's env vars
@@ -141,28 +221,112 @@ class DockerBackend(DeployerBackend):  # pragma: docker NO cover
                 if k in parameters:
                     LOG.warning('Common AND service specific environment variables not implemented at the moment')
 
-                try:
+                if 'environment' in v:
                     # use a set to remove identical elements and convert back to a list
-                    v['environment'] = list(set(v['environment'] + extra_env_list))
-                    LOG.info('Updated set of environment variables for {svc} are: \n{env}'.format(svc=k, env=v['environment']))
-                except KeyError:
+                    v['environment'] = list(set(compose.as_list(v['environment']) + extra_env_list))
+                    LOG.info('Updated set of environment variables for %s are: \n%s', k, v['environment'])
+                else:
                     LOG.warning('There is no environment variables defined for {svc}'.format(svc=k))
                     v['environment'] = extra_env_list
-                    LOG.info(
-                        'New set of environment variables for {svc} are: \n{env}'.format(svc=k, env=v['environment']))
+                    LOG.info('New set of environment variables for %s are: \n%s', k, v['environment'])
+
+        project = compose.ComposeProject(instance_id, m, working_dir=mani_dir)
 
         LOG.debug('writing to: {compo}'.format(compo=mani_dir + '/docker-compose.yml'))
-        content = yaml.dump(m)
-        m = open(mani_dir + '/docker-compose.yml', 'wt')
-        m.write(content)
-        m.close()
+        with open(mani_dir + '/docker-compose.yml', 'wt') as mani_file:
+            yaml.dump(m, mani_file)
+        self.projects[instance_id] = project
+
+        timings = {name: dict() for name in project.services}
+        self.timings[instance_id] = timings
+        self._create_networks(project)
+        self._pull_images(project, timings)
+        self._start_services(project, timings)
+        LOG.info('Services of {} started: {}'.format(instance_id, ', '.join(
+            '{} (pull {:.1f}s, start {:.1f}s)'.format(name, t['pull'], t['start']) for name, t in timings.items())))
+
+    def _create_networks(self, project):
+        for name, args in project.networks.items():
+            if self.client.networks.list(names=[name]):
+                continue
+            if args is None:
+                raise Exception('The network {net} does not exist but is declared as external'.format(net=name))
+            LOG.debug('creating network %s', name)
+            self.client.networks.create(name, **args)
+
+    def _pull(self, image):
+        LOG.info('Pulling image {}'.format(image))
+        repository, _, tag = image.rpartition(':')
+        self.client.images.pull(repository, tag=tag)
+
+    def _pull_images(self, project, timings):
+        # each image once, even if several services use it
+        services = dict()
+        for service in project.services.values():
+            services.setdefault(service.image, []).append(service.name)
+
+        def pull(image):
+            started = time.monotonic()
+            if self.warmer.ready(image):
+                # pulled, or refreshed, in the background
+                pass
+            elif config.esm_dock_update_images == 'YES':
+                LOG.info('Updating {} to the version as defined in the manifest'.format(image))
+                self._pull(image)
+            else:
+                try:
+                    self.client.images.get(image)
+                except docker.errors.ImageNotFound:
+                    self._pull(image)
+            return time.monotonic() - started
+
+        with ThreadPoolExecutor(max_workers=config.esm_dock_parallelism, thread_name_prefix='esm-docker-pull') as pool:
+            for image, seconds in zip(services, pool.map(pull, services)):
+                for name in services[image]:
+                    timings[name]['pull'] = seconds
+
+    def _start_services(self, project, timings):
+        def start(service):
+            started = time.monotonic()
+            self._run_service(service)
+            return time.monotonic() - started
+
+        waiting = {name: set(service.depends_on) for name, service in project.services.items()}
+        started = set()
+        running = dict()  # future -> service name
+        with ThreadPoolExecutor(max_workers=config.esm_dock_parallelism, thread_name_prefix='esm-docker-up') as pool:
+            while waiting or running:
+                for name in [name for name, deps in waiting.items() if deps <= started]:
+                    del waiting[name]
+                    running[pool.submit(start, project.services[name])] = name
+                if not running:
+                    raise Exception('The services {} depend on each other'.format(sorted(waiting)))
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    # on an error no further services are started; the ones running are waited for
+                    timings[name]['start'] = future.result()
+                    started.add(name)
+
+    def _run_service(self, service):
+        api = self.client.api
+        networks = list(service.networks.items())
+        networking_config = None
+        if networks:
+            net, aliases = networks[0]
+            networking_config = api.create_networking_config({net: api.create_endpoint_config(aliases=aliases)})
+        args = dict(service.create_args(), host_config=api.create_host_config(**service.host_config),
+                    networking_config=networking_config)
+        try:
+            container = api.create_container(**args)
+        except docker.errors.ImageNotFound:
+            self._pull(service.image)
+            container = api.create_container(**args)
 
-        project = project_from_options(mani_dir, self.options)
-        cmd = TopLevelCommand(project)
-        if config.esm_dock_update_images == 'YES':
-            LOG.info('Updating all images to the version as defined in the manifest to the latest')
-            cmd.pull(self.options)  # TODO consider an updater thread that is ran over all registered manifests
-        cmd.up(self.options)
+        for net, aliases in networks[1:]:
+            api.connect_container_to_network(container['Id'], net, aliases=aliases)
+        api.start(container['Id'])
+        LOG.info('Started {} for service {}'.format(service.container_name, service.name))
 
     def dict_to_list(self, parameters):
         extra_env_list = list()
@@ -171,88 +335,107 @@ class DockerBackend(DeployerBackend):  # pragma: docker NO cover
             extra_env_list.append(k + '=' + v)
         return extra_env_list
 
+    def warm(self, content: str, refresh: bool = False) -> None:
+        if config.esm_dock_warm_images == 'YES':
+            self.warmer.warm(content, refresh=refresh)
+
+    def _project(self, instance_id):
+        project = self.projects.get(instance_id)
+        if project is None:
+            mani_dir = self.manifest_cache + '/' + instance_id
+            with open(mani_dir + '/docker-compose.yml') as mani_file:
+                project = compose.ComposeProject(instance_id, yaml.safe_load(mani_file), working_dir=mani_dir)
+            self.projects[instance_id] = project
+        return project
+
+    def _containers(self, instance_id, sparse=True):
+        containers = self.client.containers.list(all=True, sparse=sparse,
+                                                 filters={'label': compose.LABEL_INSTANCE + '=' + instance_id})
+        if not containers:
+            # instances created by docker-compose only carry its project label
+            containers = self.client.containers.list(
+                all=True, sparse=sparse,
+                filters={'label': compose.LABEL_PROJECT + '=' + compose.project_name(instance_id)})
+        return containers
+
+    @staticmethod
+    def _human_state(attrs):
+        # the states docker-compose reports, which _reconcile_state understands
+        state = attrs.get('State', '')
+        if state == 'running':
+            return 'Up'
+        if state in ('exited', 'dead'):
+            code = re.search(r'\((-?\d+)\)', attrs.get('Status', ''))
+            return 'Exit {}'.format(code.group(1) if code else -1)
+        return state.capitalize()
+
+    @staticmethod
+    def _published_ports(attrs):
+        # the list response has one entry per published port, inspect has the bindings of each container port
+        ports = dict()
+        for port in attrs.get('Ports') or []:
+            if 'PublicPort' in port:
+                ports.setdefault('{}/{}'.format(port['PrivatePort'], port.get('Type', 'tcp')), []).append(
+                    {'HostIp': port.get('IP', ''), 'HostPort': str(port['PublicPort'])})
+        return ports
+
+    @classmethod
+    def _flatten_attrs(cls, name, value, out, path=()):
+        # the keys docker-compose container attributes were flattened to, e.g. <name>_networksettings_ports_80/tcp
+        if isinstance(value, dict):
+            for k, v in value.items():
+                cls._flatten_attrs(name, v, out, path + (str(k),))
+        elif isinstance(value, str) or (isinstance(value, list) and value):
+            out[name + '_' + '_'.join(path).lower()] = str(value).strip()
+
     def info(self, instance_id: str, **kwargs) -> Dict[str, str]:
         mani_dir = self.manifest_cache + '/' + instance_id
-        LOG.debug('showing info for instance id {}, with DOCKER_COMPOSE backend...'.format(instance_id))
+        LOG.debug('showing info for instance id %s, with DOCKER_COMPOSE backend...', instance_id)
 
         if not os.path.exists(mani_dir):
             LOG.warning('requested directory does not exist: {mani_dir}'.format(mani_dir=mani_dir))
             return {}
 
-        LOG.debug('info from: {compo}'.format(compo=mani_dir + '/docker-compose.yml'))
-        project = project_from_options(mani_dir, self.options)
-        containers = project.containers(service_names=self.options['SERVICE'], stopped=True)
-
-        # rg = docker_handler.convert_to_resource_group(container_ids, resource_group_name=package_name)
-        # for id in container_ids:
-        #     container = client.containers.get(id)
-
+        project = self._project(instance_id)
         info = dict()
-        for c in containers:
+        for c in self._containers(instance_id):
+            attrs = c.attrs
             # basic info...
-            name = c.name
-            if name.endswith('_1'): name = c.name[0:-2]
-            info[name + '_image_name'] = c.image_config['RepoTags'][0]
-            info[name + '_image_id'] = c.image
-            info[name + '_net_name'] = c.dictionary["HostConfig"]["NetworkMode"]
-            info[name + '_cmd'] = c.human_readable_command
-            info[name + '_state'] = c.human_readable_state
-            info = {**info, **self.container_attrs(name, c.dictionary)}
-
-            # environment info...
-            for k, v in c.environment.items():
-                info[name + '_environment_' + k] = v
+            name = attrs['Names'][0].lstrip('/')
+            if name.endswith('_1'): name = name[0:-2]
+            info[name + '_id'] = attrs['Id']
+            info[name + '_image_name'] = attrs['Image']
+            info[name + '_image_id'] = attrs['ImageID']
+            info[name + '_net_name'] = attrs['HostConfig']['NetworkMode']
+            info[name + '_cmd'] = attrs['Command']
+            info[name + '_status'] = attrs['Status']
+            info[name + '_state'] = self._human_state(attrs)
+
+            # environment info, as given in the manifest...
+            service = project.services.get(attrs['Labels'].get(compose.LABEL_SERVICE,
+                                                               attrs['Labels'].get(compose.LABEL_COMPOSE_SERVICE)))
+            if service is not None:
+                for k, v in compose.as_dict(service.environment).items():
+                    info[name + '_environment_' + k] = v
+                for step, seconds in self.timings.get(instance_id, {}).get(service.name, {}).items():
+                    info['{}_{}_seconds'.format(name, step)] = '{:.3f}'.format(seconds)
 
             # ip address info...
             # add the IP address of the container, assumes there's only 1 IP address assigned to container
-            ip = [value.get('IPAddress') for value in c.dictionary['NetworkSettings']['Networks'].values()]
-            info[name + '_' + 'Ip'] = ip[0]
+            ip = [value.get('IPAddress') for value in attrs['NetworkSettings']['Networks'].values()]
+            info[name + '_' + 'Ip'] = ip[0] if ip else ''
+
+            # published ports and networks; the list response has no configured bindings, the published ones stand in
+            ports = self._published_ports(attrs)
+            self._flatten_attrs(name, {'NetworkSettings': {'Networks': attrs['NetworkSettings']['Networks'],
+                                                           'Ports': ports},
+                                       'HostConfig': {'PortBindings': ports}}, info)
 
         self._reconcile_state(info)
 
-        LOG.debug('Stack\'s attrs:')
-        LOG.debug(info)
+        LOG.debug('Stack\'s attrs: %s', info)
         return info
 
-    def container_attrs(self, name, data):
-        out = dict()
-        for x in data:
-            self._container_attrs(name, data, [x], out)
-        return out
-
-    def _container_attrs(self, name, data, names, out):
-        a = data
-        for x in names:
-            a = a[x]
-
-        if isinstance(a, str):
-            key = names[0]
-            for n in range(1, len(names)):
-                key += "_" + str(names[n])
-            out[name + '_'+ key.lower()] = str(a).strip()
-
-        if isinstance(a, list) and len(a) > 0:
-            if isinstance(a[0], str):
-                value = ""
-                key = names[0]
-                for n in range(1, len(names)):
-                    key += "_" + str(names[n])
-                for v in a:
-                    value += v + ";"
-                out[name + '_'+ key.lower()] = str(a).strip()
-            else:
-                key = names[0]
-                for n in range(1, len(names)):
-                    key += "_" + str(names[n])
-                out[name + '_'+ key.lower()] = str(a).strip()
-
-        if isinstance(a, dict):
-            for n in a:
-                new_names = []
-                new_names.extend(names)
-                new_names.append(n)
-                self._container_attrs(name, data, new_names, out)
-
     def delete(self, instance_id: str, **kwargs) -> None:
         mani_dir = self.manifest_cache + '/' + instance_id
 
@@ -265,14 +448,17 @@ class DockerBackend(DeployerBackend):  # pragma: docker NO cover
             LOG.info('Removing the Sentinel syslog logging agent')
             SentinelAgentInjector().remove(instance_id)
 
-        self.options["--force"] = True
-        self.options["--rmi"] = "none"
-        self.options['--timeout'] = config.esm_dock_del_timeout
         LOG.info('destroying: {compo} with timeout of: {timeout}'.format(compo=mani_dir + '/docker-compose.yml',
                                                                          timeout=config.esm_dock_del_timeout))
-        project = project_from_options(mani_dir, self.options)
-        cmd = TopLevelCommand(project)
-        cmd.down(self.options)
+        api = self.client.api
+        for c in self._containers(instance_id):
+            api.stop(c.id, timeout=int(config.esm_dock_del_timeout))
+            api.remove_container(c.id, force=True)
+        for net in self.client.networks.list(filters={'label': compose.LABEL_PROJECT + '=' +
+                                                      compose.project_name(instance_id)}):
+            net.remove()
+        self.projects.pop(instance_id, None)
+        self.timings.pop(instance_id, None)
 
         try:
             shutil.rmtree(mani_dir)
@@ -281,10 +467,9 @@ class DockerBackend(DeployerBackend):  # pragma: docker NO cover
             LOG.warning('Could not delete the directory {dir}'.format(dir=mani_dir))
 
     def is_ok(self, **kwargs):
-        client = docker.from_env()
         # this container should be small - this is 452 bytes
         # https://github.com/DieterReuter/dockerchallenge-smallest-image
-        container = client.containers.run("dieterreuter/hello", detach=True)
+        container = self.client.containers.run("dieterreuter/hello", detach=True)
         if not container:
             return False
         container.remove(force=True)
@@ -292,12 +477,41 @@ class DockerBackend(DeployerBackend):  # pragma: docker NO cover
 
 
 class EPMBackend(DeployerBackend):  # pragma: epm NO cover
-    def __init__(self) -> None:
+    BACKEND = 'epm'
+
+    def __init__(self, store=None) -> None:
         super().__init__()
         LOG.info('Adding EPMBackend')
-        self.sid_to_rgid = dict()  # TODO make this persistent... better that this done in the caller of the method
+        # the resource group of each instance is persisted in the store, so that it is still known after a
+        # restart; sid_to_rgid caches it
+        self.store = store
+        self.sid_to_rgid = dict()
         self.api_endpoint = config.esm_epm_api
         LOG.info('EPM API Endpoint: ' + self.api_endpoint)
+        # one client, and so one HTTP connection pool, for all calls
+        self.api_client = ApiClient(host=self.api_endpoint)
+        self.package_api = PackageApi(self.api_client)
+        self.resource_group_api = ResourceGroupApi(self.api_client)
+
+    def _record_rgid(self, instance_id: str, rgid: str) -> None:
+        if self.store is not None:
+            self.store.add_backend_ref(instance_id, self.BACKEND, rgid)
+        self.sid_to_rgid[instance_id] = rgid
+
+    def _rgid(self, instance_id: str) -> str:
+        rgid = self.sid_to_rgid.get(instance_id)
+        if rgid is None and self.store is not None:
+            refs = self.store.get_backend_ref(instance_id, self.BACKEND)
+            if refs:
+                rgid = self.sid_to_rgid[instance_id] = refs[0]
+        if rgid is None:
+            raise KeyError('No EPM resource group is known for the instance {}'.format(instance_id))
+        return rgid
+
+    def _forget_rgid(self, instance_id: str) -> None:
+        if self.store is not None:
+            self.store.delete_backend_ref(instance_id, self.BACKEND)
+        self.sid_to_rgid.pop(instance_id, None)
 
     def create(self, instance_id: str, content: str, c_type: str, **kwargs) -> None:
         super().create(instance_id, content, c_type, **kwargs)
@@ -328,15 +542,11 @@ class EPMBackend(DeployerBackend):  # pragma: epm NO cover
             tf.add(dirpath + 'metadata.yaml', arcname='metadata.yaml', recursive=False)
             tf.add(dirpath + 'docker-compose.yaml', arcname='docker-compose.yml', recursive=False)
 
-        package = PackageApi()
-        package.api_client.host = self.api_endpoint
-
         # submit service tar to EPM
-        pkg = package.receive_package(dirpath + "service.tar")
+        pkg = self.package_api.receive_package(dirpath + "service.tar")
 
         # record the service instance ID against the resource group ID returned by EPM
-        # TODO make persistent
-        self.sid_to_rgid[instance_id] = pkg.to_dict()['id']
+        self._record_rgid(instance_id, pkg.to_dict()['id'])
 
     def info(self, instance_id: str, **kwargs) -> Dict[str, str]:
         super().info(instance_id, **kwargs)
@@ -390,11 +600,7 @@ class EPMBackend(DeployerBackend):  # pragma: epm NO cover
         #            'netName': 'testid123_default',
         #            'poPName': '',
         #            'status': None}]}
-        rgrp = ResourceGroupApi()
-        rgrp.api_client.host = self.api_endpoint
-
-        # TODO better that sid_to_rgid done in the caller of the method
-        epm_info = rgrp.get_resource_group_by_id(id=self.sid_to_rgid[instance_id])
+        epm_info = self.resource_group_api.get_resource_group_by_id(id=self._rgid(instance_id))
 
         epm_info = epm_info.to_dict()
         info = dict()
@@ -436,20 +642,93 @@ class EPMBackend(DeployerBackend):  # pragma: epm NO cover
         super().delete(instance_id, **kwargs)
         # delete the resource group (created by package) by ID will remove the containers
         # XXX note this is a synchronous operation... potential for proxy timeouts
-        package = PackageApi()
-        package.api_client.host = self.api_endpoint
-        LOG.info('Deleting the package/resource group ID: ' + self.sid_to_rgid[instance_id])
-
-        # XXX better that this done in the caller of the method
-        package.delete_package(id=self.sid_to_rgid[instance_id])
+        rgid = self._rgid(instance_id)
+        LOG.info('Deleting the package/resource group ID: ' + rgid)
+        self.package_api.delete_package(id=rgid)
+        self._forget_rgid(instance_id)
 
     def is_ok(self, **kwargs):
         # TODO - call its health endpoint?
         return True
 
 
+class NamespaceReaper(object):
+    """
+    Follows the namespaces of deleted instances until kubernetes has removed them, checking every `interval`
+    seconds, and then calls `on_gone` with the namespace. A namespace still there after `timeout` seconds is
+    no longer followed, and passed to `on_timeout` if given; deleting the instance again asks for its deletion again.
+    """
+    def __init__(self, is_gone, on_gone, interval: float, timeout: float, on_timeout=None) -> None:
+        self.is_gone = is_gone
+        self.on_gone = on_gone
+        self.on_timeout = on_timeout
+        self.interval = interval
+        self.timeout = timeout
+        self.terminating = dict()  # namespace -> time its deletion was asked for
+        self.reaped = 0
+        self.timed_out = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, namespace: str) -> None:
+        with self._lock:
+            self.terminating[namespace] = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='esm-k8s-reaper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                namespaces = dict(self.terminating)
+            for namespace, since in namespaces.items():
+                try:
+                    gone = self.is_gone(namespace)
+                except Exception as e:
+                    LOG.warning('Could not check if the namespace {} is gone: {}'.format(namespace, e))
+                    gone = False
+                if gone:
+                    LOG.info('Namespace {} is gone after {:.1f}s'.format(namespace, time.monotonic() - since))
+                    try:
+                        self.on_gone(namespace)
+                    except Exception as e:
+                        LOG.warning('Could not clean up after the namespace {}: {}'.format(namespace, e))
+                elif time.monotonic() - since > self.timeout:
+                    LOG.warning('Namespace {} is still there {}s after its deletion'.format(namespace, self.timeout))
+                    if self.on_timeout is not None:
+                        try:
+                            self.on_timeout(namespace)
+                        except Exception as e:
+                            LOG.warning('Could not give up on the namespace {}: {}'.format(namespace, e))
+                else:
+                    continue
+                with self._lock:
+                    self.terminating.pop(namespace, None)
+                    if gone:
+                        self.reaped += 1
+                    else:
+                        self.timed_out += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'terminating': sorted(self.terminating), 'reaped': self.reaped, 'timed_out': self.timed_out}
+
+    def shutdown(self) -> None:
+        self._stopped = True
+        self._wake.set()
+
+
 class KubernetesBackend(DeployerBackend):
-    def __init__(self) -> None:
+    # the state of an instance is the worst of the states of its deployments
+    STATE_SEVERITY = {'succeeded': 0, 'in progress': 1, 'failed': 2}
+    # backend under which the store keeps the namespace of each instance being deleted
+    DELETION_REF = 'k8s_deletion'
+
+    def __init__(self, store=None) -> None:
         super().__init__()
         """
             If Kubernetes is being supported, the ESM is being deployed *within* K8s, so we can access
@@ -487,6 +766,18 @@ class KubernetesBackend(DeployerBackend):
         self.core_api_instance = kubernetes.client.CoreV1Api()  # services api
         self.extensions_api_instance = kubernetes.client.ExtensionsV1beta1Api()  # deployments api
         self.manifest_cache = config.esm_dock_tmp_dir
+        # instance_id -> list of the manifest items, parsed once on create (or on the first use after a restart)
+        self.manifests = dict()
+        self.reports_readiness = config.esm_k8s_watch_readiness == 'YES'
+        # the objects created by the ESM, kept current by list+watch; None reads them from the API server
+        self.cluster = None
+        # the namespaces being deleted are persisted in the store, so that a restart still reaps them
+        self.store = store
+        self.reaper = NamespaceReaper(self._namespace_gone, self._namespace_reaped,
+                                      interval=config.esm_k8s_reap_interval, timeout=config.esm_k8s_reap_timeout,
+                                      on_timeout=self._forget_deletion)
+        # deleted namespaces the cluster cache did not know, e.g. created before they were labelled
+        self.uncached_deletions = set()
 
     def get_kube_auth_token(self):
         """
@@ -562,48 +853,72 @@ class KubernetesBackend(DeployerBackend):
             else:
                 return True
 
-    def _delete(self, item, namespace: str = "default"):
-        if item['kind'].lower() == 'service':
-            name = item['metadata']['name']
-            item_description = 'Service \'{}\''.format(item['metadata']['name'])
-
-            try:
-                api_response = self.core_api_instance.delete_namespaced_service(
-                    name=name,
-                    namespace=namespace,
-                    body=kubernetes.client.V1DeleteOptions(
-                        propagation_policy='Foreground',
-                        grace_period_seconds=5))
-                LOG.info("Kubernetes {} deleted. status='{}'".format(item_description, str(api_response.status)))
-                return True
-
-            except BaseException as e:
-                LOG.error("Kubernetes Error: {} delete failed. response=".format(item_description, e))
-                return False
-
-        elif item['kind'].lower() == 'deployment':
-            name = item['metadata']['name']
-            item_description = 'Deployment \'{}\''.format(item['metadata']['name'])
-            try:
-                api_response = self.extensions_api_instance.delete_namespaced_deployment(
-                    name=name,
-                    namespace=namespace,
-                    body=kubernetes.client.V1DeleteOptions(
-                        propagation_policy='Foreground',
-                        grace_period_seconds=5))
-                LOG.info("Kubernetes {} deleted. status='{}'".format(item_description, str(api_response.status)))
-                return True
-
-            except BaseException as e:
-                LOG.error("Kubernetes Error: {} delete failed. response=".format(item_description, e))
-                return False
+    @staticmethod
+    def _flatten(manifests):
+        # the items of a List are deployed like top level ones
+        items = list()
+        for item in manifests:
+            if item['kind'].lower() == 'list':
+                items += KubernetesBackend._flatten(item['items'])
+            else:
+                items.append(item)
+        return items
+
+    def start_cluster_cache(self) -> None:
+        self.cluster = ClusterCache(self.core_api_instance, self.extensions_api_instance)
+        self.cluster.start()
+
+    def stop_cluster_cache(self) -> None:
+        if self.cluster is not None:
+            self.cluster.stop()
+
+    def cluster_stats(self) -> dict:
+        return self.cluster.stats() if self.cluster is not None else {}
+
+    def _deploy_all(self, items, namespace: str):
+        """Creates the items concurrently, services and deployments do not depend on each other. Returns how many
+        were created."""
+        workers = max(1, min(config.esm_k8s_parallelism, len(items)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='esm-k8s-create') as pool:
+            return sum(1 for ok in pool.map(lambda item: self._deploy(item, namespace), items) if ok)
+
+    def _watch_readiness(self, namespace: str, deployments, on_state):
+        """Calls on_state once all deployments are ready, or failed after ESM_K8S_READY_TIMEOUT seconds. The
+        deployments are followed with one watch stream on their namespace instead of polling each of them."""
+        def ready(deployment):
+            replicas = deployment.spec.replicas if deployment.spec.replicas is not None else 1
+            return (deployment.status.ready_replicas or 0) >= replicas
+
+        def run():
+            pending = set(deployments)
+            deadline = time.monotonic() + config.esm_k8s_ready_timeout
+            while pending and time.monotonic() < deadline:
+                watch = kubernetes.watch.Watch()
+                try:
+                    # the API server may end a stream early; a new one starts with the current deployments
+                    for event in watch.stream(self.extensions_api_instance.list_namespaced_deployment,
+                                              namespace=namespace,
+                                              timeout_seconds=max(1, int(deadline - time.monotonic()))):
+                        deployment = event['object']
+                        if event['type'] != 'DELETED' and ready(deployment):
+                            pending.discard(deployment.metadata.name)
+                        if not pending:
+                            watch.stop()
+                except Exception as e:
+                    LOG.warning('Watching the deployments of {} failed: {}'.format(namespace, e))
+                if pending:
+                    time.sleep(max(0, min(1, deadline - time.monotonic())))
+
+            if pending:
+                LOG.warning('Deployments {} of {} not ready after {}s'.format(
+                    sorted(pending), namespace, config.esm_k8s_ready_timeout))
+                on_state('failed', 'The deployments {} of the kubernetes service instance were not ready after '
+                                   '{}s'.format(sorted(pending), config.esm_k8s_ready_timeout))
+            else:
+                LOG.info('All deployments of {} are ready'.format(namespace))
+                on_state('succeeded', 'The kubernetes service instance has been created successfully')
 
-        elif item['kind'].lower() == 'list':
-            deployables = item['items']
-            for deployable in deployables:
-                self._delete(deployable)
-            return True
-        return False
+        threading.Thread(target=run, name='esm-k8s-ready-{}'.format(namespace), daemon=True).start()
 
     # def _update_names(self, manifests, instance_id):
     #     for i in range(len(manifests)):
@@ -676,7 +991,7 @@ class KubernetesBackend(DeployerBackend):
             LOG.info('Existing Manifest was found for this Instance ID under {}'.format(mani_dir))
             LOG.info("Polling the instance to see if it's alive...")
             info = self.info(instance_id)
-            LOG.info("Info retrieved: {}".format(info))
+            LOG.info("Info retrieved: %s", info)
 
             if self._is_instance_alive_from_info(info):
                     LOG.warning('Existing instance found. Exiting create...')
@@ -704,6 +1019,7 @@ class KubernetesBackend(DeployerBackend):
         LOG.info('Kubernetes Backend: Creating Service Instance \'{}\'...'.format(instance_id))
         outcome = False
         namespace = instance_id
+        on_state = kwargs.get('on_state') if self.reports_readiness else None
 
         if self.valid_data_received(instance_id, content):
             mani_dir, directory_created = self._create_directory(instance_id)
@@ -712,7 +1028,6 @@ class KubernetesBackend(DeployerBackend):
             if directory_created:
                 manifests = list(yaml.safe_load_all(content))
                 # LOG.info("Loaded YAML file {}".format(manifests))
-                successful_deployments = 0
 
                 # modify deployment and service names to include instance_id
                 # manifests = self._update_names(manifests, instance_id)
@@ -724,39 +1039,44 @@ class KubernetesBackend(DeployerBackend):
                     manifests = self._update_env_var(manifests, extra_env_list)
 
 
-                # save manifest
-                self._save_manifest_to_file(manifests, mani_path)
+                # label the items, so that the cluster cache picks them up
+                items = self._flatten(manifests)
+                for item in items:
+                    item['metadata'].setdefault('labels', dict())[compose.LABEL_INSTANCE] = instance_id
 
-                with open(mani_path) as f:
-                    # turn generator into list to be able to subscript and get length
-                    saved_manifests = list(itertools.chain.from_iterable(yaml.safe_load_all(f)))
-                    LOG.debug("\nReading saved manifest:\n{}".format(saved_manifests))
+                # save manifest, so that it can still be found after a restart, and keep the parsed items
+                self._save_manifest_to_file(manifests, mani_path)
+                self.manifests[instance_id] = manifests
 
-                    # create namespace
-                    namespace_exists = False
-                    try:
+                # create namespace
+                namespace_exists = self.cluster is not None and self.cluster.has_namespace(namespace)
+                try:
+                    if not namespace_exists:
                         namespace_exists = self.core_api_instance.read_namespace(namespace)
-                    except:
-                        LOG.warn('Namespace could not be found: {}...\nProceeding...'.format(namespace_exists))
+                except:
+                    LOG.warn('Namespace could not be found: {}...\nProceeding...'.format(namespace_exists))
 
-                    LOG.debug('Namespace exists: {}...'.format(namespace_exists))
-                    if not namespace_exists:
-                        self.core_api_instance.create_namespace(
-                        kubernetes.client.V1Namespace(metadata=kubernetes.client.V1ObjectMeta(name=namespace)))
+                LOG.debug('Namespace exists: {}...'.format(namespace_exists))
+                if not namespace_exists:
+                    self.core_api_instance.create_namespace(
+                    kubernetes.client.V1Namespace(metadata=kubernetes.client.V1ObjectMeta(
+                        name=namespace, labels={compose.LABEL_INSTANCE: instance_id})))
 
-                    # deploy manifest items
-                    for manifest in saved_manifests:
-                        successful_deployments += self._deploy(manifest, instance_id)
+                # deploy manifest items
+                successful_deployments = self._deploy_all(items, namespace)
 
-                # Note this comparison (<) will only verify that at least* as many things as different components
-                # in the YAML were deployed. if one is of kind: List, more will be deployed
-                # than it sees at first sight
-                if successful_deployments >= len(manifests):
+                if successful_deployments >= len(items):
                     LOG.info('Successfully deployed Service Instance \'{}\''.format(instance_id))
                     outcome = True
+                    if on_state is not None:
+                        self._watch_readiness(namespace, [item['metadata']['name'] for item in items
+                                                          if item['kind'].lower() == 'deployment'], on_state)
+                        on_state = None
                 else:
                     LOG.error('Kubernetes Error: Could not deploy.')
 
+        if on_state is not None:
+            on_state('failed', 'The kubernetes service instance could not be created')
         return outcome
 
     def _get_instance_status(self, info: dict, api_response):
@@ -799,16 +1119,13 @@ class KubernetesBackend(DeployerBackend):
                     info[name + '_environment_' + env_var.name] = env_var.value
         return info
 
-    def _get_info_service(self, cache):
-        item, manifests, instance_id, namespace = cache['item'], cache['manifests'], cache['instance_id'], cache['namespace']
+    def _get_info_service(self, item, instance_id, services):
         info = {}
 
         info['name_service'] = item['metadata']['name']
+        if item['metadata']['name'] not in services:
+            raise Exception('Service \'{}\' not found in namespace {}'.format(item['metadata']['name'], instance_id))
 
-        LOG.info("Querying info from namespaced_service...")
-        api_response = self.core_api_instance.read_namespaced_service(name=item['metadata']['name'],
-                                                                      namespace=namespace)
-        LOG.debug('API Response: {}'.format(api_response))
         # get IP
         ip = item['spec'].get('load_balancer_ip')
 
@@ -823,67 +1140,56 @@ class KubernetesBackend(DeployerBackend):
         info_ip_key = "{}_{}_Ip".format(instance_id, service_name)
         info[info_ip_key] = '{}:{}'.format(ip, item['spec']['node_port']) if ip is not None \
             else 'pending'
-
-        LOG.info("Querying info completed!")
         return info
 
-    def _get_info_deployment(self, cache):
-        item, manifests, instance_id, namespace = cache['item'], cache['manifests'], cache['instance_id'], cache[
-            'namespace']
+    def _get_info_deployment(self, item, instance_id, deployments):
         info = {}
 
         info['name_deployment'] = item['metadata']['name']
+        api_response = deployments.get(item['metadata']['name'])
+        if api_response is None:
+            raise Exception('Deployment \'{}\' not found in namespace {}'.format(item['metadata']['name'],
+                                                                                instance_id))
 
-        LOG.info("Querying info from namespaced_deployment...")
-        api_response = self.extensions_api_instance.read_namespaced_deployment(
-            name=item['metadata']['name'],
-            namespace=namespace)
-
-        LOG.info("Querying environment from each container described in Manifest...")
         for c in item['spec']['template']['spec']['containers']:
-            info['environment' + c['name']] = c['env']
+            info['environment' + c['name']] = c.get('env')
 
-        LOG.info("Querying instance status...")
         info = self._get_instance_status(info, api_response)
-
-        LOG.info("Querying container data...")
         info = self._get_container_data(info, api_response)
-
-        LOG.info("Querying info completed!")
-
         return info
 
     def get_info(self, manifests, instance_id):
-        cache = {
-            'manifests': manifests,
-            'instance_id': instance_id,
-            'namespace': instance_id, # TODO this might change in the future
-        }
+        namespace = instance_id  # TODO this might change in the future
         base_info = {'namespace_name': instance_id}  # TODO this might change in the future
 
         try:
-            for i in range(len(manifests)):
-                LOG.info('\nReading part {}/{} of manifests list... '.format(i, len(manifests)))
-                cache['item'] = manifests[i]
-
-                if cache['item']['kind'].lower() == 'service':
-                    LOG.debug('Kubernetes Backend: {} found in Manifest YAML.'.format('Service'))
-                    info = self._get_info_service(cache)
-
-                elif cache['item']['kind'].lower() == 'deployment':
-                    LOG.debug('Kubernetes Backend: {} found in Manifest YAML.'.format('Deployment'))
-                    info = self._get_info_deployment(cache)
-
-                elif cache['item']['kind'].lower() == 'list':
-                    LOG.debug('Kubernetes Backend: {} found in Manifest YAML.'.format('List'))
-                    list_base_info = {}
-                    deployables = cache['item']['items']
-                    for deployable in deployables:
-                        info = self.get_info([deployable], instance_id)
-                        list_base_info = {**list_base_info, **info}
-                    info = list_base_info
-
-                base_info = {**base_info, **info}
+            if self.cluster is not None and self.cluster.has_namespace(namespace):
+                deployments = self.cluster.deployments.get(namespace)
+                services = self.cluster.services.get(namespace)
+            else:
+                # one list call per kind for the whole namespace instead of one read per manifest item
+                LOG.info("Querying the deployments and services of namespace {}...".format(namespace))
+                deployments = {d.metadata.name: d for d in
+                               self.extensions_api_instance.list_namespaced_deployment(namespace=namespace).items}
+                services = {s.metadata.name: s for s in
+                            self.core_api_instance.list_namespaced_service(namespace=namespace).items}
+
+            state = None
+            for item in self._flatten(manifests):
+                kind = item['kind'].lower()
+                if kind == 'service':
+                    base_info.update(self._get_info_service(item, instance_id, services))
+
+                elif kind == 'deployment':
+                    info = self._get_info_deployment(item, instance_id, deployments)
+                    item_state = (info.pop('srv_inst.state.state'), info.pop('srv_inst.state.description'))
+                    if state is None or self.STATE_SEVERITY[item_state[0]] > self.STATE_SEVERITY[state[0]]:
+                        state = item_state
+                    base_info.update(info)
+
+            if state is not None:
+                base_info['srv_inst.state.state'], base_info['srv_inst.state.description'] = state
+            LOG.info("Querying info completed!")
         except BaseException as e:
             LOG.error('Could not read the instance\'s information, with error: {}'.format(e))
 
@@ -892,22 +1198,33 @@ class KubernetesBackend(DeployerBackend):
     def info(self, instance_id: str, **kwargs) -> Dict[str, str]:
         LOG.info('Kubernetes Backend: Querying info for Service Instance \'{}\'...'.format(instance_id))
 
-        mani_path, manifest_exists = self.get_manifest_path(instance_id)
+        manifests = self._manifests(instance_id)
         info = {'srv_inst.state.state': 'failed'}
 
-        if manifest_exists:
-            with open(mani_path) as f:
-                manifests = list(itertools.chain.from_iterable(yaml.safe_load_all(f)))
-                LOG.info("Loaded YAML file {}".format(manifests))
-                try:
-                    info = self.get_info(manifests, instance_id)
-                    LOG.info('Stack\'s attrs:\n{}'.format(info))
+        if manifests is not None:
+            try:
+                info = self.get_info(manifests, instance_id)
+                LOG.info('Stack\'s attrs:\n%s', info)
 
-                except ApiException as e:
-                    LOG.error("Exception when calling ExtensionsV1beta1Api->read_namespaced_deployment: %s\n" % e)
-                    # info = {}
+            except ApiException as e:
+                LOG.error("Exception when calling ExtensionsV1beta1Api->read_namespaced_deployment: %s\n" % e)
+                # info = {}
         return info
 
+    def _manifests(self, instance_id):
+        """The parsed manifest items of an instance, read from its saved manifest only if not cached yet."""
+        manifests = self.manifests.get(instance_id)
+        if manifests is None:
+            mani_path, manifest_exists = self.get_manifest_path(instance_id)
+            if not manifest_exists:
+                return None
+            with open(mani_path) as f:
+                # the items are saved as one YAML list
+                manifests = list(itertools.chain.from_iterable(yaml.safe_load_all(f)))
+            LOG.debug("Loaded YAML file %s", manifests)
+            self.manifests[instance_id] = manifests
+        return manifests
+
     def get_manifest_path(self, instance_id):
         mani_dir = self.manifest_cache + '/' + instance_id
         mani_path = mani_dir + '/manifest.yaml'
@@ -922,6 +1239,7 @@ class KubernetesBackend(DeployerBackend):
             return mani_path, False
 
     def delete_mani_dir(self, instance_id):
+        self.manifests.pop(instance_id, None)
         mani_dir = self.manifest_cache + '/' + instance_id
         try:
             shutil.rmtree(mani_dir)
@@ -942,38 +1260,79 @@ class KubernetesBackend(DeployerBackend):
             return outcome
 
         super().delete(instance_id)
-        mani_path, manifest_exists = self.get_manifest_path(instance_id)
-
-        # if IID manifest file exists, check it is alive
-        if manifest_exists:
-            LOG.info("Polling the instance to see if it's alive...")
-
-            info = self.info(instance_id)
-            LOG.info("Info retrieved: {}".format(info))
-
-            instance_exists = self._is_instance_alive_from_info(info)
-
-        # if IID is alive, proceed to delete
-        if instance_exists:
-            successful_deprovisions = 0
+        manifests = self._manifests(instance_id)
 
-            with open(mani_path) as f:
-                # turn generator into list to be able to subscript and get length
-                saved_manifests = list(itertools.chain.from_iterable(yaml.safe_load_all(f)))
-
-                # delete all components
-                for manifest in saved_manifests:
-                    successful_deprovisions += self._delete(item=manifest, namespace=namespace)
-
-                # delete directory
-                self.delete_mani_dir(instance_id)
+        if manifests is None:
+            LOG.warning('No instance found to be deleted. Attempting to delete old directory...')
+            self.delete_mani_dir(instance_id)
+            return outcome
 
-            outcome = True if successful_deprovisions >= len(saved_manifests) else False
+        # a namespace the cache does not know would be taken as gone by the reaper straight away
+        if self.cluster is None or not self.cluster.has_namespace(namespace):
+            self.uncached_deletions.add(namespace)
         else:
-            LOG.warning('No instance found to be deleted. Attempting to delete old directory...')
+            self.uncached_deletions.discard(namespace)
+
+        # deleting the namespace deletes everything in it, which kubernetes finishes in the background
+        try:
+            self.core_api_instance.delete_namespace(
+                name=namespace, body=kubernetes.client.V1DeleteOptions(propagation_policy='Background'))
+        except ApiException as e:
+            if e.status != 404:
+                LOG.error("Kubernetes Error: Namespace '{}' delete failed. response={}".format(namespace, e))
+                return outcome
+            LOG.warning('No namespace found to be deleted. Deleting the old directory...')
             self.delete_mani_dir(instance_id)
+            return outcome
+        except BaseException as e:
+            LOG.error("Kubernetes Error: Namespace '{}' delete failed. response={}".format(namespace, e))
+            return outcome
 
-        return outcome
+        # the saved manifest is deleted once the namespace is gone
+        LOG.info("Kubernetes Namespace '{}' is being deleted".format(namespace))
+        self.manifests.pop(instance_id, None)
+        self._record_deletion(instance_id, namespace)
+        self.reaper.add(namespace)
+        return True
+
+    def _record_deletion(self, instance_id: str, namespace: str) -> None:
+        if self.store is None:
+            return
+        try:
+            self.store.add_backend_ref(instance_id, self.DELETION_REF, namespace)
+        except Exception as e:
+            LOG.warning('Could not record the deletion of the namespace {}: {}'.format(namespace, e))
+
+    def _forget_deletion(self, namespace: str) -> None:
+        if self.store is not None:
+            # the namespace of an instance is its id
+            self.store.delete_backend_ref(namespace, self.DELETION_REF)
+
+    def _namespace_reaped(self, namespace: str) -> None:
+        self.delete_mani_dir(namespace)
+        self._forget_deletion(namespace)
+
+    def resume_deletions(self) -> None:
+        """Follows again the namespaces whose deletion was asked for by an earlier run, until they are gone."""
+        if self.store is None:
+            return
+        for instance_id, namespace in self.store.get_backend_refs(self.DELETION_REF).items():
+            LOG.info('Following the deletion of the namespace {} asked for by an earlier run'.format(namespace))
+            # not necessarily known to the cluster cache: checked against the API server
+            self.uncached_deletions.add(namespace)
+            self.reaper.add(namespace)
+
+    def _namespace_gone(self, namespace: str) -> bool:
+        if namespace not in self.uncached_deletions and self.cluster is not None and self.cluster.synced:
+            return not self.cluster.has_namespace(namespace)
+        try:
+            self.core_api_instance.read_namespace(namespace)
+        except ApiException as e:
+            if e.status == 404:
+                self.uncached_deletions.discard(namespace)
+                return True
+            raise
+        return False
 
     def is_ok(self, **kwargs):
         return True
@@ -1003,7 +1362,7 @@ class DummyBackend(DeployerBackend):
 
         self._reconcile_state(info)
 
-        LOG.info('Dummy data:\n{dummy}'.format(dummy=info))
+        LOG.debug('Dummy data:\n%s', info)
         return info
 
     def delete(self, instance_id: str, **kwargs) -> None:
@@ -1015,11 +1374,97 @@ class DummyBackend(DeployerBackend):
         return True
 
 
+class InfoCache(object):
+    """
+    Per-instance cache of info() results kept for ttl seconds. Concurrent misses on the same instance share
+    one fetch (single flight). Failed fetches are not cached. A ttl of 0 disables caching.
+    """
+
+    class _Flight(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.stale = False  # invalidated while fetching: the result is returned but not kept
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._entries = dict()  # instance id -> (expiry, info)
+        self._flights = dict()  # instance id -> _Flight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.invalidations = 0
+
+    def get(self, instance_id: str, fetch) -> Dict[str, str]:
+        if self.ttl <= 0:
+            with self._lock:
+                self.misses += 1
+            return fetch()
+
+        with self._lock:
+            entry = self._entries.get(instance_id)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.hits += 1
+                    return dict(entry[1])
+                del self._entries[instance_id]
+            flight = self._flights.get(instance_id)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._flights[instance_id] = InfoCache._Flight()
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return dict(flight.result)
+
+        try:
+            flight.result = fetch()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(instance_id) is flight:
+                    del self._flights[instance_id]
+                if flight.error is None and not flight.stale:
+                    self._entries[instance_id] = (time.monotonic() + self.ttl, flight.result)
+            flight.done.set()
+        return dict(flight.result)
+
+    def invalidate(self, instance_id: str) -> None:
+        with self._lock:
+            self._entries.pop(instance_id, None)
+            flight = self._flights.pop(instance_id, None)
+            if flight is not None:
+                flight.stale = True
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.shared
+            return {
+                'ttl': self.ttl,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared': self.shared,
+                'invalidations': self.invalidations,
+                'hit_ratio': round((self.hits + self.shared) / lookups, 4) if lookups else 0.0,
+            }
+
+
 class ResourceManager(DeployerBackend):
 
     def __init__(self) -> None:
         docker_backend = DockerBackend()
-        k8s_backend = KubernetesBackend()
+        k8s_backend = KubernetesBackend(store=STORE)
 
         self.backends = {
             'docker': docker_backend,
@@ -1027,17 +1472,28 @@ class ResourceManager(DeployerBackend):
             'kubernetes': k8s_backend,
             'k8s': k8s_backend,
             'dummy': DummyBackend(),
-            'epm': EPMBackend(),
+            'epm': EPMBackend(store=STORE),
         }
         # set an alias to the docker-compose driver
         # LOG.info('Adding docker-compose alias to DockerBackend')
         # self.backends['docker-compose'] = self.backends.get('docker')
         # LOG.info('Adding k8s alias to KubernetesBackend')
         # self.backends['k8s'] = self.backends.get('kubernetes')
+        self.info_cache = InfoCache(ttl=config.esm_info_cache_ttl)
+        self._stop_warming = threading.Event()
 
     def create(self, instance_id: str, content: str, c_type: str, **kwargs):
         be = self.backends.get(c_type, self.backends['dummy'])
-        be.create(instance_id, content, c_type, **kwargs)
+        on_state = kwargs.get('on_state')
+        if on_state is not None:
+            def state_changed(state, description):
+                self.info_cache.invalidate(instance_id)
+                on_state(state, description)
+            kwargs['on_state'] = state_changed
+        try:
+            be.create(instance_id, content, c_type, **kwargs)
+        finally:
+            self.info_cache.invalidate(instance_id)
 
     def info(self, instance_id: str, **kwargs) -> Dict[str, str]:
         if 'manifest_type' in kwargs:
@@ -1046,7 +1502,7 @@ class ResourceManager(DeployerBackend):
         else:
             raise RuntimeError('manifest_type parameter not specified in call to info()')
 
-        return be.info(instance_id, **kwargs)
+        return self.info_cache.get(instance_id, lambda: be.info(instance_id, **kwargs))
 
     def delete(self, instance_id: str, **kwargs):
         if 'manifest_type' in kwargs:
@@ -1055,7 +1511,43 @@ class ResourceManager(DeployerBackend):
         else:
             raise RuntimeError('manifest_type parameter not specified in call to info()')
 
-        be.delete(instance_id, **kwargs)
+        try:
+            be.delete(instance_id, **kwargs)
+        finally:
+            self.info_cache.invalidate(instance_id)
+
+    def warm(self, content: str, refresh: bool = False, **kwargs) -> None:
+        if 'manifest_type' in kwargs:
+            manifest_type = kwargs.get('manifest_type', 'dummy')
+            be = self.backends.get(manifest_type, self.backends['dummy'])
+        else:
+            raise RuntimeError('manifest_type parameter not specified in call to warm()')
+        be.warm(content, refresh=refresh)
+
+    def start_warming(self, manifests, interval: float) -> None:
+        """Warms the backends for all manifests returned by manifests() every interval seconds."""
+        def run():
+            while not self._stop_warming.wait(interval):
+                try:
+                    for mani in manifests():
+                        self.warm(mani.manifest_content, refresh=True, manifest_type=mani.manifest_type)
+                except Exception as e:
+                    LOG.warning('Could not warm the registered manifests: {}'.format(e))
+
+        if interval > 0:
+            threading.Thread(target=run, name='esm-warmer', daemon=True).start()
+
+    def stop_warming(self) -> None:
+        self._stop_warming.set()
+        self.backends['docker'].warmer.shutdown(wait=False)
+
+    def reports_readiness_of(self, manifest_type: str) -> bool:
+        """True if create() of the backend calls its on_state callback once the instance is ready."""
+        return self.backends.get(manifest_type, self.backends['dummy']).reports_readiness
+
+    def invalidate(self, instance_id: str) -> None:
+        """Drop the cached info() of an instance, e.g. after it was changed outside of create/delete."""
+        self.info_cache.invalidate(instance_id)
 
     def is_ok(self, **kwargs):
         if 'manifest_type' in kwargs:
@@ -14,8 +14,13 @@
 #    under the License.
 
 import json
+import threading
+import time
+from functools import wraps
 
 from orator import DatabaseManager, Schema
+from orator.connectors import MySQLConnector
+from orator.connectors.connection_factory import ConnectionFactory
 from orator import Model
 from orator.orm import belongs_to_many
 from orator.orm import belongs_to
@@ -42,6 +47,11 @@ from adapters.log import get_logger
 LOG = get_logger(__name__)
 
 
+class MissingReference(Exception):
+    """A model refers to a service or plan that is not in the DB."""
+    pass
+
+
 class LastOperationSQL(Model):  # pragma: sql NO cover
     __table__ = 'last_operation'
 
@@ -51,7 +61,6 @@ class LastOperationSQL(Model):  # pragma: sql NO cover
 
     def __init__(self):
         super(LastOperationSQL, self).__init__()
-        Model.set_connection_resolver(Helper().db)
 
     ''' 
         UPDATE WITH:
@@ -79,13 +88,13 @@ class LastOperationSQL(Model):  # pragma: sql NO cover
 
     @classmethod
     def table_exists(cls):
-        return Helper().schema.has_table(cls.__table__)
+        return Helper.has_table(cls.__table__)
 
     @classmethod
     def delete_all(cls):
-        if Helper().schema.has_table(cls.__table__):
+        if Helper.has_table(cls.__table__):
             # Helper().db.table(cls.__table__).truncate()
-            Helper().schema.drop_if_exists(cls.__table__)
+            Helper.drop_table(cls.__table__)
 
 
 class LastOperationAdapter(LastOperation):  # pragma: sql NO cover
@@ -107,6 +116,7 @@ class LastOperationAdapter(LastOperation):  # pragma: sql NO cover
         ''' STRINGS '''
         my_dict['state'] = model.state
         my_dict['description'] = model.description
+        my_dict['operation'] = model.operation
 
         return json.dumps(my_dict)
 
@@ -117,8 +127,9 @@ class LastOperationAdapter(LastOperation):  # pragma: sql NO cover
     # CAN NOT BE IMPLEMENTED - ServiceInstance.ID IS NOT STORED in LastOperation
 
     @staticmethod
-    def model_to_model_sql(instance_id: str, model: LastOperation):
-        instance_sql = ServiceInstanceAdapter.find_by_id_name(instance_id)
+    def model_to_model_sql(instance_id: str, model: LastOperation, instance_sql=None):
+        if instance_sql is None:
+            instance_sql = ServiceInstanceAdapter.find_by_id_name(instance_id)
 
         model_sql = LastOperationSQL()
         model_sql.instance_id = instance_sql.id
@@ -143,10 +154,9 @@ class LastOperationAdapter(LastOperation):  # pragma: sql NO cover
 
     @staticmethod
     def save(instance_id: str, model: LastOperation) -> LastOperationSQL:
-        model_sql = LastOperationSQL()
+        model_sql = LastOperationAdapter.find_by_id_name(instance_id, model)
         if model_sql:
             ''' OBJECTS '''
-            model_sql = LastOperationAdapter.find_by_id_name(instance_id, model)
             model_sql.state = model.state
             model_sql.description = model.description
             model_sql.save()
@@ -192,6 +202,67 @@ class LastOperationAdapter(LastOperation):  # pragma: sql NO cover
             return False
 
 
+class BackendRefSQL(Model):  # pragma: sql NO cover
+    """The id a backend knows an instance by, e.g. the resource group of an EPM instance."""
+    __table__ = 'backend_ref'
+
+    @classmethod
+    def create_table(cls):
+        with Helper().schema.create(cls.__table__) as table:
+            table.increments('id')
+            ''' STRINGS '''
+            # not a foreign key: pooled instances are not service instances (yet)
+            table.string('instance_id')
+            table.string('backend')
+            table.unique(['instance_id', 'backend'])
+            table.string('ref')
+            ''' DATES '''
+            table.datetime('created_at')
+            table.datetime('updated_at')
+
+    @classmethod
+    def table_exists(cls):
+        return Helper.has_table(cls.__table__)
+
+    @classmethod
+    def delete_all(cls):
+        if Helper.has_table(cls.__table__):
+            Helper.drop_table(cls.__table__)
+
+
+class BackendRefAdapter:  # pragma: sql NO cover
+    @staticmethod
+    def create_table():
+        if not BackendRefSQL.table_exists():
+            BackendRefSQL.create_table()
+
+    @staticmethod
+    def find(instance_id: str, backend: str) -> BackendRefSQL or None:
+        return BackendRefSQL.where('instance_id', '=', instance_id).where('backend', '=', backend).first()
+
+    @staticmethod
+    def find_all(backend: str) -> [BackendRefSQL]:
+        return BackendRefSQL.where('backend', '=', backend).get()
+
+    @staticmethod
+    def save(instance_id: str, backend: str, ref: str) -> BackendRefSQL:
+        model_sql = BackendRefSQL()
+        model_sql.instance_id = instance_id
+        model_sql.backend = backend
+        model_sql.ref = ref
+        # (instance_id, backend) is the only unique key, so concurrent saves cannot both insert
+        Helper.upsert(model_sql)
+        return model_sql
+
+    @staticmethod
+    def delete(instance_id: str, backend: str) -> None:
+        BackendRefSQL.where('instance_id', '=', instance_id).where('backend', '=', backend).delete()
+
+    @staticmethod
+    def delete_all() -> None:
+        BackendRefSQL.delete_all()
+
+
 '''    
     *******************
     *******************
@@ -217,7 +288,6 @@ class ServiceInstanceSQL(Model):  # pragma: sql NO cover
 
     def __init__(self):
         super(ServiceInstanceSQL, self).__init__()
-        Model.set_connection_resolver(Helper().db)
 
     ''' 
         UPDATE WITH:
@@ -248,13 +318,13 @@ class ServiceInstanceSQL(Model):  # pragma: sql NO cover
 
     @classmethod
     def table_exists(cls):
-        return Helper().schema.has_table(cls.__table__)
+        return Helper.has_table(cls.__table__)
 
     @classmethod
     def delete_all(cls):
-        if Helper().schema.has_table(cls.__table__):
+        if Helper.has_table(cls.__table__):
             # Helper().db.table(cls.__table__).truncate()
-            Helper().schema.drop_if_exists(cls.__table__)
+            Helper.drop_table(cls.__table__)
 
 
 class ServiceInstanceAdapter:  # pragma: sql NO cover
@@ -296,11 +366,14 @@ class ServiceInstanceAdapter:  # pragma: sql NO cover
         return cls.model_to_model_sql(model)
 
     @staticmethod
-    def model_sql_to_model(model_sql: ServiceInstanceSQL) -> ServiceInstance:
+    def model_sql_to_model(model_sql: ServiceInstanceSQL, service_types: dict = None) -> ServiceInstance:
         model = ServiceInstance()
         ''' OBJECT '''
-        service_sql = ServiceTypeAdapter.find_by_id_name(model_sql.service_id_name)
-        model.service_type = ServiceTypeAdapter.model_sql_to_model(service_sql)
+        if service_types is not None:
+            model.service_type = service_types.get(model_sql.service_id_name)
+        else:
+            service_sql = ServiceTypeAdapter.find_by_id_name(model_sql.service_id_name)
+            model.service_type = ServiceTypeAdapter.model_sql_to_model(service_sql)
         ''' OBJECT '''
         model.state = LastOperationAdapter.from_blob(model_sql.state)
         ''' OBJECT '''
@@ -323,22 +396,10 @@ class ServiceInstanceAdapter:  # pragma: sql NO cover
         id_name = ServiceInstanceAdapter.get_id(model)
         if not id_name:
             raise Exception('ID for given instance not found in Service Instance Context!')
-        model_sql = ServiceInstanceAdapter.find_by_id_name(id_name) or None
-        if model_sql:
-            ''' OBJECTS '''
-            service_sql = ServiceTypeAdapter.find_by_id_name(model.service_type.id)
-            model_sql.service_id = service_sql.id
-            model_sql.service_id_name = service_sql.id_name
-            ''' OBJECT '''
-            model_sql.state = LastOperationAdapter.to_blob(model.state)
-            ''' OBJECT '''
-            model_sql.context = Helper().to_blob(model.context)
-            model_sql.save()
-        else:
-            model_sql = ServiceInstanceAdapter.model_to_model_sql(model)
-            model_sql.save()
+        model_sql = ServiceInstanceAdapter.model_to_model_sql(model)
+        Helper.upsert(model_sql)
 
-        operation_sql = LastOperationAdapter.model_to_model_sql(id_name, model.state)
+        operation_sql = LastOperationAdapter.model_to_model_sql(id_name, model.state, model_sql)
         operation_sql.save()
 
         return model_sql
@@ -348,11 +409,10 @@ class ServiceInstanceAdapter:  # pragma: sql NO cover
         ServiceInstanceSQL.delete_all()
 
     @staticmethod
-    def delete(id_name: str) -> None:
-        model_sql = ServiceInstanceAdapter.find_by_id_name(id_name) or None
+    def delete(id_name: str, model_sql: ServiceInstanceSQL = None) -> None:
+        model_sql = model_sql or ServiceInstanceAdapter.find_by_id_name(id_name)
         if model_sql:
-            for operation in model_sql.operations:
-                operation.delete()
+            LastOperationSQL.where('instance_id', '=', model_sql.id).delete()
             model_sql.delete()
         else:
             raise Exception('model not found on DB to delete')
@@ -361,7 +421,9 @@ class ServiceInstanceAdapter:  # pragma: sql NO cover
     def get_all() -> [ServiceInstance]:
         model = ServiceInstanceSQL()
         models = [] or model.all()  # .serialize()
-        return [ServiceInstanceAdapter.model_sql_to_model(model) for model in models]
+        # load every referenced service type (and its plans) in one batch, not once per instance
+        service_types = ServiceTypeAdapter.find_by_id_names({model.service_id_name for model in models})
+        return [ServiceInstanceAdapter.model_sql_to_model(model, service_types) for model in models]
 
     @staticmethod
     def find_by_id_name(id_name: str) -> ServiceInstanceSQL or None:
@@ -394,6 +456,7 @@ class ServiceInstanceAdapter:  # pragma: sql NO cover
 
 class ManifestSQL(Model):  # pragma: sql NO cover
     __table__ = 'service_manifests'
+    PLAN_INDEX = 'service_manifests_plan_id_name_index'
 
     @belongs_to
     def service(self):
@@ -405,7 +468,6 @@ class ManifestSQL(Model):  # pragma: sql NO cover
 
     def __init__(self):
         super(ManifestSQL, self).__init__()
-        Model.set_connection_resolver(Helper().db)
 
     ''' 
         UPDATE WITH:
@@ -435,6 +497,7 @@ class ManifestSQL(Model):  # pragma: sql NO cover
             table.foreign('service_id').references('id').on('service_types')
             ''' FOREIGN KEY '''
             table.string('plan_id_name')
+            table.index('plan_id_name', cls.PLAN_INDEX)
             table.integer('plan_id').unsigned()
             table.foreign('plan_id').references('id').on('plans')
             ''' OBJECTS '''
@@ -445,12 +508,22 @@ class ManifestSQL(Model):  # pragma: sql NO cover
 
     @classmethod
     def table_exists(cls):
-        return Helper().schema.has_table(cls.__table__)
+        return Helper.has_table(cls.__table__)
+
+    @classmethod
+    def plan_index_exists(cls):
+        return bool(Helper.db.select('SHOW INDEX FROM {} WHERE Key_name = %s'.format(cls.__table__),
+                                     [cls.PLAN_INDEX]))
+
+    @classmethod
+    def create_plan_index(cls):
+        with Helper.schema.table(cls.__table__) as table:
+            table.index('plan_id_name', cls.PLAN_INDEX)
 
     @classmethod
     def delete_all(cls):
-        if Helper().schema.has_table(cls.__table__):
-            Helper().schema.drop_if_exists(cls.__table__)
+        if Helper.has_table(cls.__table__):
+            Helper.drop_table(cls.__table__)
 
 
 class ManifestAdapter:  # pragma: sql NO cover
@@ -459,6 +532,12 @@ class ManifestAdapter:  # pragma: sql NO cover
         if not ManifestSQL.table_exists():
             ManifestSQL.create_table()
 
+    @staticmethod
+    def create_plan_index():
+        # tables created before the index was introduced get it added here
+        if ManifestSQL.table_exists() and not ManifestSQL.plan_index_exists():
+            ManifestSQL.create_plan_index()
+
     @staticmethod
     def sample_model(name='manifest1') -> Manifest:
         model = Manifest()
@@ -487,13 +566,13 @@ class ManifestAdapter:  # pragma: sql NO cover
         # we are saving a manifest, so a service and a plan have to exist.
         service = ServiceTypeAdapter.find_by_id_name(model.service_id)
         if not service:
-            raise Exception('Bad Service ID provided')
+            raise MissingReference('Bad Service ID provided')
         model_sql.service_id = service.id
         ''' FOREIGN KEY '''
         model_sql.plan_id_name = model.plan_id
         plan = PlanAdapter.find_by_id_name(model.plan_id)
         if not plan:
-            raise Exception('Bad Plan ID provided')
+            raise MissingReference('Bad Plan ID provided')
         model_sql.plan_id = plan.id
         ''' OBJECTS '''
         model_sql.endpoints = Helper().to_blob(model.endpoints)
@@ -526,31 +605,8 @@ class ManifestAdapter:  # pragma: sql NO cover
 
     @staticmethod
     def save(model: Manifest) -> ManifestSQL:
-        model_sql = ManifestAdapter.find_by_id_name(model.id) or None
-        if model_sql:
-            ''' STRINGS '''
-            model_sql.id_name = model.id
-            LOG.warn('saving service with id: {}'.format(model.id))
-            model_sql.manifest_type = model.manifest_type
-            model_sql.manifest_content = model.manifest_content
-            ''' FOREIGN KEY '''
-            model_sql.service_id_name = model.service_id
-            service = ServiceTypeAdapter.find_by_id_name(model.service_id)
-            if not service:
-                raise Exception('Bad Service ID provided')
-            model_sql.service_id = service.id
-            ''' FOREIGN KEY '''
-            model_sql.plan_id_name = model.plan_id
-            plan = PlanAdapter.find_by_id_name(model.plan_id)
-            if not plan:
-                raise Exception('Bad Plan ID provided')
-            model_sql.plan_id = PlanAdapter.find_by_id_name(model.plan_id)
-            ''' OBJECTS '''
-            model_sql.endpoints = Helper().to_blob(model.endpoints)
-            model_sql.config = Helper().to_blob(model.config)
-        else:
-            model_sql = ManifestAdapter.model_to_model_sql(model)
-            model_sql.save()
+        model_sql = ManifestAdapter.model_to_model_sql(model)
+        Helper.upsert(model_sql)
         return model_sql
 
     @staticmethod
@@ -613,11 +669,10 @@ class PlanSQL(Model):  # pragma: sql NO cover
 
     def __init__(self):
         super(PlanSQL, self).__init__()
-        Model.set_connection_resolver(Helper().db)
 
     @classmethod
     def delete_all(cls):
-        if Helper().schema.has_table(cls.__table__):
+        if Helper.has_table(cls.__table__):
             Helper().db.table(cls.__table__).truncate()
 
     '''
@@ -653,7 +708,7 @@ class PlanSQL(Model):  # pragma: sql NO cover
 
     @classmethod
     def table_exists(cls):
-        return Helper().schema.has_table(cls.__table__)
+        return Helper.has_table(cls.__table__)
 
 
 class PlanAdapter:  # pragma: sql NO cover
@@ -711,21 +766,8 @@ class PlanAdapter:  # pragma: sql NO cover
 
     @staticmethod
     def save(model: Plan) -> PlanSQL:
-        model_sql = PlanAdapter.find_by_id_name(model.id) or None
-        if model_sql:
-            ''' STRINGS '''
-            model_sql.name = model.name
-            model_sql.id_name = model.id
-            model_sql.description = model.description
-            ''' BOOLEANS '''
-            model_sql.bindable = model.bindable
-            model_sql.free = model.free
-            ''' OBJECTS '''
-            model_sql.metadata = PlanMetadataAdapter.to_blob(model.metadata)
-            model_sql.update()
-        else:
-            model_sql = PlanAdapter.model_to_model_sql(model)
-            model_sql.save()
+        model_sql = PlanAdapter.model_to_model_sql(model)
+        Helper.upsert(model_sql)
         return model_sql
 
     @staticmethod
@@ -775,6 +817,7 @@ class PlanAdapter:  # pragma: sql NO cover
 
     @staticmethod
     def plans_from_service_sql(service_sql):
+        # served from the eager-loaded relation when the service was fetched with with_('plans')
         return [PlanAdapter.model_sql_to_model(plan_sql) for plan_sql in service_sql.plans.all()]
 
 
@@ -838,11 +881,10 @@ class ServiceTypeSQL(Model):  # pragma: sql NO cover
 
     def __init__(self):
         super(ServiceTypeSQL, self).__init__()
-        Model.set_connection_resolver(Helper().db)
 
     @classmethod
     def delete_all(cls):
-        if Helper().schema.has_table(cls.__table__):
+        if Helper.has_table(cls.__table__):
             Helper().db.table(cls.__table__).truncate()
 
     @classmethod
@@ -869,7 +911,7 @@ class ServiceTypeSQL(Model):  # pragma: sql NO cover
 
     @classmethod
     def table_exists(cls):
-        return Helper().schema.has_table(cls.__table__)
+        return Helper.has_table(cls.__table__)
 
 
 class PlanServiceTypeSQL(Model):  # pragma: sql NO cover
@@ -888,12 +930,12 @@ class PlanServiceTypeSQL(Model):  # pragma: sql NO cover
 
     @classmethod
     def table_exists(cls):
-        return Helper().schema.has_table(cls.__table__)
+        return Helper.has_table(cls.__table__)
 
     @classmethod
     def delete_all(cls):
-        if Helper().schema.has_table(cls.__table__):
-            Helper().schema.drop_if_exists(cls.__table__)
+        if Helper.has_table(cls.__table__):
+            Helper.drop_table(cls.__table__)
 
 
 class PlanServiceTypeAdapter:  # pragma: sql NO cover
@@ -920,6 +962,8 @@ class PlanServiceTypeAdapter:  # pragma: sql NO cover
 
 
 class ServiceTypeAdapter:  # pragma: sql NO cover
+    BATCH_SIZE = 1000  # max id_names per IN (...) query
+
     @staticmethod
     def create_table():
         if not ServiceTypeSQL.table_exists():
@@ -996,34 +1040,21 @@ class ServiceTypeAdapter:  # pragma: sql NO cover
 
     @staticmethod
     def save(model: ServiceType) -> ServiceTypeSQL:
-        model_sql = ServiceTypeAdapter.find_by_id_name(model.id) or None
-        plans_sql = []
-        if model_sql:
-            ''' STRINGS '''
-            model_sql.name = model.name
-            model_sql.id_name = model.id
-            model_sql.short_name = model.short_name
-            model_sql.description = model.description
-            ''' BOOLEANS '''
-            model_sql.bindable = model.bindable
-            model_sql.plan_updateable = model.plan_updateable
-            ''' LISTS '''
-            model_sql.tags = json.dumps(model.tags)
-            model_sql.requires = json.dumps(model.requires)
-            ''' OBJECTS '''
-            model_sql.metadata = ServiceMetadataAdapter.to_blob(model.metadata)
-            model_sql.dashboard_client = DashboardClientAdapter.to_blob(model.dashboard_client)
-            # update the associated plans
-            for plan_sql in model_sql.plans:
-                plan = PlanAdapter.model_sql_to_model(plan_sql)
-                PlanAdapter.save(plan)
-            model_sql.update()
-        else:
-            model_sql, plans_sql = ServiceTypeAdapter.model_to_model_sql(model)
-            model_sql.save()
-            for plan in plans_sql:
-                plan.save()
-                model_sql.plans().attach(plan)
+        model_sql, plans_sql = ServiceTypeAdapter.model_to_model_sql(model)
+        # name is unique too: the upsert would otherwise overwrite the service that has it
+        if ServiceTypeSQL.where('name', '=', model.name).where('id_name', '!=', model.id).count():
+            raise Exception('Service name \'{}\' is already used by another service'.format(model.name))
+        service_inserted = Helper.upsert(model_sql)
+        linked_ids = set() if service_inserted else {plan.id for plan in model_sql.plans}
+        plan_ids = set()
+        for plan_sql in plans_sql:
+            Helper.upsert(plan_sql)
+            plan_ids.add(plan_sql.id)
+        if plan_ids - linked_ids:
+            model_sql.plans().attach(list(plan_ids - linked_ids))
+        # plans dropped from the service are unlinked; their rows stay as manifests may refer to them
+        if linked_ids - plan_ids:
+            model_sql.plans().detach(list(linked_ids - plan_ids))
         return model_sql
 
     @staticmethod
@@ -1031,12 +1062,13 @@ class ServiceTypeAdapter:  # pragma: sql NO cover
         ServiceTypeSQL.delete_all()
 
     @staticmethod
-    def delete(id_name: str) -> None:
-        model_sql = ServiceTypeAdapter.find_by_id_name(id_name) or None
+    def delete(id_name: str, model_sql: ServiceTypeSQL = None) -> None:
+        model_sql = model_sql or ServiceTypeAdapter.find_by_id_name(id_name)
         if model_sql:
-            for plan in model_sql.plans:
-                model_sql.plans().detach(plan)
-                plan.delete()
+            plan_ids = [plan.id for plan in model_sql.plans]
+            if plan_ids:
+                model_sql.plans().detach(plan_ids)
+                PlanSQL.where_in('id', plan_ids).delete()
             model_sql.delete()
 
         else:
@@ -1044,10 +1076,20 @@ class ServiceTypeAdapter:  # pragma: sql NO cover
 
     @staticmethod
     def get_all() -> [ServiceType]:
-        model = ServiceTypeSQL()
-        models = [] or model.all()
+        models = ServiceTypeSQL.with_('plans').get()
         return [ServiceTypeAdapter.model_sql_to_model(model) for model in models]
 
+    @staticmethod
+    def find_by_id_names(id_names) -> dict:
+        """Map each of the given service id_names to its ServiceType, eager-loading plans."""
+        id_names = list(id_names)
+        services = {}
+        for i in range(0, len(id_names), ServiceTypeAdapter.BATCH_SIZE):
+            batch = id_names[i:i + ServiceTypeAdapter.BATCH_SIZE]
+            for model_sql in ServiceTypeSQL.with_('plans').where_in('id_name', batch).get():
+                services[model_sql.id_name] = ServiceTypeAdapter.model_sql_to_model(model_sql)
+        return services
+
     @staticmethod
     def find_by_id_name(id_name: str) -> ServiceTypeSQL or None:
         result = ServiceTypeSQL.where('id_name', '=', '{}'.format(id_name)).get()
@@ -1121,12 +1163,183 @@ class ServiceMetadataAdapter(ServiceMetadata):  # pragma: sql NO cover
 '''
 
 
+class PooledConnection:  # pragma: sql NO cover
+    """
+    Proxy around a DB-API connection checked out of a ConnectionPool. Closing it
+    hands the underlying connection back to the pool instead of closing the socket.
+    """
+    def __init__(self, pool, connection, created_at=None):
+        self._pool = pool
+        self._connection = connection
+        self.created_at = created_at or time.monotonic()
+        self.released_at = self.created_at
+
+    def close(self):
+        if self._connection is not None:
+            self._pool.release(self)
+
+    def __getattr__(self, item):
+        return getattr(self._connection, item)
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of DB-API connections. Idle connections are
+    health-checked with ping() before reuse and are discarded once they exceed
+    the idle timeout or the max lifetime. Callers wait at most wait_timeout
+    seconds for a free slot.
+    """
+    PING_AFTER = 5  # seconds idle before a connection is pinged on checkout
+
+    def __init__(self, creator, size=10, wait_timeout=30, idle_timeout=300, max_lifetime=3600):
+        self.creator = creator
+        self.size = size
+        self.wait_timeout = wait_timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._created = 0
+        self._closed = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def _expired(self, conn, now):
+        return now - conn.released_at > self.idle_timeout or now - conn.created_at > self.max_lifetime
+
+    def _healthy(self, conn, now):
+        if now - conn.released_at < self.PING_AFTER:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception as e:
+            LOG.debug('Discarding pooled connection that failed its health check: {}'.format(e))
+            return False
+
+    def _discard(self, conn):
+        self._closed += 1
+        try:
+            conn._connection.close()
+        except Exception:
+            pass
+        conn._connection = None
+
+    def acquire(self) -> PooledConnection:
+        start = time.monotonic()
+        deadline = start + self.wait_timeout
+        with self._cond:
+            while not self._idle and self._in_use >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception('Timed out after {}s waiting for a DB connection ({} in use)'.format(
+                        self.wait_timeout, self._in_use))
+                self._cond.wait(remaining)
+            waited = time.monotonic() - start
+            if waited > 0.001:
+                self._waits += 1
+                self._wait_time += waited
+                self._max_wait_time = max(self._max_wait_time, waited)
+            self._in_use += 1
+
+        now = time.monotonic()
+        while True:
+            with self._cond:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                break
+            if not self._expired(conn, now) and self._healthy(conn, now):
+                return conn
+            with self._cond:
+                self._discard(conn)
+
+        try:
+            conn = PooledConnection(self, self.creator())
+        except BaseException:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def release(self, conn: PooledConnection) -> None:
+        # hand out a fresh proxy next time so a stale reference can not release twice
+        fresh = PooledConnection(self, conn._connection, conn.created_at)
+        conn._connection = None
+        with self._cond:
+            self._in_use -= 1
+            fresh.released_at = time.monotonic()
+            if self._expired(fresh, fresh.released_at):
+                self._discard(fresh)
+            else:
+                self._idle.append(fresh)
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.pop())
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'size': self.size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'created': self._created,
+                'closed': self._closed,
+                'waits': self._waits,
+                'wait_time': round(self._wait_time, 6),
+                'max_wait_time': round(self._max_wait_time, 6)
+            }
+
+
+class PooledMySQLConnector(MySQLConnector):  # pragma: sql NO cover
+    """
+    orator connector that checks its DB-API connection out of Helper.pool. orator
+    closes the connection on disconnect(), which returns it to the pool.
+    """
+    def _do_connect(self, config):
+        return Helper.pool.acquire()
+
+
+class PooledConnectionFactory(ConnectionFactory):  # pragma: sql NO cover
+    CONNECTORS = dict(ConnectionFactory.CONNECTORS, mysql=PooledMySQLConnector)
+
+
+def release_connection(func):
+    """
+    Return the calling thread's orator connection to the pool once the outermost
+    decorated call finishes. Nested decorated calls share the same connection.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        local = Helper.local
+        local.depth = getattr(local, 'depth', 0) + 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            local.depth -= 1
+            if not local.depth:
+                Helper.release()
+    return wrapper
+
+
 class Helper:  # pragma: sql NO cover
     host = config.esm_sql_host
     port = config.esm_sql_port
     user = config.esm_sql_user
     password = config.esm_sql_password
     database = config.esm_sql_database
+    pool_size = config.esm_sql_pool_size
+    pool_wait_timeout = config.esm_sql_pool_wait_timeout
+    pool_idle_timeout = config.esm_sql_pool_idle_timeout
+    pool_max_lifetime = config.esm_sql_pool_max_lifetime
 
     config = {
         'mysql': {
@@ -1139,8 +1352,70 @@ class Helper:  # pragma: sql NO cover
             'port': port
         }
     }
-    db = DatabaseManager(config)
+    pool = ConnectionPool(
+        creator=lambda: MySQLConnector('mysql')._do_connect(Helper.config['mysql']),
+        size=pool_size,
+        wait_timeout=pool_wait_timeout,
+        idle_timeout=pool_idle_timeout,
+        max_lifetime=pool_max_lifetime
+    )
+    db = DatabaseManager(config, PooledConnectionFactory())
     schema = Schema(db)
+    local = threading.local()
+    known_tables = set()
+
+    @staticmethod
+    def release() -> None:
+        """Hand the calling thread's connection back to the pool, if it holds one."""
+        if Helper.db.get_connections():
+            Helper.db.disconnect()
+
+    @staticmethod
+    def pool_stats() -> dict:
+        return Helper.pool.stats()
+
+    @staticmethod
+    def has_table(table: str) -> bool:
+        """Like Schema.has_table, but remembers tables known to exist so callers can check on every write."""
+        if table not in Helper.known_tables and Helper.schema.has_table(table):
+            Helper.known_tables.add(table)
+        return table in Helper.known_tables
+
+    @staticmethod
+    def drop_table(table: str) -> None:
+        Helper.known_tables.discard(table)
+        Helper.schema.drop_if_exists(table)
+
+    @staticmethod
+    def upsert(model_sql: Model, unique_key: str = 'id_name') -> bool:
+        """
+        Write an unsaved model with a single INSERT ... ON DUPLICATE KEY UPDATE. The model gets the
+        primary key of the inserted or updated row and is marked as existing.
+        Returns True if a new row was inserted, False if an existing one was updated.
+        """
+        connection = Helper.db.connection()
+        grammar = connection.get_query_grammar()
+        now = model_sql.fresh_timestamp_string()
+        attributes = dict(model_sql.get_attributes())
+        attributes.setdefault(model_sql.CREATED_AT, now)
+        attributes[model_sql.UPDATED_AT] = now
+        columns = list(attributes)
+
+        updates = ['id = LAST_INSERT_ID(id)'] + [
+            '{col} = VALUES({col})'.format(col=grammar.wrap(column))
+            for column in columns if column not in (unique_key, model_sql.CREATED_AT)]
+        query = 'INSERT INTO {table} ({columns}) VALUES ({markers}) ON DUPLICATE KEY UPDATE {updates}'.format(
+            table=grammar.wrap_table(model_sql.get_table()),
+            columns=', '.join(grammar.wrap(column) for column in columns),
+            markers=', '.join([grammar.get_marker()] * len(columns)),
+            updates=', '.join(updates))
+        # MySQL reports 1 affected row for an insert and 2 for an update
+        affected = connection.affecting_statement(query, [attributes[column] for column in columns])
+
+        model_sql.id = connection.get_cursor().lastrowid
+        model_sql.set_exists(True)
+        model_sql.sync_original()
+        return affected == 1
 
     @staticmethod
     def to_blob(model) -> str:
@@ -1155,5 +1430,9 @@ class Helper:  # pragma: sql NO cover
             return temp
 
 
+# one resolver for every model, shared by all threads; connections come from Helper.pool
+Model.set_connection_resolver(Helper.db)
+
+
 if __name__ == "__main__":  # pragma: sql NO cover
    pass
\ No newline at end of file
@@ -18,7 +18,7 @@
 import config
 import pymysql
 import time
-from typing import List
+from typing import Dict, List
 
 
 if config.esm_mongo_host != '':
@@ -36,7 +36,11 @@ from adapters.sql_store import PlanServiceTypeAdapter
 from adapters.sql_store import ManifestAdapter
 from adapters.sql_store import ServiceInstanceAdapter
 from adapters.sql_store import LastOperationAdapter
+from adapters.sql_store import BackendRefAdapter
 from adapters.sql_store import ManifestSQL
+from adapters.sql_store import LastOperationSQL
+from adapters.sql_store import MissingReference
+from adapters.sql_store import release_connection
 
 
 # TODO implement exception handling
@@ -70,6 +74,7 @@ class Store(object):  # pragma: no cover
         raise NotImplementedError
 
     def get_manifest(self, manifest_id: str=None, plan_id: str=None) -> List[Manifest]:
+        # by plan_id every manifest of the plan is returned, [] if it has none
         raise NotImplementedError
 
     def delete_manifest(self, manifest_id: str=None) -> None:
@@ -84,6 +89,19 @@ class Store(object):  # pragma: no cover
     def get_last_operation(self, instance_id: str=None) -> List[LastOperation]:
         raise NotImplementedError
 
+    def add_backend_ref(self, instance_id: str, backend: str, ref: str) -> tuple:
+        raise NotImplementedError
+
+    def get_backend_ref(self, instance_id: str, backend: str) -> List[str]:
+        raise NotImplementedError
+
+    def delete_backend_ref(self, instance_id: str, backend: str) -> None:
+        raise NotImplementedError
+
+    def get_backend_refs(self, backend: str) -> Dict[str, str]:
+        # instance id -> reference, for all the instances of the backend
+        raise NotImplementedError
+
     def is_ok(self) -> bool:
         raise NotImplementedError
 
@@ -118,6 +136,7 @@ class SQLStore(Store):  # pragma: no cover
                 return None
 
     @staticmethod
+    @release_connection
     def set_up(wait_time=10):
         connection = SQLStore.get_connection()
         count = 3
@@ -136,17 +155,20 @@ class SQLStore(Store):  # pragma: no cover
             ServiceTypeAdapter.create_table()
             PlanServiceTypeAdapter.create_table()
             ManifestAdapter.create_table()
+            ManifestAdapter.create_plan_index()
             ServiceInstanceAdapter.create_table()
             LastOperationAdapter.create_table()
+            BackendRefAdapter.create_table()
             connection.close()
         else:
             raise Exception('Could not connect to the DB')
 
     @staticmethod
+    @release_connection
     def get_service(service_id: str=None) -> List[ServiceType]:
         if service_id:
-            if ServiceTypeAdapter.exists_in_db(service_id):
-                model_sql = ServiceTypeAdapter.find_by_id_name(service_id)
+            model_sql = ServiceTypeAdapter.find_by_id_name(service_id)
+            if model_sql:
                 model = ServiceTypeAdapter.model_sql_to_model(model_sql)
                 return [model]
             else:
@@ -155,24 +177,26 @@ class SQLStore(Store):  # pragma: no cover
             return ServiceTypeAdapter.get_all()
 
     @staticmethod
+    @release_connection
     def add_service(service: ServiceType) -> tuple:
-        if ServiceTypeAdapter.exists_in_db(service.id):
-            return 'The service already exists in the catalog.', 409
-
+        ''' Attempt to Create Table '''
+        ServiceTypeAdapter.create_table()
         PlanAdapter.create_table()
         PlanServiceTypeAdapter.create_table()
 
-        ServiceTypeAdapter.save(service)
         if ServiceTypeAdapter.exists_in_db(service.id):
-            return 'Service added successfully', 200
-        else:
-            return 'Could not save the Service in the DB', 500
+            return 'The service already exists in the catalog.', 409
+
+        ServiceTypeAdapter.save(service)
+        return 'Service added successfully', 200
 
     @staticmethod
+    @release_connection
     def delete_service(service_id: str = None) -> tuple:
         if service_id:
-            if ServiceTypeAdapter.exists_in_db(service_id):
-                ServiceTypeAdapter.delete(service_id)
+            model_sql = ServiceTypeAdapter.find_by_id_name(service_id)
+            if model_sql:
+                ServiceTypeAdapter.delete(service_id, model_sql)
                 return 'Service Deleted', 200
             else:
                 return 'Service ID not found', 500
@@ -187,20 +211,23 @@ class SQLStore(Store):  # pragma: no cover
             return 'Deleted all Services', 200
 
     @staticmethod
+    @release_connection
     def get_manifest(manifest_id: str = None, plan_id: str = None) -> List[Manifest]:
         if manifest_id and plan_id:
             raise Exception('Query Manifests only by manifest_id OR plan_id')
 
         if plan_id:
-            manifests = ManifestSQL.where('plan_id_name', '=', '{}'.format(plan_id)).get().serialize()
-            if len(manifests) > 1:
-                raise Exception('Too many manifests {mani_len} returned for the Plan: {plan_id}'.format(
-                    mani_len=len(manifests), plan_id=plan_id))
-            return [Manifest.from_dict(manifests[0])]
+            # served by the plan_id_name index; all manifests of the plan, callers decide what several mean
+            manifests = list()
+            for model_sql in ManifestSQL.where('plan_id_name', '=', '{}'.format(plan_id)).get():
+                model = ManifestAdapter.model_sql_to_model(model_sql)
+                model.manifest_content = model.manifest_content.replace('</br>', '\n')
+                manifests.append(model)
+            return manifests
 
         if manifest_id:
-            if ManifestAdapter.exists_in_db(manifest_id):
-                model_sql = ManifestAdapter.find_by_id_name(manifest_id)
+            model_sql = ManifestAdapter.find_by_id_name(manifest_id)
+            if model_sql:
                 model = ManifestAdapter.model_sql_to_model(model_sql)
                 model.manifest_content = model.manifest_content.replace('</br>', '\n')
                 return [model]
@@ -213,27 +240,31 @@ class SQLStore(Store):  # pragma: no cover
             return manifests
 
     @staticmethod
+    @release_connection
     def add_manifest(manifest) -> tuple:
-        if ManifestAdapter.exists_in_db(manifest.id):
-            return 'The Manifest already exists in the catalog.', 409
-
         ''' Attempt to Create Table '''
         PlanAdapter.create_table()
         ServiceTypeAdapter.create_table()
-        if ServiceTypeAdapter.exists_in_db(manifest.service_id) and PlanAdapter.exists_in_db(manifest.plan_id):
+        ManifestAdapter.create_table()
+
+        if ManifestAdapter.exists_in_db(manifest.id):
+            return 'The Manifest already exists in the catalog.', 409
+
+        try:
+            # resolves the Service and Plan foreign keys, raising MissingReference if either is missing
             ManifestAdapter.save(manifest)
-        else:
+        except MissingReference as e:
+            LOG.warning('Could not save the Manifest in the DB: {}'.format(e))
             return 'Could not save the Manifest in the DB, Plan and Service don\'t exist', 500
-        if ManifestAdapter.exists_in_db(manifest.id):
-            return 'Manifest added successfully', 200
-        else:
-            return 'Could not save the Manifest in the DB', 500
+        return 'Manifest added successfully', 200
 
     @staticmethod
+    @release_connection
     def delete_manifest(manifest_id: str = None):  # -> None:
         if manifest_id:
-            if ManifestAdapter.exists_in_db(manifest_id):
-                ManifestAdapter.delete(manifest_id)
+            model_sql = ManifestAdapter.find_by_id_name(manifest_id)
+            if model_sql:
+                model_sql.delete()
                 return 'Manifest Deleted', 200
             else:
                 return 'Manifest ID not found', 500
@@ -242,10 +273,11 @@ class SQLStore(Store):  # pragma: no cover
             return 'Deleted all Manifests', 200
 
     @staticmethod
+    @release_connection
     def get_service_instance(instance_id: str = None) -> List[ServiceInstance]:
         if instance_id:
-            if ServiceInstanceAdapter.exists_in_db(instance_id):
-                model_sql = ServiceInstanceAdapter.find_by_id_name(instance_id)
+            model_sql = ServiceInstanceAdapter.find_by_id_name(instance_id)
+            if model_sql:
                 model = ServiceInstanceAdapter.model_sql_to_model(model_sql)
                 return [model]
             else:
@@ -255,34 +287,27 @@ class SQLStore(Store):  # pragma: no cover
             return models
 
     @staticmethod
+    @release_connection
     def add_service_instance(instance: ServiceInstance) -> tuple:
-        id_name = ServiceInstanceAdapter.get_id(instance)
-        if ServiceInstanceAdapter.exists_in_db(id_name):
-            LOG.warning('An existing instance was attempted to be saved. Updating it...')
-            SQLStore.delete_service_instance(id_name)
-            # return 'The Instance already exists in the catalog.', 409
-
         ''' Attempt to Create Table '''
         PlanAdapter.create_table()
         ServiceTypeAdapter.create_table()
         ManifestAdapter.create_table()
         ServiceInstanceAdapter.create_table()
         LastOperationAdapter.create_table()
-        ServiceInstanceAdapter.save(instance)
 
-        id_name = ServiceInstanceAdapter.get_id(instance)
-        if ServiceInstanceAdapter.exists_in_db(id_name):
-            LOG.warning('Instance added successfully...')
-            return 'Instance added successfully', 200
-        else:
-            LOG.warning('Could not save the Instance in the DB...')
-            return 'Could not save the Instance in the DB', 500
+        # an existing instance is updated in place by the upsert
+        ServiceInstanceAdapter.save(instance)
+        LOG.debug('Instance added successfully...')
+        return 'Instance added successfully', 200
 
     @staticmethod
+    @release_connection
     def delete_service_instance(instance_id: str = None):  # -> None:
         if instance_id:
-            if ServiceInstanceAdapter.exists_in_db(instance_id):
-                ServiceInstanceAdapter.delete(instance_id)
+            model_sql = ServiceInstanceAdapter.find_by_id_name(instance_id)
+            if model_sql:
+                ServiceInstanceAdapter.delete(instance_id, model_sql)
                 return 'Instance Deleted', 200
             else:
                 return 'Instance ID not found', 500
@@ -292,19 +317,12 @@ class SQLStore(Store):  # pragma: no cover
             return 'Deleted all Instances', 200
 
     @staticmethod
-    def delete_last_operation(self, instance_id: str = None) -> None:
-        if instance_id:
-            self.ESM_DB.last_operations.delete_one({'id': instance_id})
-        else:
-            self.ESM_DB.last_operations.delete_many({})
-
-    @staticmethod
-    def get_last_operation(instance_id: str = None) -> List[ServiceInstance]:
+    @release_connection
+    def get_last_operation(instance_id: str = None) -> List[LastOperation]:
         if instance_id:
-            if ServiceInstanceAdapter.exists_in_db(instance_id):
-                model_sql = ServiceInstanceAdapter.find_by_id_name(instance_id)
-                model = ServiceInstanceAdapter.model_sql_to_model(model_sql)
-                return [model.state]
+            model_sql = ServiceInstanceAdapter.find_by_id_name(instance_id)
+            if model_sql:
+                return [LastOperationAdapter.from_blob(model_sql.state)]
             else:
                 return []
         else:
@@ -312,60 +330,82 @@ class SQLStore(Store):  # pragma: no cover
             return []
 
     @staticmethod
+    @release_connection
     def add_last_operation(instance_id: str, last_operation: LastOperation) -> tuple:
-        if ServiceInstanceAdapter.exists_in_db(instance_id):
-            instance = ServiceInstanceAdapter.find_by_id_name(instance_id)
-            ''' Attempt to Create Table '''
-            PlanAdapter.create_table()
-            ServiceTypeAdapter.create_table()
-            ServiceTypeAdapter.create_table()
-            ServiceInstanceAdapter.create_table()
-            LastOperationAdapter.create_table()
-            instance.state = last_operation
-            ServiceInstanceAdapter.save(instance)
-
-            id_name = ServiceInstanceAdapter.get_id(instance)
-            if ServiceInstanceAdapter.exists_in_db(id_name):
-                return 'Instance added successfully', 200
-            else:
-                return 'Could not save the Instance in the DB', 500
+        instance_sql = ServiceInstanceAdapter.find_by_id_name(instance_id)
+        if instance_sql:
+            instance_sql.state = LastOperationAdapter.to_blob(last_operation)
+            instance_sql.save()
+            LastOperationAdapter.model_to_model_sql(instance_id, last_operation, instance_sql).save()
+            return 'Instance added successfully', 200
         else:
             raise Exception('Service Instance not found')
 
     @staticmethod
-    def delete_last_operation(self, instance_id: str = None) -> tuple:
-        if ServiceInstanceAdapter.exists_in_db(instance_id):
-            instance = ServiceInstanceAdapter.find_by_id_name(instance_id)
-            ''' Attempt to Create Table '''
-            PlanAdapter.create_table()
-            ServiceTypeAdapter.create_table()
-            ServiceTypeAdapter.create_table()
-            ServiceInstanceAdapter.create_table()
-            LastOperationAdapter.create_table()
-            instance.state = None
-            ServiceInstanceAdapter.save(instance)
-
-            id_name = ServiceInstanceAdapter.get_id(instance)
-            if ServiceInstanceAdapter.exists_in_db(id_name):
-                return 'Instance added successfully', 200
+    @release_connection
+    def delete_last_operation(instance_id: str = None) -> tuple:
+        if instance_id:
+            instance_sql = ServiceInstanceAdapter.find_by_id_name(instance_id)
+            if instance_sql:
+                LastOperationSQL.where('instance_id', '=', instance_sql.id).delete()
+                return 'Last Operations Deleted', 200
             else:
-                return 'Could not save the Instance in the DB', 500
+                raise Exception('Service Instance not found')
         else:
-            raise Exception('Service Instance not found')
+            LastOperationAdapter.delete_all()
+            return 'Deleted all Last Operations', 200
+
+    @staticmethod
+    @release_connection
+    def add_backend_ref(instance_id: str, backend: str, ref: str) -> tuple:
+        BackendRefAdapter.save(instance_id, backend, ref)
+        return 'Backend reference added successfully', 200
+
+    @staticmethod
+    @release_connection
+    def get_backend_ref(instance_id: str, backend: str) -> List[str]:
+        model_sql = BackendRefAdapter.find(instance_id, backend)
+        return [model_sql.ref] if model_sql else []
+
+    @staticmethod
+    @release_connection
+    def delete_backend_ref(instance_id: str, backend: str) -> None:
+        BackendRefAdapter.delete(instance_id, backend)
+
+    @staticmethod
+    @release_connection
+    def get_backend_refs(backend: str) -> Dict[str, str]:
+        return {model_sql.instance_id: model_sql.ref for model_sql in BackendRefAdapter.find_all(backend)}
 
     def is_ok(self):
         try:
-            self.get_connection().ping()
+            connection = Helper.pool.acquire()
         except:
             return False
+        try:
+            connection.ping()
+        except:
+            return False
+        finally:
+            connection.close()
         return True
 
+    @staticmethod
+    def pool_stats() -> dict:
+        return Helper.pool_stats()
+
 
 class MongoDBStore(Store):  # pragma: no cover
 
     def __init__(self, host: str, port=27017) -> None:
         self.client = MongoClient(host, port)
         self.ESM_DB = self.client.esm
+        # manifests are looked up by plan on every provisioning request
+        self.ESM_DB.manifests.create_index('plan_id')
+        self.ESM_DB.manifests.create_index('id')
+        # last_operation polling reads operation state by instance
+        self.ESM_DB.last_operations.create_index('id', unique=True)
+        self.ESM_DB.backend_refs.create_index([('id', 1), ('backend', 1)], unique=True)
         LOG.info('Using the MongoDBStore.')
         LOG.info('MongoDBStore is persistent.')
 
@@ -427,18 +467,19 @@ class MongoDBStore(Store):  # pragma: no cover
             raise Exception('Query manifests only by manifest_id OR plan_id')
 
         if plan_id:
-            if self.ESM_DB.manifests.count({'plan_id': plan_id}) == 1:
-                m = self.ESM_DB.manifests.find_one({'plan_id': plan_id})
+            # all manifests of the plan, callers decide what several mean
+            manifests = []
+            for m in self.ESM_DB.manifests.find({'plan_id': plan_id}):
                 m = Manifest.from_dict(m)
                 LOG.debug("replacing <br/> with newlines")
                 m.manifest_content = m.manifest_content.replace('</br>', '\n')
-                return [m]
-            else:
+                manifests.append(m)
+            if not manifests:
                 LOG.warning('Requested manifest by plan ID not found: {id}'.format(id=plan_id))
-                return []
+            return manifests
         elif manifest_id:
-            if self.ESM_DB.manifests.count({'id': manifest_id}) == 1:
-                m = self.ESM_DB.manifests.find_one({'id': manifest_id})
+            m = self.ESM_DB.manifests.find_one({'id': manifest_id})
+            if m is not None:
                 m = Manifest.from_dict(m)
                 LOG.debug("replacing <br/> with newlines")
                 m.manifest_content = m.manifest_content.replace('</br>', '\n')
@@ -490,9 +531,8 @@ class MongoDBStore(Store):  # pragma: no cover
         if result == 1:
 
             LOG.info('A duplicate service instance was attempted to be stored. '
-                     'Updating the existing service instance {id}.'
-                     'Content supplied:\n{content}'.format(id=service_instance.context['id'],
-                                                           content=service_instance.to_str()))
+                     'Updating the existing service instance %s.'
+                     'Content supplied:\n%s', service_instance.context['id'], service_instance)
             # Update the service instance
 
             raw_svc_inst = self.ESM_DB.instances.find_one({'context.id': service_instance.context['id']})
@@ -525,19 +565,18 @@ class MongoDBStore(Store):  # pragma: no cover
             self.ESM_DB.instances.delete_many({})
 
     def add_last_operation(self, instance_id: str, last_operation: LastOperation) -> tuple:
-        result = self.ESM_DB.last_operations.insert_one({'id': instance_id, 'last_op': last_operation.to_dict()})
+        # one document per instance, replaced as the operation progresses
+        result = self.ESM_DB.last_operations.replace_one(
+            {'id': instance_id}, {'id': instance_id, 'last_op': last_operation.to_dict()}, upsert=True)
         if not result.acknowledged:
             return 'there was an issue saving the service status to the DB', 500
         return 'ok', 200
 
     def get_last_operation(self, instance_id: str=None) -> List[LastOperation]:
         if instance_id:
-            if self.ESM_DB.last_operations.count({'id': instance_id}) == 1:
-                return [
-                    LastOperation.from_dict(
-                        self.ESM_DB.last_operations.find_one({'id': instance_id})
-                    )
-                ]
+            lo = self.ESM_DB.last_operations.find_one({'id': instance_id})
+            if lo is not None:
+                return [LastOperation.from_dict(lo['last_op'])]
             else:
                 LOG.warning('Requested last operation not found: {id}'.format(id=instance_id))
                 return []
@@ -546,7 +585,7 @@ class MongoDBStore(Store):  # pragma: no cover
 
             for lo in self.ESM_DB.last_operations.find():
                 last_ops.append(
-                    LastOperation().from_dict(lo)
+                    LastOperation().from_dict(lo['last_op'])
                 )
 
             return last_ops
@@ -557,6 +596,23 @@ class MongoDBStore(Store):  # pragma: no cover
         else:
             self.ESM_DB.last_operations.delete_many({})
 
+    def add_backend_ref(self, instance_id: str, backend: str, ref: str) -> tuple:
+        result = self.ESM_DB.backend_refs.replace_one(
+            {'id': instance_id, 'backend': backend}, {'id': instance_id, 'backend': backend, 'ref': ref}, upsert=True)
+        if not result.acknowledged:
+            return 'there was an issue saving the backend reference to the DB', 500
+        return 'ok', 200
+
+    def get_backend_ref(self, instance_id: str, backend: str) -> List[str]:
+        ref = self.ESM_DB.backend_refs.find_one({'id': instance_id, 'backend': backend})
+        return [ref['ref']] if ref is not None else []
+
+    def delete_backend_ref(self, instance_id: str, backend: str) -> None:
+        self.ESM_DB.backend_refs.delete_one({'id': instance_id, 'backend': backend})
+
+    def get_backend_refs(self, backend: str) -> Dict[str, str]:
+        return {ref['id']: ref['ref'] for ref in self.ESM_DB.backend_refs.find({'backend': backend})}
+
     def is_ok(self):
         # basic but dependent (requires client) check
         return self.client.server_info()['ok'] == 1.0
@@ -574,43 +630,63 @@ class InMemoryStore(Store):  # pragma: no cover
     def __init__(self) -> None:
         LOG.info('Using the InMemoryStore.')
         LOG.warning('InMemoryStore is not persistent.')
+        # primary tables are keyed by entity id so that lookups, updates and deletes are O(1)
         self.ESM_DB = dict()
-        self.ESM_DB['services'] = list()
-        self.ESM_DB['instances'] = list()
-        self.ESM_DB['manifests'] = list()
-        self.ESM_DB['last_operations'] = list()
+        self.ESM_DB['services'] = dict()  # service_id -> ServiceType
+        self.ESM_DB['instances'] = dict()  # instance_id -> ServiceInstance
+        self.ESM_DB['manifests'] = dict()  # manifest_id -> Manifest
+        self.ESM_DB['last_operations'] = dict()  # instance_id -> {'id': instance_id, 'last_op': LastOperation}
+        self.ESM_DB['backend_refs'] = dict()  # (instance_id, backend) -> id of the instance in the backend
+        # secondary indexes
+        self.ESM_DB['manifests_by_plan'] = dict()  # plan_id -> {manifest_id: Manifest}
+        self.ESM_DB['instances_by_service'] = dict()  # service_id -> {instance_id: ServiceInstance}
         self.ESM_DB = self.DotDict(self.ESM_DB)
 
+    @staticmethod
+    def _index_add(index, key, entity_id, entity):
+        index.setdefault(key, dict())[entity_id] = entity
+
+    @staticmethod
+    def _index_remove(index, key, entity_id):
+        entries = index.get(key)
+        if entries is None:
+            return
+        entries.pop(entity_id, None)
+        if not entries:
+            del index[key]
+
+    @staticmethod
+    def _instance_service_id(service_instance):
+        if service_instance.service_type is None:
+            return None
+        return service_instance.service_type.id
+
     def get_service(self, service_id: str=None) -> List[ServiceType]:
         if not service_id:
             LOG.info('Returning registered services. Count: {count}'.format(count=len(self.ESM_DB.services)))
-            return self.ESM_DB.services
+            return list(self.ESM_DB.services.values())
         else:
-            return [s for s in self.ESM_DB.services if s.id == service_id]
+            service = self.ESM_DB.services.get(service_id)
+            return [service] if service is not None else []
 
     def add_service(self, service: ServiceType) -> None:
-        srv = [s for s in self.ESM_DB.services if s.id == service.id]
-        if len(srv) > 0:
-            LOG.info('Service to be updated with:\n{content}'.format(content=service.to_str()))
-            self.ESM_DB.services.remove(srv[0])
-            self.ESM_DB.services.append(service)
+        if service.id in self.ESM_DB.services:
+            LOG.info('Service to be updated with:\n%s', service)
         else:
-            self.ESM_DB.services.append(service)
             LOG.info('Adding a new service type to the catalog. '
-                     'Content supplied: {content}'.format(content=service.to_str()))
+                     'Content supplied: %s', service)
+        self.ESM_DB.services[service.id] = service
 
     def delete_service(self, service_id: str=None) -> None:
         if not service_id:
             LOG.warning('Deleting ALL registered service types in the catalog.')
-            self.ESM_DB.services = list()
+            self.ESM_DB.services = dict()
         else:
-            service_to_delete = [s for s in self.ESM_DB.services if s.id == service_id]
-            if len(service_to_delete) < 1:
+            service_to_delete = self.ESM_DB.services.pop(service_id, None)
+            if service_to_delete is None:
                 LOG.error('no service instance found.')
                 raise Exception('no service instance found.')
-            LOG.info('Deleting the service {id} from the catalog. Content:\n{content}'.format(
-                id=service_id, content=service_to_delete[0].to_str()))
-            self.ESM_DB.services.remove(service_to_delete[0])
+            LOG.info('Deleting the service %s from the catalog. Content:\n%s', service_id, service_to_delete)
 
     def valid_manifest_type(self, content, type):
         try:
@@ -627,125 +703,129 @@ class InMemoryStore(Store):  # pragma: no cover
 
     def add_manifest(self, manifest: Manifest) -> tuple:
 
-        m = [m for m in self.ESM_DB.manifests if m.id == manifest.id]
-
-        if len(m) == 0:
-            LOG.info('Manifest to be added with:\n{content}'.format(content=manifest.to_str()))
+        if manifest.id not in self.ESM_DB.manifests:
+            LOG.info('Manifest to be added with:\n%s', manifest)
 
             if not self.valid_manifest_type(manifest.manifest_content, manifest.manifest_type):
                 LOG.error("Incompatible manifest type and content.")
                 return 'the manifest has an incompatible type {}'.format(manifest.manifest_type), 400
 
-            # self.ESM_DB.manifests.remove(m[0])
-            self.ESM_DB.manifests.append(manifest)
+            self.ESM_DB.manifests[manifest.id] = manifest
+            self._index_add(self.ESM_DB.manifests_by_plan, manifest.plan_id, manifest.id, manifest)
             return 'ok', 200
         else:
             print('client side error - 4XX')
             error_msg = "The Manifest already exists in the catalog."
             LOG.warning(error_msg)
             return error_msg, 409
-            # self.ESM_DB.manifests.append(manifest)
-            # LOG.info('Adding a new service type to the catalog. '
-            #          'Content supplied: {content}'.format(content=manifest.to_str()))
 
     def get_manifest(self, manifest_id: str=None, plan_id: str=None) -> List[Manifest]:
         if manifest_id and plan_id:
             raise Exception('you can only query by manifest_id or plan_id!')
 
         if not plan_id and not manifest_id:
-            return self.ESM_DB.manifests
+            return list(self.ESM_DB.manifests.values())
         elif plan_id:
-            return [m for m in self.ESM_DB.manifests if m.plan_id == plan_id]
+            return list(self.ESM_DB.manifests_by_plan.get(plan_id, dict()).values())
         elif manifest_id:
-            return [m for m in self.ESM_DB.manifests if m.id == manifest_id]
+            manifest = self.ESM_DB.manifests.get(manifest_id)
+            return [manifest] if manifest is not None else []
         return []
 
     def delete_manifest(self, manifest_id: str=None) -> None:
         if not manifest_id:
             LOG.warning('Deleting ALL registered manifests in the catalog.')
-            self.ESM_DB.manifests = list()
+            self.ESM_DB.manifests = dict()
+            self.ESM_DB.manifests_by_plan = dict()
         else:
-            manifest_to_delete = [m for m in self.ESM_DB.manifests if m.id == manifest_id]
-            if len(manifest_to_delete) < 1:
+            manifest_to_delete = self.ESM_DB.manifests.pop(manifest_id, None)
+            if manifest_to_delete is None:
                 LOG.error('no manifest found.')
                 raise Exception('no manifest found.')
 
-            LOG.info('Deleting the manifest {id} from the catalog. Content:\n{content}'.format(
-                id=manifest_id, content=manifest_to_delete[0].to_str()))
-            self.ESM_DB.manifests.remove(manifest_to_delete[0])
+            self._index_remove(self.ESM_DB.manifests_by_plan, manifest_to_delete.plan_id, manifest_id)
+            LOG.info('Deleting the manifest %s from the catalog. Content:\n%s', manifest_id, manifest_to_delete)
 
     def add_service_instance(self, service_instance: ServiceInstance) -> None:
+        instance_id = service_instance.context['id']
+        existing = self.ESM_DB.instances.get(instance_id)
 
-        si = [si for si in self.ESM_DB.instances if si.context['id'] == service_instance.context['id']]
-
-        if len(si) > 0:
-            LOG.info('Service Instance to be updated with:\n{content}'.format(content=service_instance.to_str()))
-            self.ESM_DB.instances.remove(si[0])
-            self.ESM_DB.instances.append(service_instance)
+        if existing is not None:
+            LOG.info('Service Instance to be updated with:\n%s', service_instance)
+            self._index_remove(self.ESM_DB.instances_by_service, self._instance_service_id(existing), instance_id)
         else:
-            self.ESM_DB.instances.append(service_instance)
             LOG.info('Adding a new service instance. '
-                     'Content supplied: {content}'.format(content=service_instance.to_str()))
+                     'Content supplied: %s', service_instance)
+
+        self.ESM_DB.instances[instance_id] = service_instance
+        self._index_add(self.ESM_DB.instances_by_service, self._instance_service_id(service_instance),
+                        instance_id, service_instance)
 
     def get_service_instance(self, instance_id: str=None) -> List[ServiceInstance]:
         if not instance_id:
-            return self.ESM_DB.instances
+            return list(self.ESM_DB.instances.values())
         else:
-            return [i for i in self.ESM_DB.instances if i.context['id'] == instance_id]
+            instance = self.ESM_DB.instances.get(instance_id)
+            return [instance] if instance is not None else []
+
+    def get_service_instance_by_service(self, service_id: str) -> List[ServiceInstance]:
+        return list(self.ESM_DB.instances_by_service.get(service_id, dict()).values())
 
     def delete_service_instance(self, service_instance_id: str=None) -> None:
         if not service_instance_id:
             LOG.warning('Deleting ALL service instances in the catalog.')
-            self.ESM_DB.instances = list()
+            self.ESM_DB.instances = dict()
+            self.ESM_DB.instances_by_service = dict()
         else:
-            service_instance_to_delete = [si for si in self.ESM_DB.instances if si.context['id'] ==
-                                          service_instance_id][0]
-            LOG.info('Deleting the service instance {id} from the catalog. Content:\n{content}'.format(
-                id=service_instance_id, content=service_instance_to_delete.to_str()))
-            self.ESM_DB.instances.remove(service_instance_to_delete)
+            service_instance_to_delete = self.ESM_DB.instances.pop(service_instance_id, None)
+            if service_instance_to_delete is None:
+                LOG.error('no service instance found.')
+                raise Exception('no service instance found.')
+            self._index_remove(self.ESM_DB.instances_by_service,
+                               self._instance_service_id(service_instance_to_delete), service_instance_id)
+            LOG.info('Deleting the service instance %s from the catalog. Content:\n%s',
+                     service_instance_id, service_instance_to_delete)
 
     def add_last_operation(self, instance_id: str, last_operation: LastOperation) -> None:
-        last_op = {'id': instance_id, 'last_op': last_operation}
-
-        lo = [lo for lo in self.ESM_DB.last_operations if lo['id'] == instance_id]
-
-        if len(lo) > 0:
-            LOG.info('An existing last operation for service instance {id} is found. '
-                     'Updating with {content}'.format(id=instance_id, content=last_operation.to_str()))
-            lo[0]['last_op'].state = last_operation.state
-            lo[0]['last_op'].description = last_operation.description
+        if instance_id in self.ESM_DB.last_operations:
+            LOG.info('An existing last operation for service instance %s is found. '
+                     'Updating with %s', instance_id, last_operation)
         else:
-            self.ESM_DB.last_operations.append(last_op)
             LOG.info('Adding a new last operation. '
-                     'Content supplied: {content}'.format(content=str(last_op)))
-
-        # if last_op not in self.ESM_DB.last_operations:   # this check fails - need to search by instance.id
-        #     self.ESM_DB.last_operations.append(last_op)
-        # else:
-        #     LOG.info('An existing last operation for service instance {id} is found. '
-        #              'Updating with {content}'.format(id=instance_id, content=last_operation.to_str()))
-        #     lo = [lo for lo in self.ESM_DB.last_operations if lo['id'] == instance_id]
-        #     lo[0]['last_op'].state = last_operation.state
-        #     lo[0]['last_op'].description = last_operation.description
+                     'Content supplied: %s', last_operation)
+        self.ESM_DB.last_operations[instance_id] = {'id': instance_id, 'last_op': last_operation}
 
     def get_last_operation(self, instance_id: str=None) -> List[LastOperation]:
         if not instance_id:
-            return self.ESM_DB.last_operations
+            return [lo['last_op'] for lo in self.ESM_DB.last_operations.values()]
         else:
-            return [lo for lo in self.ESM_DB.last_operations if lo['id'] == instance_id]
+            lo = self.ESM_DB.last_operations.get(instance_id)
+            return [lo['last_op']] if lo is not None else []
 
     def delete_last_operation(self, instance_id: str=None) -> None:
         if not instance_id:
             LOG.warning('Deleting ALL last operations in the data store.')
-            self.ESM_DB.last_operations = list()
+            self.ESM_DB.last_operations = dict()
         else:
-            last_op_to_delete = [lo for lo in self.ESM_DB.last_operations if lo['id'] == instance_id]
-            if len(last_op_to_delete) < 1:
+            last_op_to_delete = self.ESM_DB.last_operations.pop(instance_id, None)
+            if last_op_to_delete is None:
                 LOG.error('no last_operation found.')
                 raise Exception('no last_operation found.')
-            LOG.info('Deleting the service {id} from the catalog. Content:\n{content}'.format(
-                id=instance_id, content=last_op_to_delete[0]))
-            self.ESM_DB.last_operations.remove(last_op_to_delete[0])
+            LOG.info('Deleting the service %s from the catalog. Content:\n%s', instance_id, last_op_to_delete)
+
+    def add_backend_ref(self, instance_id: str, backend: str, ref: str) -> tuple:
+        self.ESM_DB.backend_refs[(instance_id, backend)] = ref
+        return 'ok', 200
+
+    def get_backend_ref(self, instance_id: str, backend: str) -> List[str]:
+        ref = self.ESM_DB.backend_refs.get((instance_id, backend))
+        return [ref] if ref is not None else []
+
+    def delete_backend_ref(self, instance_id: str, backend: str) -> None:
+        self.ESM_DB.backend_refs.pop((instance_id, backend), None)
+
+    def get_backend_refs(self, backend: str) -> Dict[str, str]:
+        return {instance_id: ref for (instance_id, b), ref in self.ESM_DB.backend_refs.items() if b == backend}
 
     def is_ok(self):
         # no other logic needed - this store is in-memory
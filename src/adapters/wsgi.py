@@ -0,0 +1,112 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado
+from tornado import escape, httputil
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.wsgi import WSGIContainer
+
+from adapters.log import get_logger
+
+LOG = get_logger(__name__)
+
+
+class ThreadedWSGIContainer(WSGIContainer):
+    """
+    Serves a WSGI app like tornado's WSGIContainer, but runs the app on a pool of worker threads instead of
+    on the IOLoop thread. A slow request (e.g. a backend call) then only holds up its own worker, while the
+    IOLoop keeps accepting and answering the others.
+
+    The request handling follows tornado 6.2's WSGIContainer and relies on its environ() and _log(), hence the
+    pinned tornado version. tornado>=6.3 accepts an executor itself, but no longer supports python 3.7.
+    """
+    def __init__(self, wsgi_application, workers: int, name: str = 'esm-http') -> None:
+        super().__init__(wsgi_application)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        # requests accepted and not yet answered; only changed on the IOLoop thread
+        self.in_flight = 0
+        self.served = 0
+
+    def __call__(self, request: httputil.HTTPServerRequest) -> None:
+        self.in_flight += 1
+        IOLoop.current().spawn_callback(self._handle, request)
+
+    def _run_app(self, request: httputil.HTTPServerRequest):
+        data = {}
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            data['status'] = status
+            data['headers'] = headers
+            return response.append
+
+        environ = self.environ(request)
+        environ['wsgi.multithread'] = True
+        environ['wsgi.multiprocess'] = False
+        app_response = self.wsgi_application(environ, start_response)
+        try:
+            response.extend(app_response)
+        finally:
+            if hasattr(app_response, 'close'):
+                app_response.close()
+        if not data:
+            raise Exception('WSGI app did not call start_response')
+        return data['status'], data['headers'], b''.join(response)
+
+    async def _handle(self, request: httputil.HTTPServerRequest) -> None:
+        try:
+            try:
+                status, headers, body = await IOLoop.current().run_in_executor(self.executor, self._run_app,
+                                                                               request)
+            except Exception as e:
+                LOG.error('Error serving {} {}: {}'.format(request.method, request.uri, e), exc_info=True)
+                status, headers, body = '500 Internal Server Error', [], b'Internal Server Error'
+            self._write(request, status, headers, body)
+        except StreamClosedError:
+            LOG.warning('Client went away before {} {} was answered'.format(request.method, request.uri))
+        finally:
+            self.in_flight -= 1
+            self.served += 1
+
+    def _write(self, request, status, headers, body):
+        status_code_str, reason = status.split(' ', 1)
+        status_code = int(status_code_str)
+        header_set = set(k.lower() for (k, v) in headers)
+        body = escape.utf8(body)
+        if status_code != 304:
+            if 'content-length' not in header_set:
+                headers.append(('Content-Length', str(len(body))))
+            if 'content-type' not in header_set:
+                headers.append(('Content-Type', 'text/html; charset=UTF-8'))
+        if 'server' not in header_set:
+            headers.append(('Server', 'TornadoServer/%s' % tornado.version))
+
+        start_line = httputil.ResponseStartLine('HTTP/1.1', status_code, reason)
+        header_obj = httputil.HTTPHeaders()
+        for key, value in headers:
+            header_obj.add(key, value)
+        request.connection.write_headers(start_line, header_obj, chunk=body)
+        request.connection.finish()
+        self._log(status_code, request)
+
+    def shutdown(self, wait=True) -> None:
+        self.executor.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        return {'workers': self.workers, 'in_flight': self.in_flight, 'served': self.served}
@@ -28,15 +28,25 @@ auth_passwd = os.environ.get('ET_AAA_ESM_KEYSTONE_PASSWD', '')
 auth_tenant = os.environ.get('ET_AAA_ESM_KEYSTONE_TENANT', '')
 
 # adapters.generic
-# None
+esm_exec_workers = int(os.environ.get('ESM_EXECUTOR_WORKERS', 4))
+esm_exec_queue_size = int(os.environ.get('ESM_EXECUTOR_QUEUE_SIZE', 32))
+esm_exec_backend_limits = os.environ.get('ESM_EXECUTOR_BACKEND_LIMITS', 'docker=4,k8s=4,epm=2')
 
 # adapters.log
+esm_log_level = os.environ.get('ESM_LOG_LEVEL', 'DEBUG')
+esm_log_async = os.environ.get('ESM_LOG_ASYNC', 'YES')
+esm_log_rate_limit = float(os.environ.get('ESM_LOG_RATE_LIMIT', 0))
+esm_log_rate_burst = int(os.environ.get('ESM_LOG_RATE_BURST', 10))
 sen_kafka_ep = os.environ.get('ESM_SENTINEL_KAFKA_ENDPOINT', '')  # localhost:9092
 sen_topic = os.environ.get('ESM_SENTINEL_TOPIC', None)  # space
 sen_series = os.environ.get('ESM_SENTINEL_SERIES_NAME', None)
 sen_agent = os.environ.get('ESM_SENTINEL_AGENT', 'sentinel-internal-log-agent')
 sen_key_ser = os.environ.get('ESM_SENTINEL_KAFKA_KEY_SERIALIZER', 'StringSerializer')
 sen_val_ser = os.environ.get('ESM_SENTINEL_KAFKA_VALUE_SERIALIZER', 'StringSerializer')
+sen_kafka_linger_ms = int(os.environ.get('ESM_SENTINEL_KAFKA_LINGER_MS', 50))
+sen_kafka_batch_size = int(os.environ.get('ESM_SENTINEL_KAFKA_BATCH_SIZE', 16384))
+sen_kafka_close_timeout = float(os.environ.get('ESM_SENTINEL_KAFKA_CLOSE_TIMEOUT', 5))
+sen_queue_size = int(os.environ.get('ESM_SENTINEL_QUEUE_SIZE', 1000))
 
 # adapters.log syslog agent
 syslog_agent_sentinel_image = os.environ.get('ESM_SENTINEL_SYSLOG_AGENT_IMAGE', 'dizz/sen-syslog-agent:latest')
@@ -53,13 +63,36 @@ esm_hc_sen_series = os.environ.get('ESM_SENTINEL_SERIES_NAME', 'service-health-c
 esm_hc_sen_max_retries = os.environ.get('ESM_SENTINEL_MAX_RETRIES', '5')
 esm_hc_sen_hc_port = os.environ.get('ESM_SENTINEL_HEALTH_CHECK_PORT', '80')
 esm_hc_interval = os.environ.get('ESM_SENTINEL_HEALTH_CHECK_INTERVAL', 2)
+esm_hc_max_interval = float(os.environ.get('ESM_SENTINEL_HEALTH_CHECK_MAX_INTERVAL', 60))
+esm_hc_failure_threshold = int(os.environ.get('ESM_SENTINEL_HEALTH_CHECK_FAILURE_THRESHOLD', 5))
+esm_hc_workers = int(os.environ.get('ESM_SENTINEL_HEALTH_CHECK_WORKERS', 8))
+esm_hc_jitter = float(os.environ.get('ESM_SENTINEL_HEALTH_CHECK_JITTER', 0.1))
+esm_hc_timeout = float(os.environ.get('ESM_SENTINEL_HEALTH_CHECK_TIMEOUT', 5))
+esm_hc_history_size = int(os.environ.get('ESM_SENTINEL_HEALTH_HISTORY_SIZE', 1000))
+esm_hc_persist_interval = float(os.environ.get('ESM_SENTINEL_HEALTH_PERSIST_INTERVAL', 0))
+
+# adapters.pool
+esm_pool_workers = int(os.environ.get('ESM_WARM_POOL_WORKERS', 2))
+esm_pool_interval = float(os.environ.get('ESM_WARM_POOL_INTERVAL', 30))
 
 # adapters.resources
 esm_dock_tmp_dir = os.environ.get('ESM_TMP_DIR', tempfile.gettempdir())
 esm_dock_inject_logger = os.environ.get('ESM_SENTINEL_INJECT_LOGGER', False)
 esm_dock_update_images = os.environ.get('ESM_DOCKER_UPDATE_IMAGES', 'NO')
+esm_dock_parallelism = int(os.environ.get('ESM_DOCKER_PARALLELISM', 4))
+esm_dock_warm_images = os.environ.get('ESM_DOCKER_WARM_IMAGES', 'NO')
+esm_dock_warm_interval = float(os.environ.get('ESM_DOCKER_WARM_INTERVAL', 3600))
+esm_dock_warm_workers = int(os.environ.get('ESM_DOCKER_WARM_WORKERS', 2))
 esm_dock_del_timeout = os.environ.get('ESM_DOCKER_DELETE_TIMEOUT', 20)
+esm_k8s_parallelism = int(os.environ.get('ESM_K8S_PARALLELISM', 4))
+esm_k8s_watch_readiness = os.environ.get('ESM_K8S_WATCH_READINESS', 'YES')
+esm_k8s_ready_timeout = float(os.environ.get('ESM_K8S_READY_TIMEOUT', 600))
+esm_k8s_sync_ready_wait = float(os.environ.get('ESM_K8S_SYNC_READY_WAIT', 0))
+esm_k8s_cache = os.environ.get('ESM_K8S_CACHE', 'NO')
+esm_k8s_reap_interval = float(os.environ.get('ESM_K8S_REAP_INTERVAL', 5))
+esm_k8s_reap_timeout = float(os.environ.get('ESM_K8S_REAP_TIMEOUT', 600))
 esm_epm_api = os.environ.get('ET_EPM_API', 'http://localhost:8180/') + 'v1'
+esm_info_cache_ttl = float(os.environ.get('ESM_INFO_CACHE_TTL', 5))
 
 # adapters.sql_store
 esm_sql_host = os.environ.get('ESM_SQL_HOST', os.environ.get('ET_EDM_MYSQL_HOST', ''))
@@ -67,6 +100,10 @@ esm_sql_port = int(os.environ.get('ESM_SQL_PORT', os.environ.get('ET_EDM_MYSQL_P
 esm_sql_user = os.environ.get('ESM_SQL_USER', 'root')
 esm_sql_password = os.environ.get('ESM_SQL_PASSWORD', '')
 esm_sql_database = os.environ.get('ESM_SQL_DBNAME', 'mysql')  # TODO make this something other than mysql!
+esm_sql_pool_size = int(os.environ.get('ESM_SQL_POOL_SIZE', 10))
+esm_sql_pool_wait_timeout = float(os.environ.get('ESM_SQL_POOL_WAIT_TIMEOUT', 30))
+esm_sql_pool_idle_timeout = float(os.environ.get('ESM_SQL_POOL_IDLE_TIMEOUT', 300))
+esm_sql_pool_max_lifetime = float(os.environ.get('ESM_SQL_POOL_MAX_LIFETIME', 3600))
 
 # adapters.store
 esm_mongo_host = os.environ.get('ESM_MONGO_HOST', '')
@@ -74,12 +111,19 @@ esm_in_mem = os.environ.get('ESM_IN_MEM', 'YES')
 
 # esm.controllers
 esm_measure_insts = os.environ.get('ESM_MEASURE_INSTANCES', 'NO')
+esm_last_op_live_check = os.environ.get('ESM_LAST_OP_LIVE_CHECK', 'NO')
+esm_last_op_live_interval = int(os.environ.get('ESM_LAST_OP_LIVE_INTERVAL', 30))
+esm_retrieve_all_workers = int(os.environ.get('ESM_RETRIEVE_ALL_WORKERS', 8))
+esm_retrieve_all_timeout = float(os.environ.get('ESM_RETRIEVE_ALL_TIMEOUT', 10))
 
 # esm
 esm_bind_address = os.environ.get('ESM_IP', '0.0.0.0')
 esm_bind_port = os.environ.get('ESM_PORT', 8080)
 esm_check_ip = os.environ.get('ESM_CHECK_IP', '0.0.0.0')
 esm_check_port = os.environ.get('ESM_CHECK_PORT', 5001)
+esm_http_workers = int(os.environ.get('ESM_HTTP_WORKERS', 16))
+esm_check_workers = int(os.environ.get('ESM_CHECK_WORKERS', 2))
+esm_shutdown_timeout = float(os.environ.get('ESM_SHUTDOWN_TIMEOUT', 30))
 
 
 def print_env_vars():
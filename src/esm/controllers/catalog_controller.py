@@ -17,6 +17,7 @@ import connexion
 from flask import request, Response
 from functools import wraps
 
+from adapters.resources import RM
 from adapters.store import STORE
 from esm.controllers import _version_ok
 
@@ -147,6 +148,8 @@ def store_manifest(manifest_id, manifest):
         result, code = STORE.add_manifest(manifest)
 
         if code == 200:
+            # e.g. pull the images of the manifest before the first instance is provisioned
+            RM.warm(manifest.manifest_content, manifest_type=manifest.manifest_type)
             return Empty(), code
         else:
             return result, code
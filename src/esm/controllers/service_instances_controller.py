@@ -13,10 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import uuid
+
 import connexion
 
 import config
-from adapters.generic import AsychExe
+from adapters.generic import EXECUTOR
+from adapters.pool import POOL
 from adapters.store import STORE
 from adapters.resources import RM
 from adapters.auth import AUTH
@@ -38,6 +41,41 @@ from adapters.log import get_logger
 
 LOG = get_logger(__name__)
 
+RETRY_AFTER = 10  # seconds a client is asked to wait when the background queue is full
+
+
+def _manifest_type(plan_id=None, instance_id=None):
+    """
+    Manifest type behind a plan, or behind an existing instance when instance_id is given.
+    It selects the executor pool that an asynchronous operation runs on.
+    """
+    try:
+        if instance_id:
+            instance = STORE.get_service_instance(instance_id=instance_id)
+            manifest_id = instance[0].context.get('manifest_id') if instance else None
+            mani = STORE.get_manifest(manifest_id=manifest_id) if manifest_id else []
+        else:
+            mani = STORE.get_manifest(plan_id=plan_id) if plan_id else []
+    except Exception as e:
+        LOG.warning('Could not determine the manifest type: {}'.format(e))
+        return None
+    return mani[0].manifest_type if mani else None
+
+
+def _operation_id(kind):
+    return '{kind}-{id}'.format(kind=kind, id=uuid.uuid4().hex)
+
+
+def _submit(tasks, manifest_type, entity):
+    """
+    Runs tasks in the background and answers 202 with the id of the operation (entity['operation']), which
+    the tasks record in the store as they progress so that last_operation polls are answered from there.
+    """
+    operation = entity['operation']
+    if EXECUTOR.submit(tasks, backend=manifest_type, key=entity['entity_id'], operation=operation):
+        return LastOperation(state='in progress', description='operation accepted', operation=operation), 202
+    return 'Too many pending operations, retry later.', 429, {'Retry-After': str(RETRY_AFTER)}
+
 
 def create_service_instance(instance_id, service, accept_incomplete=False):
     """
@@ -65,11 +103,15 @@ def create_service_instance(instance_id, service, accept_incomplete=False):
             return "Supplied body content is not or is mal-formed JSON", 400
 
         entity = {'entity_id': instance_id, 'entity_req': service_inst_req, 'entity_res': None}
-        context = {'STORE': STORE, 'RM': RM}
+        context = {'STORE': STORE, 'RM': RM, 'POOL': POOL}
 
         if accept_incomplete:
-            AsychExe([CreateInstance(entity, context)]).start()
-            return 'accepted', 201
+            entity['operation'] = _operation_id('provision')
+            task = CreateInstance(entity, context)
+            # requests that cannot succeed are answered now instead of with an operation that fails
+            if not task.validate():
+                return task.context['status']
+            return _submit([task], task.mani.manifest_type, entity)
         else:
             # we have the result of the operation in entity, good/bad status in context
             entity, context = CreateInstance(entity, context).start()
@@ -108,8 +150,8 @@ def deprovision_service_instance(instance_id, service_id, plan_id, accept_incomp
 
         # XXX if there's bindings remove first?
         if accept_incomplete:
-            AsychExe([DeleteInstance(entity, context)]).start()
-            return 'accepted', 201
+            entity['operation'] = _operation_id('deprovision')
+            return _submit([DeleteInstance(entity, context)], _manifest_type(plan_id=plan_id), entity)
         else:
             entity, context = DeleteInstance(entity, context).start()
             # response is UpdateOperationResponse
@@ -139,10 +181,14 @@ def instance_info(instance_id):
         return entity['entity_res'], context['status'][1]
 
 
-def all_instance_info():
+def all_instance_info(limit=None, offset=None):
     """
     Returns information about the service instance.
     Returns all service instances that are accessible to the end-user on this service manager.
+    :param limit: Maximum number of service instances to return
+    :type limit: int
+    :param offset: Number of service instances to skip
+    :type offset: int
 
     :rtype: List[ServiceInstance]
     """
@@ -150,10 +196,10 @@ def all_instance_info():
     if not ok:
         return message, code
     else:
-        entity = {'entity_id': None, 'entity_req': {}, 'entity_res': None}
+        entity = {'entity_id': None, 'entity_req': {'limit': limit, 'offset': offset}, 'entity_res': None}
         context = {'STORE': STORE, 'RM': RM}
         entity, context = RetrieveAllInstances(entity, context).start()
-        return entity['entity_res'], context['status'][1]
+        return entity['entity_res'], context['status'][1], {'X-Total-Count': str(context['total'])}
 
 
 def last_operation_status(instance_id, service_id=None, plan_id=None, operation=None):
@@ -183,7 +229,7 @@ def last_operation_status(instance_id, service_id=None, plan_id=None, operation=
         entity = {'entity_id': instance_id,
                   'entity_req': {'service_id':service_id, 'plan_id': plan_id, 'operation': operation},
                   'entity_res': None}
-        context = {'STORE': STORE, 'RM': RM}
+        context = {'STORE': STORE, 'RM': RM, 'EXECUTOR': EXECUTOR}
 
         entity, context = RetrieveInstanceLastOp(entity, context).start()
         # response should be LastOperation
@@ -291,8 +337,8 @@ def update_service_instance(instance_id, plan, accept_incomplete=False):
         context = {'STORE': STORE, 'RM': RM}
 
         if accept_incomplete:
-            AsychExe([UpdateInstance(entity, context)]).start()
-            return 'accepted', 201
+            entity['operation'] = _operation_id('update')
+            return _submit([UpdateInstance(entity, context)], _manifest_type(instance_id=instance_id), entity)
         else:
             # we have the result of the operation in entity, good/bad status in context
             entity, context = UpdateInstance(entity, context).start()
@@ -13,6 +13,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import Event, Lock
+
+import config
 from adapters.generic import Task
 from adapters.measurer import Measurer, MeasurerFactory
 from esm.models import LastOperation, ServiceInstance, Empty, BindingResponse
@@ -24,6 +29,19 @@ from adapters.log import get_logger
 LOG = get_logger(__name__)
 
 
+def _record_operation(store, instance_id, last_op):
+    # operation state is best effort: a failed write must not fail the operation itself
+    try:
+        store.add_last_operation(instance_id, last_op)
+    except Exception as e:
+        LOG.warning('Could not record the last operation of {id}: {err}'.format(id=instance_id, err=e))
+
+
+def _backend_id(srv_inst):
+    # instances handed out from a warm pool keep the id they were created with in the backend
+    return srv_inst.context.get('backend_id', srv_inst.context['id'])
+
+
 class CreateInstance(Task):
 
     def __init__(self, entity, context):
@@ -32,63 +50,127 @@ class CreateInstance(Task):
         self.rm = self.context['RM']
         self.instance_id = self.entity.get('entity_id')
         self.entity_req = self.entity.get('entity_req')
+        self.operation = self.entity.get('operation')
 
-    def run(self):
-
+    def validate(self) -> bool:
+        """
+        Checks that the instance id is free and that the requested plan has exactly one manifest, which it keeps
+        in self.mani. Otherwise the reason is left in context['status'].
+        """
         if len(self.store.get_service_instance(instance_id=self.instance_id)) == 1:
             self.context['status'] = ('Service instance with id {id} already exists'.format(id=self.instance_id), 409)
-            return self.entity, self.context
+            return False
 
         # get the manifest for the service/plan
         LOG.debug("Executing run()... Looking for service_id: {}".format(self.entity_req.service_id))
-        svc_type = self.store.get_service(self.entity_req.service_id)[0]
-        if svc_type is None:
+        svc_type = self.store.get_service(self.entity_req.service_id)
+        if len(svc_type) < 1:
             self.context['status'] = ('Unrecognised service requested to be instantiated', 404)
-            return self.entity, self.context
+            return False
+        self.svc_type = svc_type[0]
 
-        plans = svc_type.plans
+        plans = self.svc_type.plans
         plan = [p for p in plans if p.id == self.entity_req.plan_id]
         if len(plan) <= 0:
             self.context['status'] = ('Plan {p_id} found.'.format(p_id=self.entity_req.plan_id), 404)
-            return self.entity, self.context
+            return False
 
-        # mani = self.store.get_manifest(plan_id=plan[0].id)  # TODO revert once underlying bug is fixed
-        manis = self.store.get_manifest()
-        mani = [m for m in manis if m.plan_id == plan[0].id]
+        mani = self.store.get_manifest(plan_id=plan[0].id)
 
         if not len(mani) == 1:
             self.context['status'] = ('no manifest for service {plan} found.'.format(plan=self.entity_req.plan_id), 404)
-            return self.entity, self.context
+            return False
 
+        self.mani = mani[0]
+        return True
+
+    def run(self):
+        # asynchronous requests were validated when accepted, but the store may have changed since
+        if not self.validate():
+            # a duplicate id keeps the operation of the existing instance, polls for this one are answered 400
+            if self.operation and self.context['status'][1] != 409:
+                _record_operation(self.store, self.instance_id,
+                                  LastOperation(state='failed', description=self.context['status'][0],
+                                                operation=self.operation))
+            return self.entity, self.context
+        svc_type, mani = self.svc_type, self.mani
 
-        mani = mani[0]
+        # an idle instance from the warm pool of the plan, if it has one; parameters need a new instance
+        pool = self.context.get('POOL')
+        backend_id = pool.acquire(mani) if pool is not None and not self.entity_req.parameters else None
 
         # stored within the service instance doc
-        last_op = LastOperation(state='in progress', description='service instance is being created')
+        last_op = LastOperation(state='in progress', description='service instance is being created',
+                                operation=self.operation)
 
         # store the instance Id with manifest id
         srv_inst = ServiceInstance(service_type=svc_type, state=last_op,
                                    context={'id': self.instance_id, 'manifest_id': mani.id})
+        if backend_id is not None:
+            LOG.info('Handing out the pooled instance %s as %s', backend_id, self.instance_id)
+            srv_inst.context['backend_id'] = backend_id
+
+        try:
+            self.store.add_service_instance(srv_inst)
+        except Exception:
+            if backend_id is not None:
+                # not lost with the request: back to the pool
+                pool.release(backend_id)
+            raise
+        if backend_id is not None:
+            pool.claim(backend_id)
+        _record_operation(self.store, self.instance_id, last_op)
+
+        # backends that report readiness complete the operation themselves, once the instance is ready
+        reports_readiness = backend_id is None and self.rm.reports_readiness_of(mani.manifest_type)
+        on_state, ready, outcome = self._record_state, None, list()
+        if reports_readiness and not self.operation:
+            # a synchronous request has no operation to poll, it may wait (ESM_K8S_SYNC_READY_WAIT) for readiness
+            ready = Event()
+
+            def on_state(state, description):
+                self._record_state(state, description)
+                outcome.append((state, description))
+                ready.set()
+        if backend_id is None:
+            try:
+                self.rm.create(instance_id=self.instance_id, content=mani.manifest_content,
+                               c_type=mani.manifest_type, parameters=self.entity_req.parameters,
+                               on_state=on_state if reports_readiness else None)
+            except Exception as e:
+                _record_operation(self.store, self.instance_id,
+                                  LastOperation(state='failed', description='service instance creation failed: '
+                                                                            '{}'.format(e), operation=self.operation))
+                raise
+
+        if not reports_readiness:
+            self._record_state('succeeded', 'service instance is created')
 
-        self.store.add_service_instance(srv_inst)
-
-        self.rm.create(instance_id=self.instance_id, content=mani.manifest_content,
-                       c_type=mani.manifest_type, parameters=self.entity_req.parameters)
-
-        # should loop or receive call back to when the stack is done
+        self.entity['entity_res'] = srv_inst
+        # the outcome if ready in time, else the current state, which the readiness watch keeps updating in the store
+        if ready is not None and ready.wait(config.esm_k8s_sync_ready_wait):
+            srv_inst.state.state, srv_inst.state.description = outcome[0]
+            if srv_inst.state.state != 'succeeded':
+                self.context['status'] = (srv_inst.state.description, 500)
+                return self.entity, self.context
+        self.context['status'] = ('created', 200)
+        return self.entity, self.context
 
-        svc_up = self.store.get_service_instance(instance_id=self.instance_id)[0]
-        # TODO this does not reflect real status (svc up)
-        LOG.debug("svcup result {} \n{}".format(type(svc_up), svc_up))
+    def _record_state(self, state, description):
+        svc_up = self.store.get_service_instance(instance_id=self.instance_id)
+        if len(svc_up) < 1:
+            LOG.warning('Service instance {id} is gone, not recording it {state}'.format(id=self.instance_id,
+                                                                                        state=state))
+            return
+        svc_up = svc_up[0]
+        LOG.debug("svcup result %s \n%s", type(svc_up), svc_up)
 
-        svc_up.state.state = 'succeeded'
-        svc_up.state.description = 'service instance is created'
+        svc_up.state.state = state
+        svc_up.state.description = description
 
         self.store.add_service_instance(svc_up)
-
-        self.entity['entity_res'] = srv_inst
-        self.context['status'] = ('created', 200)
-        return self.entity, self.context
+        _record_operation(self.store, self.instance_id,
+                          LastOperation(state=state, description=description, operation=self.operation))
 
 
 class DeleteInstance(Task):
@@ -99,6 +181,7 @@ class DeleteInstance(Task):
         self.rm = self.context['RM']
         self.instance_id = self.entity.get('entity_id')
         self.entity_req = self.entity.get('entity_req')
+        self.operation = self.entity.get('operation')
 
     def run(self):
         instance = self.store.get_service_instance(instance_id=self.instance_id)
@@ -111,7 +194,23 @@ class DeleteInstance(Task):
                 self.context['status'] = ('no service manifest found.', 404)
                 return self.entity, self.context
 
-            self.rm.delete(instance_id=self.instance_id, manifest_type=mani[0].manifest_type)
+            _record_operation(self.store, self.instance_id,
+                              LastOperation(state='in progress', description='service instance is being deleted',
+                                            operation=self.operation))
+            try:
+                self.rm.delete(instance_id=_backend_id(instance[0]), manifest_type=mani[0].manifest_type)
+            except Exception as e:
+                _record_operation(self.store, self.instance_id,
+                                  LastOperation(state='failed', description='service instance deletion failed: '
+                                                                            '{}'.format(e), operation=self.operation))
+                raise
+            MeasurerFactory.instance().stop_heartbeat_measurer(self.instance_id)
+
+            # once the instance is gone, polling its last operation answers 410 Gone
+            try:
+                self.store.delete_last_operation(self.instance_id)
+            except Exception as e:
+                LOG.warning('Could not delete the last operation of {id}: {err}'.format(id=self.instance_id, err=e))
             self.store.delete_service_instance(self.instance_id)
 
             self.entity['entity_res'] = Empty()
@@ -154,7 +253,7 @@ class RetrieveInstance(Task):
         # Get the latest info of the instance
         # could also use STORE.get_service_instance(srv_inst) but will not have all details
         LOG.debug("requesting instance info... with manifest type: {}".format(mani[0].manifest_type))
-        inst_info = self.rm.info(instance_id=srv_inst.context['id'], manifest_type=mani[0].manifest_type)
+        inst_info = self.rm.info(instance_id=_backend_id(srv_inst), manifest_type=mani[0].manifest_type)
 
         if inst_info['srv_inst.state.state'] == 'failed':
             # try epm.delete(instance_id=instance_id)?
@@ -169,6 +268,10 @@ class RetrieveInstance(Task):
 
         # merge the two context dicts
         srv_inst.context = {**srv_inst.context, **inst_info}
+        # availability from the health checks of the instance, if it is measured
+        health = MeasurerFactory.instance().health(srv_inst.context['id'])
+        if health is not None:
+            srv_inst.context['health'] = health
 
         # update the service instance record - there should be an asynch method doing the update - event based
         self.store.add_service_instance(srv_inst)
@@ -177,14 +280,47 @@ class RetrieveInstance(Task):
 
 
 class RetrieveAllInstances(RetrieveInstance):
+    """
+    Retrieves the latest info of (a page of) all instances with up to ESM_RETRIEVE_ALL_WORKERS backend calls in
+    parallel. An instance that fails or takes longer than ESM_RETRIEVE_ALL_TIMEOUT seconds is returned as stored,
+    with the reason in context['retrieve_error'].
+    """
     def __init__(self, entity, context):
         super().__init__(entity, context, state='retrieve-all')
+        self.limit = self.entity_req.get('limit')
+        self.offset = self.entity_req.get('offset') or 0
 
     def run(self):
         instances = self.store.get_service_instance()
-        insts = list()
-        for inst in instances:
-            insts.append(self._get_instance(inst))
+        self.context['total'] = len(instances)
+        instances = instances[self.offset:self.offset + self.limit if self.limit else None]
+
+        workers = max(1, min(config.esm_retrieve_all_workers, len(instances)))
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='retrieve-all')
+        try:
+            futures = [pool.submit(self._get_instance, inst) for inst in instances]
+            started = time.monotonic()
+            insts = list()
+            for i, (inst, future) in enumerate(zip(instances, futures)):
+                # instances queued behind the parallelism limit get the time of the calls ahead of them
+                deadline = started + config.esm_retrieve_all_timeout * (i // workers + 1)
+                try:
+                    srv_inst = future.result(timeout=max(0, deadline - time.monotonic()))
+                except TimeoutError:
+                    future.cancel()
+                    srv_inst = ('timed out after {}s'.format(config.esm_retrieve_all_timeout), 504)
+                except Exception as e:
+                    srv_inst = (str(e), 500)
+                if not isinstance(srv_inst, ServiceInstance):
+                    LOG.warning('Could not retrieve service instance {id}: {err}'.format(
+                        id=inst.context.get('id'), err=srv_inst[0]))
+                    # a copy, a late _get_instance call may still update the stored instance object
+                    srv_inst = ServiceInstance(service_type=inst.service_type, state=inst.state,
+                                               context={**inst.context, 'retrieve_error': srv_inst[0]})
+                insts.append(srv_inst)
+        finally:
+            # do not wait on backend calls that timed out
+            pool.shutdown(wait=False)
 
         self.entity['entity_res'] = insts
         self.context['status'] = ('service instances found.', 200)
@@ -192,14 +328,81 @@ class RetrieveAllInstances(RetrieveInstance):
 
 
 class RetrieveInstanceLastOp(RetrieveInstance):
+    """
+    Answers last_operation polls from the store. Asking the backend for the live state of the instance is
+    optional (ESM_LAST_OP_LIVE_CHECK) and done at most once per ESM_LAST_OP_LIVE_INTERVAL seconds per instance.
+    """
+    live_checks = dict()  # instance id -> time of the last live check
+    live_checks_lock = Lock()
+
     def __init__(self, entity, context):
         super().__init__(entity, context, state='retrieve-lastop')
+        self.executor = self.context.get('EXECUTOR')
+        self.operation = self.entity_req.get('operation') if self.entity_req else None
 
     def run(self):
-        entity, context = RetrieveInstance(self.entity, self.context).run()
-        entity['entity_res'] = entity['entity_res'].state
+        if self.executor is not None:
+            pending, operation = self.executor.pending(self.instance_id)
+            # a poll for an earlier operation is answered from the store below
+            if pending and (not self.operation or self.operation == operation):
+                # not picked up yet, or still running: the store may hold the previous operation
+                self.entity['entity_res'] = LastOperation(state='in progress', description='operation is pending',
+                                                          operation=operation)
+                self.context['status'] = ('operation is pending.', 200)
+                return self.entity, self.context
 
-        return entity, context
+        last_op = self.store.get_last_operation(self.instance_id)
+        if len(last_op) < 1:
+            # instances created before operations were recorded only carry their state
+            srv_inst = self.store.get_service_instance(self.instance_id)
+            if len(srv_inst) < 1:
+                self.entity['entity_res'] = Empty()
+                self.context['status'] = ('no service instance found.', 410)
+                return self.entity, self.context
+            last_op = [srv_inst[0].state]
+        last_op = last_op[0]
+
+        # operations recorded without an id (synchronous ones, or from before ids were recorded) match any poll
+        if self.operation and last_op.operation and self.operation != last_op.operation:
+            LOG.warning('Operation {req} was requested but the last operation of {id} is {op}'.format(
+                req=self.operation, id=self.instance_id, op=last_op.operation))
+            self.entity['entity_res'] = Empty()
+            self.context['status'] = ('operation {op} is not known for service instance {id}.'.format(
+                op=self.operation, id=self.instance_id), 400)
+            return self.entity, self.context
+
+        if self._live_check_due():
+            live = self._live_state()
+            if live is not None and (live.state, live.description) != (last_op.state, last_op.description):
+                last_op = LastOperation(state=live.state, description=live.description, operation=last_op.operation)
+                _record_operation(self.store, self.instance_id, last_op)
+
+        self.entity['entity_res'] = last_op
+        self.context['status'] = ('last operation found.', 200)
+        return self.entity, self.context
+
+    def _live_check_due(self):
+        if config.esm_last_op_live_check != 'YES':
+            return False
+        now = time.monotonic()
+        with self.live_checks_lock:
+            last = self.live_checks.get(self.instance_id)
+            if last is not None and now - last < config.esm_last_op_live_interval:
+                return False
+            self.live_checks[self.instance_id] = now
+            return True
+
+    def _live_state(self):
+        srv_inst = self.store.get_service_instance(self.instance_id)
+        if len(srv_inst) < 1:
+            return None
+        try:
+            srv_inst = self._get_instance(srv_inst[0])
+        except Exception as e:
+            LOG.warning('Live check of {id} failed: {err}'.format(id=self.instance_id, err=e))
+            return None
+        # _get_instance reports errors as (message, code)
+        return srv_inst.state if isinstance(srv_inst, ServiceInstance) else None
 
 
 class BindInstance(Task):
@@ -269,6 +472,11 @@ class UpdateInstance(Task):
         self.entity_req = entity.get('entity_req')
 
     def run(self):
+        if self.entity.get('operation'):
+            # an asynchronous update is polled for like any other operation
+            _record_operation(self.store, self.instance_id,
+                              LastOperation(state='failed', description='Not implemented',
+                                            operation=self.entity['operation']))
         self.entity['entity_res'] = Empty()
         self.context['status'] = ('Not implemented', 501)
 
@@ -290,11 +498,12 @@ class MeasureInstance(Task):
         svc_type = self.store.get_service(self.entity_req.service_id)[0]
         plans = svc_type.plans
         plan = [p for p in plans if p.id == self.entity_req.plan_id]
-        manis = self.store.get_manifest()
-        mani = [m for m in manis if m.plan_id == plan[0].id]
-        if mani:
+        mani = self.store.get_manifest(plan_id=plan[0].id) if plan else []
+        srv_inst = self.store.get_service_instance(instance_id=self.instance_id)
+        if mani and srv_inst:
             mani = mani[0]
-            factory.start_heartbeat_measurer({'instance_id': self.instance_id, 'RM': self.rm, 'mani': mani})
+            factory.start_heartbeat_measurer({'instance_id': self.instance_id, 'RM': self.rm, 'mani': mani,
+                                              'STORE': self.store, 'backend_id': _backend_id(srv_inst[0])})
         else:
             pass
 
@@ -12,7 +12,7 @@ class LastOperation(Model):
     NOTE: This class is auto generated by the swagger code generator program.
     Do not edit the class manually.
     """
-    def __init__(self, state: str=None, description: str=None):
+    def __init__(self, state: str=None, description: str=None, operation: str=None):
         """
         LastOperation - a model defined in Swagger
 
@@ -20,19 +20,24 @@ class LastOperation(Model):
         :type state: str
         :param description: The description of this LastOperation.
         :type description: str
+        :param operation: The operation of this LastOperation.
+        :type operation: str
         """
         self.swagger_types = {
             'state': str,
-            'description': str
+            'description': str,
+            'operation': str
         }
 
         self.attribute_map = {
             'state': 'state',
-            'description': 'description'
+            'description': 'description',
+            'operation': 'operation'
         }
 
         self._state = state
         self._description = description
+        self._operation = operation
 
     @classmethod
     def from_dict(cls, dikt) -> 'LastOperation':
@@ -94,3 +99,25 @@ class LastOperation(Model):
 
         self._description = description
 
+    @property
+    def operation(self) -> str:
+        """
+        Gets the operation of this LastOperation.
+        The broker-provided identifier of the asynchronous operation this state belongs to.
+
+        :return: The operation of this LastOperation.
+        :rtype: str
+        """
+        return self._operation
+
+    @operation.setter
+    def operation(self, operation: str):
+        """
+        Sets the operation of this LastOperation.
+        The broker-provided identifier of the asynchronous operation this state belongs to.
+
+        :param operation: The operation of this LastOperation.
+        :type operation: str
+        """
+
+        self._operation = operation
@@ -17,21 +17,29 @@ import connexion
 import flask
 import os
 import signal
+import time
 
 from healthcheck import HealthCheck, EnvironmentDump
+from tornado import gen
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
-from tornado.wsgi import WSGIContainer
 
 import config
+from adapters.generic import EXECUTOR
 from adapters.log import get_logger
+from adapters.measurer import MeasurerFactory
+from adapters.pool import POOL
 from adapters.store import STORE
 from adapters.resources import RM
+from adapters.wsgi import ThreadedWSGIContainer
 from esm.encoder import JSONEncoder
 
 
 LOG = get_logger(__name__)
 
+# name -> (HTTPServer, ThreadedWSGIContainer) of the servers started by serve()
+SERVERS = dict()
+
 
 # this adds keystone auth to access the ESM
 def add_mware(app):
@@ -87,6 +95,14 @@ def add_check_api():
 
     health.add_check(health_check)
     envdump.add_section("application", application_data)
+    envdump.add_section("executor", EXECUTOR.stats)
+    envdump.add_section("info_cache", RM.info_cache.stats)
+    envdump.add_section("warm_pool", POOL.stats)
+    envdump.add_section("images", RM.backends['docker'].warmer.stats)
+    envdump.add_section("k8s_cache", RM.backends['kubernetes'].cluster_stats)
+    envdump.add_section("k8s_reaper", RM.backends['kubernetes'].reaper.stats)
+    envdump.add_section("health_checks", MeasurerFactory.instance().stats)
+    envdump.add_section("http", lambda: {name: container.stats() for name, (_, container) in SERVERS.items()})
 
     return add_mware(app)
 
@@ -114,27 +130,66 @@ def create_api():
     return add_mware(app)
 
 
+def serve(name, app, address, port, workers):
+    container = ThreadedWSGIContainer(app, workers=workers, name=name)
+    server = HTTPServer(container)
+    server.listen(address=address, port=port)
+    SERVERS[name] = (server, container)
+    return server, container
+
+
+async def drain(timeout):
+    # stop accepting connections, then give the requests being served up to timeout seconds to finish
+    for server, _ in SERVERS.values():
+        server.stop()
+    deadline = time.monotonic() + timeout
+    while any(container.in_flight for _, container in SERVERS.values()) and time.monotonic() < deadline:
+        await gen.sleep(0.1)
+    in_flight = sum(container.in_flight for _, container in SERVERS.values())
+    if in_flight:
+        LOG.warning('Stopping with {} requests still in flight.'.format(in_flight))
+    IOLoop.current().stop()
+
+
 def shutdown_handler(signum=None, frame=None):
     LOG.info('Shutting down...')
-    IOLoop.instance().stop()
+    IOLoop.instance().add_callback_from_signal(drain, config.esm_shutdown_timeout)
 
 
 if __name__ == '__main__':
     esm_ip = config.esm_bind_address
     esm_port = config.esm_bind_port
-    esm_server = HTTPServer(WSGIContainer(create_api()))
-    esm_server.listen(address=esm_ip, port=esm_port)
-    LOG.info('ESM available at http://{IP}:{PORT}'.format(IP=esm_ip, PORT=esm_port))
+    serve('esm-http', create_api(), esm_ip, esm_port, config.esm_http_workers)
+    LOG.info('ESM available at http://{IP}:{PORT} with {W} workers'.format(IP=esm_ip, PORT=esm_port,
+                                                                            W=config.esm_http_workers))
 
     esm_check_ip = config.esm_check_ip
     check_port = config.esm_check_port
-    check_server = HTTPServer(WSGIContainer(add_check_api()))
-    check_server.listen(address=esm_check_ip, port=check_port)
+    serve('esm-check', add_check_api(), esm_check_ip, check_port, config.esm_check_workers)
     LOG.info('ESM Health available at http://{IP}:{PORT}'.format(IP=esm_check_ip, PORT=check_port))
 
     for sig in [signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGQUIT]:
         signal.signal(sig, shutdown_handler)
 
+    RM.start_warming(STORE.get_manifest, config.esm_dock_warm_interval)
+    if config.esm_k8s_cache == 'YES':
+        RM.backends['kubernetes'].start_cluster_cache()
+    try:
+        RM.backends['kubernetes'].resume_deletions()
+    except Exception as e:
+        LOG.warning('Could not resume the namespace deletions of an earlier run: {}'.format(e))
+    POOL.start(STORE.get_manifest, config.esm_pool_interval)
+
     LOG.info(config.print_env_vars())
     LOG.info('Press CTRL+C to quit.')
     IOLoop.instance().start()
+
+    for _, container in SERVERS.values():
+        container.shutdown(wait=False)
+    MeasurerFactory.instance().shutdown(wait=False)
+    RM.stop_warming()
+    RM.backends['kubernetes'].stop_cluster_cache()
+    RM.backends['kubernetes'].reaper.shutdown()
+    # let queued and running operations finish
+    EXECUTOR.shutdown(wait=True)
+    POOL.shutdown()
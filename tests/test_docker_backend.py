@@ -14,17 +14,223 @@
 #    under the License.
 
 import inspect
+import tempfile
+import threading
+import time
 from unittest import TestCase, skipIf
+from unittest.mock import MagicMock, patch
 
 import docker
 import os
+import yaml
 
-from adapters.resources import DockerBackend
+from adapters import compose
+from adapters.log import get_logger
+from adapters.resources import DockerBackend, ImageWarmer
+
+LOG = get_logger(__name__)
 
 INST_ID = 'test-id-123'
 MANIFEST = os.environ.get("TEST_MANIFEST_CONTENT", "/manifests/docker-compose.yml")
 
 
+def read_manifest():
+    path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+    with open(path + '/manifests/docker-compose.yml', "r") as mani:
+        return mani.read()
+
+
+class TestComposeProject(TestCase):
+
+    def test_parse(self):
+        project = compose.ComposeProject(INST_ID, yaml.safe_load(read_manifest()))
+        self.assertEqual(project.start_order(), ['spark-master', 'spark-worker', 'rest-api'])
+        self.assertEqual(list(project.networks), ['test-id-123_elastest_elastest'])
+
+        master = project.services['spark-master']
+        self.assertEqual(master.container_name, 'spark-master')
+        self.assertEqual(master.host_config['port_bindings'], {'8082/tcp': 8082, '7077/tcp': 7077})
+        self.assertEqual(master.host_config['network_mode'], 'test-id-123_elastest_elastest')
+        self.assertEqual(master.labels[compose.LABEL_INSTANCE], INST_ID)
+
+        worker = project.services['spark-worker'].create_args()
+        self.assertEqual(worker['name'], 'test-id-123_spark-worker_1')
+        self.assertEqual(worker['image'], 'elastest/ebs-spark:latest')
+        self.assertEqual(worker['ports'], ['8081/tcp'])
+
+    def test_ports(self):
+        self.assertEqual(compose.parse_ports(['80', '8080:80/udp', '127.0.0.1:9000-9001:90-91',
+                                              {'target': 22, 'published': 2222}]),
+                         {'80/tcp': None, '80/udp': 8080, '90/tcp': ('127.0.0.1', 9000),
+                          '91/tcp': ('127.0.0.1', 9001), '22/tcp': 2222})
+
+    def test_dependency_cycle(self):
+        m = {'services': {'a': {'image': 'a', 'depends_on': ['b']}, 'b': {'image': 'b', 'links': ['a']}}}
+        with self.assertRaises(Exception):
+            compose.ComposeProject(INST_ID, m).start_order()
+
+
+class TestDockerBackendInfo(TestCase):
+
+    def container(self, name, service, state='running', status='Up 2 minutes'):
+        c = MagicMock()
+        c.attrs = {'Id': name + '-id', 'Names': ['/' + name], 'Image': 'elastest/ebs:latest', 'ImageID': 'sha256:1',
+                   'Command': 'run', 'State': state, 'Status': status, 'HostConfig': {'NetworkMode': 'net'},
+                   'Labels': {compose.LABEL_INSTANCE: INST_ID, compose.LABEL_SERVICE: service},
+                   'NetworkSettings': {'Networks': {'net': {'IPAddress': '10.0.0.2'}}},
+                   'Ports': [{'IP': '0.0.0.0', 'PrivatePort': 8080, 'PublicPort': 32768, 'Type': 'tcp'},
+                             {'PrivatePort': 7077, 'Type': 'tcp'}]}
+        return c
+
+    def test_info_with_one_list_call(self):
+        with tempfile.TemporaryDirectory() as tmp, patch('config.esm_dock_tmp_dir', tmp):
+            backend = DockerBackend()
+            backend._client = MagicMock()
+            with patch.object(backend, '_create_networks'), patch.object(backend, '_run_service'):
+                backend.create(INST_ID, read_manifest(), 'docker-compose', parameters={'TEST': 'value'})
+            backend.projects.clear()  # as after a restart: the saved manifest is parsed again
+
+            backend.client.containers.list.return_value = [self.container('spark-master', 'spark-master'),
+                                                           self.container('test-id-123_rest-api_1', 'rest-api')]
+            info = backend.info(INST_ID)
+            backend.client.containers.list.assert_called_once_with(
+                all=True, sparse=True, filters={'label': compose.LABEL_INSTANCE + '=' + INST_ID})
+            self.assertEqual(info['srv_inst.state.state'], 'succeeded')
+            self.assertEqual(info['spark-master_Ip'], '10.0.0.2')
+            self.assertEqual(info['test-id-123_rest-api_environment_EBS_PORT'], '5002')
+            self.assertEqual(info['test-id-123_rest-api_environment_TEST'], 'value')
+            # as the flattened container attributes had them
+            published = str([{'HostIp': '0.0.0.0', 'HostPort': '32768'}])
+            self.assertEqual(info['spark-master_networksettings_ports_8080/tcp'], published)
+            self.assertEqual(info['spark-master_hostconfig_portbindings_8080/tcp'], published)
+            self.assertNotIn('spark-master_networksettings_ports_7077/tcp', info)
+            self.assertEqual(info['spark-master_networksettings_networks_net_ipaddress'], '10.0.0.2')
+
+            backend.client.containers.list.return_value = [self.container('spark-master', 'spark-master', 'exited',
+                                                                          'Exited (137) 1 second ago')]
+            info = backend.info(INST_ID)
+            self.assertEqual(info['spark-master_state'], 'Exit 137')
+            self.assertEqual(info['srv_inst.state.state'], 'failed')
+
+
+class TestDockerBackendStartup(TestCase):
+    """Startup of a spark master, 4 workers and an api in dependency order, with slow image pulls and starts."""
+    SLOW = 0.1
+    MANIFEST = {'services': {
+        'master': {'image': 'spark'},
+        **{'worker{}'.format(i): {'image': 'spark', 'depends_on': ['master']} for i in range(4)},
+        'api': {'image': 'api', 'links': ['master']},
+    }}
+
+    def setUp(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def slow(self, what):
+        with self.lock:
+            self.events.append(('begin', what, time.monotonic()))
+        time.sleep(self.SLOW)
+        with self.lock:
+            self.events.append(('end', what, time.monotonic()))
+
+    def create(self, parallelism):
+        self.events.clear()
+        with tempfile.TemporaryDirectory() as tmp, patch('config.esm_dock_tmp_dir', tmp), \
+                patch('config.esm_dock_parallelism', parallelism):
+            backend = DockerBackend()
+            backend._client = MagicMock()
+            backend.client.images.get.side_effect = docker.errors.ImageNotFound('missing')
+            with patch.object(backend, '_create_networks'), \
+                    patch.object(backend, '_pull', side_effect=lambda image: self.slow(image)), \
+                    patch.object(backend, '_run_service', side_effect=lambda svc: self.slow(svc.name)):
+                started = time.monotonic()
+                backend.create(INST_ID, yaml.dump(self.MANIFEST), 'docker-compose')
+                return time.monotonic() - started, backend.timings[INST_ID]
+
+    @skipIf(os.getenv('BENCHMARK_TESTS', 'NO') != 'YES', "BENCHMARK_TESTS not set in environment variables")
+    def test_concurrent_startup_is_faster(self):
+        serial, _ = self.create(parallelism=1)
+        concurrent, _ = self.create(parallelism=6)
+        LOG.info('6 services up in {:.2f}s serially, {:.2f}s concurrently'.format(serial, concurrent))
+        self.assertLess(concurrent * 2, serial)
+
+    def test_concurrent_startup(self):
+        _, timings = self.create(parallelism=6)
+        # each image pulled once, every service started after the ones it depends on
+        self.assertEqual(sorted(e[1] for e in self.events if e[0] == 'begin' and ':' in e[1]),
+                         ['api:latest', 'spark:latest'])
+        master_up = [e[2] for e in self.events if e[:2] == ('end', 'master')][0]
+        for e in self.events:
+            if e[0] == 'begin' and e[1] != 'master' and ':' not in e[1]:
+                self.assertGreaterEqual(e[2], master_up)
+        self.assertEqual(sorted(timings), ['api', 'master', 'worker0', 'worker1', 'worker2', 'worker3'])
+        self.assertGreater(timings['worker0']['start'], 0)
+        self.assertGreater(timings['worker0']['pull'], 0)
+
+
+class TestImageWarmer(TestCase):
+
+    def test_pulls_in_background(self):
+        release = threading.Event()
+        pulled = []
+        active = []
+
+        def pull(image):
+            active.append(image)
+            release.wait(5)
+            if image == 'broken:latest':
+                raise Exception('not found')
+            pulled.append(image)
+
+        warmer = ImageWarmer(pull, workers=2)
+        manifest = yaml.dump({'services': {'a': {'image': 'spark'}, 'b': {'image': 'spark'},
+                                           'c': {'image': 'api:1.0'}, 'd': {'image': 'broken'}}})
+        self.assertEqual(warmer.warm(manifest), ['api:1.0', 'broken:latest', 'spark:latest'])
+        time.sleep(0.1)
+        stats = warmer.stats()
+        self.assertEqual((stats['pulling'], stats['queued']), (2, 1))  # bounded concurrency
+        self.assertEqual(warmer.warm(manifest), [])  # already under way
+
+        release.set()
+        self.assertTrue(warmer.ready('spark:latest'))  # waits for the pull under way
+        self.assertFalse(warmer.ready('broken:latest'))
+        warmer.shutdown()
+        stats = warmer.stats()
+        self.assertEqual((stats['ready'], stats['failed']), (2, 1))
+        self.assertEqual(stats['images']['broken:latest']['error'], 'not found')
+
+        # pulled images are only pulled again on a refresh
+        warmer = ImageWarmer(warmer.pull, workers=2)
+        warmer.images = stats['images']
+        self.assertEqual(warmer.warm(manifest), ['broken:latest'])
+        warmer.ready('broken:latest')
+        self.assertEqual(len(warmer.warm(manifest, refresh=True)), 3)
+        warmer.shutdown()
+
+    def test_provisioning_uses_warmed_images(self):
+        with tempfile.TemporaryDirectory() as tmp, patch('config.esm_dock_tmp_dir', tmp), \
+                patch('config.esm_dock_update_images', 'YES'), patch('config.esm_dock_warm_images', 'YES'):
+            backend = DockerBackend()
+            backend._client = MagicMock()
+            with patch.object(backend, '_pull') as pull, patch.object(backend, '_create_networks'), \
+                    patch.object(backend, '_run_service'):
+                backend.warmer.pull = pull
+                backend.warm(read_manifest())
+                backend.warmer.shutdown()
+                self.assertEqual(pull.call_count, 2)
+
+                backend.create(INST_ID, read_manifest(), 'docker-compose')
+                self.assertEqual(pull.call_count, 2)
+
+
+    def test_not_warmed_by_default(self):
+        with tempfile.TemporaryDirectory() as tmp, patch('config.esm_dock_tmp_dir', tmp):
+            backend = DockerBackend()
+            with patch.object(backend.warmer, 'warm') as warm:
+                backend.warm(read_manifest())
+            self.assertFalse(warm.called)
+            backend.warmer.shutdown()
+
 @skipIf(os.getenv('DOCKER_TESTS', 'NO') != 'YES', "DOCKER_TESTS not set in environment variables")
 class TestDockerCompose(TestCase):
     def setUp(self):
@@ -16,10 +16,12 @@
 import inspect
 from unittest import TestCase
 from unittest import skipIf
+from unittest.mock import MagicMock, patch
 
 import os
 
 from adapters.resources import EPMBackend
+from adapters.store import InMemoryStore
 
 INST_ID = 'test-id-123'
 
@@ -66,6 +68,50 @@ class TestEPMBackendWithoutSetup(TestCase):
             self.epm.create(instance_id=INST_ID, content=content, c_type="epm")
 
 
+class TestEPMResourceGroups(TestCase):
+
+    def setUp(self):
+        self.store = InMemoryStore()
+        self.epm = self.backend()
+        self.epm.package_api.receive_package = MagicMock()
+        self.epm.package_api.receive_package.return_value.to_dict.return_value = {'id': 'rg-1'}
+        path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+        with open(path + "/manifests/docker-compose.yml", "r") as mani:
+            self.epm.create(instance_id=INST_ID, content=mani.read(), c_type="epm")
+
+    def backend(self):
+        epm = EPMBackend(store=self.store)
+        epm.package_api.delete_package = MagicMock()
+        epm.resource_group_api.get_resource_group_by_id = MagicMock(side_effect=Exception('offline'))
+        return epm
+
+    def test_resource_group_survives_a_restart(self):
+        self.assertEqual(self.store.get_backend_ref(INST_ID, 'epm'), ['rg-1'])
+        restarted = self.backend()
+        with self.assertRaises(Exception):
+            restarted.info(instance_id=INST_ID)
+        restarted.resource_group_api.get_resource_group_by_id.assert_called_once_with(id='rg-1')
+
+        restarted.delete(instance_id=INST_ID)
+        restarted.package_api.delete_package.assert_called_once_with(id='rg-1')
+        self.assertEqual(self.store.get_backend_ref(INST_ID, 'epm'), [])
+        with self.assertRaises(KeyError):
+            restarted.delete(instance_id=INST_ID)
+
+    def test_cached_lookups_do_not_read_the_store(self):
+        with patch.object(self.store, 'get_backend_ref') as get_backend_ref:
+            self.epm.delete(instance_id=INST_ID)
+        self.assertFalse(get_backend_ref.called)
+
+    def test_clients_are_shared(self):
+        self.assertIs(self.epm.package_api.api_client, self.epm.resource_group_api.api_client)
+        self.assertEqual(self.epm.api_client.host, self.epm.api_endpoint)
+        with patch('adapters.resources.PackageApi') as package_api, \
+                patch('adapters.resources.ResourceGroupApi') as resource_group_api:
+            self.epm.delete(instance_id=INST_ID)
+        self.assertFalse(package_api.called or resource_group_api.called)
+
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
@@ -0,0 +1,150 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import threading
+import time
+import unittest
+
+from adapters.generic import Executor, Task, WorkerPool
+
+
+class BlockingTask(Task):
+    def __init__(self, release, started=None, fail=False):
+        super().__init__(state='test')
+        self.release = release
+        self.started = started
+        self.fail = fail
+
+    def run(self):
+        if self.started:
+            self.started.release()
+        self.release.wait(5)
+        if self.fail:
+            raise Exception('task failed')
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.pool = WorkerPool('test', workers=2, queue_size=2)
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+
+    def test_bounded_concurrency_and_queue(self):
+        started = threading.Semaphore(0)
+        for _ in range(2):
+            self.assertTrue(self.pool.submit([BlockingTask(self.release, started)]))
+        for _ in range(2):
+            self.assertTrue(started.acquire(timeout=5))
+        # both workers busy: two more jobs fit in the queue, the next one is rejected
+        self.assertTrue(self.pool.submit([BlockingTask(self.release)]))
+        self.assertTrue(self.pool.submit([BlockingTask(self.release)]))
+        self.assertFalse(self.pool.submit([BlockingTask(self.release)]))
+
+        stats = self.pool.stats()
+        self.assertEqual(stats['running'], 2)
+        self.assertEqual(stats['queue_depth'], 2)
+        self.assertEqual(stats['rejected'], 1)
+
+        self.release.set()
+        self.pool.shutdown()
+        stats = self.pool.stats()
+        self.assertEqual(stats['completed'], 4)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertGreater(stats['avg_wait_time'], 0)
+
+    def test_failed_task_is_counted(self):
+        self.release.set()
+        self.pool.submit([BlockingTask(self.release, fail=True), BlockingTask(self.release)])
+        self.pool.shutdown()
+        self.assertEqual(self.pool.stats()['failed'], 1)
+        self.assertEqual(self.pool.stats()['completed'], 0)
+
+    def test_pending_until_finished(self):
+        started = threading.Semaphore(0)
+        self.assertTrue(self.pool.submit([BlockingTask(self.release, started)], key='inst', operation='op-1'))
+        self.assertTrue(started.acquire(timeout=5))
+        self.assertEqual(self.pool.pending('inst'), (True, 'op-1'))
+        self.assertEqual(self.pool.pending('other'), (False, None))
+        self.release.set()
+        self.pool.shutdown()
+        self.assertEqual(self.pool.pending('inst'), (False, None))
+
+    def test_pending_with_two_jobs_for_the_same_key(self):
+        pool = WorkerPool('single', workers=1, queue_size=2)
+        first, second = threading.Event(), threading.Event()
+        started = threading.Semaphore(0)
+        try:
+            self.assertTrue(pool.submit([BlockingTask(first, started)], key='inst', operation='op-1'))
+            self.assertTrue(pool.submit([BlockingTask(second, started)], key='inst', operation='op-2'))
+            self.assertTrue(started.acquire(timeout=5))
+            self.assertEqual(pool.pending('inst'), (True, 'op-2'))
+
+            # the first job finishing must not drop the second one, still to run
+            first.set()
+            self.assertTrue(started.acquire(timeout=5))
+            self.assertEqual(pool.pending('inst'), (True, 'op-2'))
+
+            second.set()
+            pool.shutdown()
+            self.assertEqual(pool.pending('inst'), (False, None))
+        finally:
+            first.set()
+            second.set()
+            pool.shutdown()
+
+    def test_shutdown_does_not_block_on_a_full_queue(self):
+        started = threading.Semaphore(0)
+        for _ in range(2):
+            self.assertTrue(self.pool.submit([BlockingTask(self.release, started)]))
+        for _ in range(2):
+            self.assertTrue(started.acquire(timeout=5))
+        for _ in range(2):
+            self.assertTrue(self.pool.submit([BlockingTask(self.release)]))
+        before = time.monotonic()
+        self.pool.shutdown(wait=False)
+        self.assertLess(time.monotonic() - before, 1)
+        # the queued jobs still run once the workers are free
+        self.release.set()
+        self.pool.shutdown()
+        self.assertEqual(self.pool.stats()['completed'], 4)
+
+    def test_rejects_after_shutdown(self):
+        self.pool.shutdown()
+        self.assertFalse(self.pool.submit([BlockingTask(self.release)]))
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = Executor(workers=1, queue_size=1,
+                                 backend_limits=Executor.parse_limits('docker=3, k8s=2'))
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_backends_get_their_own_pools(self):
+        self.assertEqual(self.executor.pool('docker-compose').workers, 3)
+        self.assertIs(self.executor.pool('docker-compose'), self.executor.pool('docker'))
+        self.assertEqual(self.executor.pool('kubernetes').workers, 2)
+        self.assertEqual(self.executor.pool('dummy').name, Executor.DEFAULT)
+        self.assertEqual(self.executor.pool(None).workers, 1)
+        self.assertEqual(set(self.executor.stats()), {'docker', 'k8s', Executor.DEFAULT})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from adapters.log import get_logger
+from adapters.measurer import HealthCheckScheduler, HealthHistory, Measurer
+
+LOG = get_logger(__name__)
+
+INTERVAL = 0.2
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so that connections can be reused
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.checks[self.path] = self.server.checks.get(self.path, 0) + 1
+        body = b'{"status": "up"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HealthServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), HealthHandler)
+        self.connections = 0
+        self.checks = dict()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def endpoint(self, instance_id):
+        return 'http://127.0.0.1:{}/health/{}'.format(self.server_address[1], instance_id)
+
+
+class TestHealthCheckScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HealthServer()
+        self.scheduler = HealthCheckScheduler(workers=4, interval=INTERVAL)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def measurer(self, instance_id):
+        return Measurer({'instance_id': instance_id, 'RM': None, 'mani': None}, session=self.scheduler.session,
+                        interval=INTERVAL, max_interval=INTERVAL)
+
+    def checks(self, instance_id):
+        return self.server.checks.get('/health/{}'.format(instance_id), 0)
+
+    def test_many_instances_few_threads(self):
+        threads = threading.active_count()
+        ids = ['inst-{}'.format(i) for i in range(100)]
+        with patch.object(Measurer, 'get_endpoint', lambda m: self.server.endpoint(m.instance_id)):
+            for instance_id in ids:
+                self.scheduler.add(self.measurer(instance_id))
+            time.sleep(INTERVAL * 6)
+            # one scheduler thread and the workers, whatever the number of instances
+            self.assertLessEqual(threading.active_count() - threads, 1 + 4 + 4)  # + the server's handler threads
+        self.assertTrue(all(self.checks(i) >= 3 for i in ids))
+        # the checks share a few kept-alive connections
+        total = sum(self.server.checks.values())
+        self.assertLessEqual(self.server.connections, 8)
+        LOG.info('{} checks of {} instances over {} connections'.format(total, len(ids), self.server.connections))
+
+    def test_add_and_remove_at_runtime(self):
+        with patch.object(Measurer, 'get_endpoint', lambda m: self.server.endpoint(m.instance_id)):
+            self.scheduler.add(self.measurer('first'))
+            time.sleep(INTERVAL * 3)
+            self.scheduler.add(self.measurer('second'))
+            self.assertTrue(self.scheduler.remove('first'))
+            self.assertFalse(self.scheduler.remove('unknown'))
+            time.sleep(INTERVAL * 0.5)  # let a check of 'first' that was running finish
+            removed = self.checks('first')
+            time.sleep(INTERVAL * 3)
+        self.assertGreater(removed, 0)
+        self.assertEqual(self.checks('first'), removed)
+        self.assertGreater(self.checks('second'), 0)
+        self.assertEqual(self.scheduler.stats()['instances'], 1)
+
+    def test_sentinel_messages(self):
+        endpoints = [None, self.server.endpoint('late')]
+        with patch.object(Measurer, 'get_endpoint', lambda m: endpoints.pop(0) if endpoints else endpoints), \
+                patch.object(Measurer, 'ENDPOINT_RETRY_DELAY', 0.05), \
+                self.assertLogs('adapters.measurer', 'WARNING') as logs:
+            self.scheduler.add(self.measurer('late'))
+            time.sleep(INTERVAL * 2)
+        self.assertEqual(logs.output[:3], [
+            'WARNING:adapters.measurer:late#Measurer created',
+            'WARNING:adapters.measurer:late#Endpoint could not be retrieved!',
+            "WARNING:adapters.measurer:late#Endpoint '{}' is alive!".format(self.server.endpoint('late')),
+        ])
+        health = self.scheduler.measurers['late'].history.summary()
+        self.assertEqual((health['status'], health['uptime']), ('alive', 100.0))
+        self.assertGreater(health['latency_p50_ms'], 0)
+
+
+class TestAdaptiveChecks(unittest.TestCase):
+
+    def run_checks(self, results, endpoints=('http://10.0.0.1/health',)):
+        """Steps a measurer whose checks return results; returns the delays it asked for."""
+        measurer = Measurer({'instance_id': 'adaptive', 'RM': None, 'mani': None}, interval=2, max_interval=60,
+                            failure_threshold=3)
+        endpoints = list(endpoints)
+        with patch.object(Measurer, 'get_endpoint', lambda m: endpoints.pop(0) if len(endpoints) > 1
+                          else endpoints[0]), \
+                patch.object(Measurer, '_endpoint_is_healthy', side_effect=results):
+            return [measurer.step() for _ in results], measurer
+
+    def test_healthy_backs_off(self):
+        delays, _ = self.run_checks([True] * 8)
+        self.assertEqual(delays, [4, 8, 16, 32, 60, 60, 60, 60])
+
+        # over an hour this is a fraction of the checks at the fixed interval
+        checks, elapsed = 0, 0
+        for delay in delays[:5]:
+            checks, elapsed = checks + 1, elapsed + delay
+        checks += int(3600 - elapsed) // 60
+        LOG.info('{} checks of a healthy instance per hour instead of {}'.format(checks, 3600 // 2))
+        self.assertLess(checks * 10, 3600 // 2)
+
+    def test_failing_opens_the_circuit(self):
+        results = [True, True, False, ConnectionError(), False, False, True, True]
+        with self.assertLogs('adapters.measurer', 'WARNING') as logs:
+            delays, measurer = self.run_checks(results, endpoints=('http://10.0.0.1/health',
+                                                                   'http://10.0.0.2/health'))
+        # back to the base interval on the first failure, then exponential, then open
+        self.assertEqual(delays, [4, 8, 2, 4, 60, 60, 2, 4])
+        self.assertEqual(measurer.circuit, Measurer.CLOSED)
+        self.assertIn("WARNING:adapters.measurer:adaptive#Endpoint changed to 'http://10.0.0.2/health'", logs.output)
+        self.assertEqual([m for m in logs.output if 'Circuit' in m], [
+            'WARNING:adapters.measurer:adaptive#Circuit open after 3 failed checks',
+            'WARNING:adapters.measurer:adaptive#Circuit closed',
+        ])
+
+
+class TestHealthHistory(unittest.TestCase):
+
+    def test_summary(self):
+        history = HealthHistory(size=100)
+        self.assertIsNone(history.summary())
+        for i in range(1, 91):
+            history.record(HealthHistory.ALIVE, latency=i, at=1000 + i)
+        for i in range(91, 101):
+            history.record(HealthHistory.UNREACHABLE, at=1000 + i)
+        self.assertEqual(history.summary(), {
+            'status': 'unreachable', 'checks': 100, 'uptime': 90.0,
+            'latency_p50_ms': 45, 'latency_p99_ms': 90,  # of the checks that got an answer
+            'last_check': '1970-01-01T00:18:20Z', 'last_transition': '1970-01-01T00:18:11Z',
+        })
+
+    def test_ring_buffer_keeps_the_latest_checks(self):
+        history = HealthHistory(size=10)
+        for i in range(10):
+            history.record(HealthHistory.DOWN, latency=1000, at=i)
+        for i in range(10, 25):
+            history.record(HealthHistory.ALIVE, latency=1, at=i)
+        summary = history.summary()
+        self.assertEqual((summary['checks'], summary['uptime'], summary['latency_p99_ms']), (10, 100.0, 1))
+        self.assertEqual(summary['last_transition'], '1970-01-01T00:00:10Z')
+
+
+if __name__ == '__main__':
+    unittest.main()
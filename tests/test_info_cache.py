@@ -0,0 +1,110 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import threading
+import unittest
+from unittest.mock import patch
+
+from adapters.resources import InfoCache, RM
+
+INST_ID = 'test-cache-123'
+
+
+class SlowFetch:
+    def __init__(self, release=None, fail=False):
+        self.release = release
+        self.fail = fail
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.release:
+            self.release.wait(5)
+        if self.fail:
+            raise Exception('backend down')
+        return {'srv_inst.state.state': 'succeeded'}
+
+
+class TestInfoCache(unittest.TestCase):
+
+    def test_hit_after_miss(self):
+        cache = InfoCache(ttl=60)
+        fetch = SlowFetch()
+        first = cache.get(INST_ID, fetch)
+        # callers delete keys from the returned dict, that must not change the cached copy
+        del first['srv_inst.state.state']
+        self.assertEqual(cache.get(INST_ID, fetch), {'srv_inst.state.state': 'succeeded'})
+        self.assertEqual(fetch.calls, 1)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+
+    def test_concurrent_misses_share_one_fetch(self):
+        cache = InfoCache(ttl=60)
+        release = threading.Event()
+        fetch = SlowFetch(release)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get(INST_ID, fetch))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(fetch.calls, 1)
+
+    def test_errors_are_not_cached(self):
+        cache = InfoCache(ttl=60)
+        with self.assertRaises(Exception):
+            cache.get(INST_ID, SlowFetch(fail=True))
+        fetch = SlowFetch()
+        cache.get(INST_ID, fetch)
+        self.assertEqual(fetch.calls, 1)
+
+    def test_invalidate_and_disabled(self):
+        cache = InfoCache(ttl=60)
+        fetch = SlowFetch()
+        cache.get(INST_ID, fetch)
+        cache.invalidate(INST_ID)
+        cache.get(INST_ID, fetch)
+        self.assertEqual(fetch.calls, 2)
+
+        cache = InfoCache(ttl=0)
+        cache.get(INST_ID, fetch)
+        cache.get(INST_ID, fetch)
+        self.assertEqual(fetch.calls, 4)
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class TestResourceManagerInfoCache(unittest.TestCase):
+
+    def test_create_and_delete_invalidate(self):
+        with patch.object(RM, 'info_cache', InfoCache(ttl=60)):
+            backend = RM.backends['dummy']
+            with patch.object(backend, 'info', wraps=backend.info) as info:
+                RM.info(instance_id=INST_ID, manifest_type='dummy')
+                RM.info(instance_id=INST_ID, manifest_type='dummy')
+                self.assertEqual(info.call_count, 1)
+
+                RM.create(instance_id=INST_ID, content='', c_type='dummy')
+                RM.info(instance_id=INST_ID, manifest_type='dummy')
+                self.assertEqual(info.call_count, 2)
+
+                RM.delete(instance_id=INST_ID, manifest_type='dummy')
+                RM.info(instance_id=INST_ID, manifest_type='dummy')
+                self.assertEqual(info.call_count, 3)
+                self.assertEqual(RM.info_cache.stats()['invalidations'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
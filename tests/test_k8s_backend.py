@@ -14,8 +14,22 @@
 #    under the License.
 
 import inspect
+import shutil
+import tempfile
+import threading
+import time
 from unittest import TestCase
 from unittest import skipIf
+from unittest.mock import MagicMock, patch
+
+from kubernetes.client.rest import ApiException
+
+import yaml
+
+import config
+from adapters.store import InMemoryStore
+from esm.controllers.tasks import CreateInstance
+from esm.models import Manifest, Plan, ServiceRequest, ServiceType
 
 from adapters.log import get_logger, SentinelAgentInjector
 
@@ -112,6 +126,396 @@ class TestK8SBackendOffline(TestCase):
             self.assertEqual(False, outcome)
 
 
+def deployment(name, ready_replicas, replicas=1):
+    dep = MagicMock()
+    dep.metadata.name = name
+    dep.spec.replicas = replicas
+    dep.status.ready_replicas = ready_replicas
+    return dep
+
+
+def named(name):
+    obj = MagicMock()
+    obj.metadata.name = name
+    return obj
+
+
+def fake_cluster(k8s, ready_replicas=1):
+    """Lets the API of k8s answer with the objects of k8s_multi.yml."""
+    names = ['redis-master', 'redis-slave', 'frontend']
+    k8s.core_api_instance = MagicMock()
+    k8s.extensions_api_instance = MagicMock()
+    k8s.core_api_instance.read_namespace.side_effect = Exception('not found')
+    k8s.extensions_api_instance.list_namespaced_deployment.return_value.items = \
+        [deployment(name, ready_replicas) for name in names]
+    k8s.core_api_instance.list_namespaced_service.return_value.items = [named(name) for name in names]
+
+
+class TestK8SManifestCache(TestCase):
+    """Benchmark: info on a multi-document manifest, parsed from the saved file on every call or once."""
+    REQUESTS = 200
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.k8s = KubernetesBackend()
+        self.k8s.manifest_cache = self.tmp_dir
+        fake_cluster(self.k8s)
+        path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+        with open(path + "/manifests/k8s_multi.yml", "r") as mani:
+            self.content = mani.read()
+
+    def tearDown(self):
+        self.k8s.reaper.shutdown()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _latency(self, cached):
+        started = time.perf_counter()
+        for _ in range(self.REQUESTS):
+            if not cached:
+                self.k8s.manifests.clear()
+            info = self.k8s.info(instance_id=INST_ID)
+        self.assertEqual(info['srv_inst.state.state'], 'succeeded')
+        return (time.perf_counter() - started) / self.REQUESTS
+
+    @skipIf(os.getenv('BENCHMARK_TESTS', 'NO') != 'YES', "BENCHMARK_TESTS not set in environment variables")
+    def test_info_latency(self):
+        self.assertTrue(self.k8s.create(instance_id=INST_ID, content=self.content, c_type="kubernetes"))
+        parsing = self._latency(cached=False)
+        cached = self._latency(cached=True)
+        LOG.info('info of k8s_multi.yml: {:.3f}ms parsing the manifest, {:.3f}ms cached'.format(
+            parsing * 1000, cached * 1000))
+        self.assertLess(cached, parsing)
+
+    def test_hot_paths_do_not_parse(self):
+        self.assertTrue(self.k8s.create(instance_id=INST_ID, content=self.content, c_type="kubernetes"))
+        # 3 services and 3 deployments
+        self.assertEqual(self.k8s.extensions_api_instance.create_namespaced_deployment.call_count, 3)
+        self.assertEqual(self.k8s.core_api_instance.create_namespaced_service.call_count, 3)
+        with patch.object(yaml, 'safe_load_all') as safe_load_all:
+            self.k8s.info(instance_id=INST_ID)
+            self.assertTrue(self.k8s.delete(instance_id=INST_ID, c_type="kubernetes"))
+        self.assertFalse(safe_load_all.called)
+        self.assertNotIn(INST_ID, self.k8s.manifests)
+        self.assertEqual(self.k8s.core_api_instance.delete_namespace.call_count, 1)
+
+    def test_reads_saved_manifest_after_restart(self):
+        self.assertTrue(self.k8s.create(instance_id=INST_ID, content=self.content, c_type="kubernetes"))
+        created = self.k8s.manifests[INST_ID]
+        self.k8s.manifests.clear()
+        self.assertEqual(self.k8s.info(instance_id=INST_ID)['srv_inst.state.state'], 'succeeded')
+        self.assertEqual(self.k8s.manifests[INST_ID], created)
+
+
+class FakeWatch:
+    """Streams the events given to the test, like kubernetes.watch.Watch streams those of the API server."""
+    streams = 0
+
+    def __init__(self, events):
+        self.events = events
+        self.stopped = False
+
+    def stream(self, func, **kwargs):
+        FakeWatch.streams += 1
+        for event in self.events:
+            if self.stopped:
+                return
+            yield event
+
+    def stop(self):
+        self.stopped = True
+
+
+class TestK8SCreate(TestCase):
+    OBJECTS = 6  # services and deployments in k8s_multi.yml
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.k8s = KubernetesBackend()
+        self.k8s.manifest_cache = self.tmp_dir
+        self.k8s.reports_readiness = True
+        self.k8s.core_api_instance = MagicMock()
+        self.k8s.extensions_api_instance = MagicMock()
+        self.k8s.core_api_instance.read_namespace.side_effect = Exception('not found')
+        self.k8s.core_api_instance.create_namespaced_service.side_effect = self.slow_create
+        self.k8s.extensions_api_instance.create_namespaced_deployment.side_effect = self.slow_create
+        path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+        with open(path + "/manifests/k8s_multi.yml", "r") as mani:
+            self.content = mani.read()
+        self.states = list()
+        self.done = threading.Event()
+        self.barrier = None
+        FakeWatch.streams = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def slow_create(self, body, namespace):
+        if self.barrier is not None:
+            # only passes once all the objects are being created at the same time
+            self.barrier.wait(5)
+        return MagicMock()
+
+    def on_state(self, state, description):
+        self.states.append(state)
+        self.done.set()
+
+    def create(self, events):
+        with patch('kubernetes.watch.Watch', lambda: FakeWatch(events)):
+            outcome = self.k8s.create(instance_id=INST_ID, content=self.content, c_type="kubernetes",
+                                      on_state=self.on_state)
+            self.assertTrue(outcome)
+            self.done.wait(5)
+
+    def test_objects_are_created_concurrently(self):
+        events = [{'type': 'ADDED', 'object': deployment(name, 1)}
+                  for name in ['redis-master', 'redis-slave', 'frontend']]
+        self.barrier = threading.Barrier(self.OBJECTS)
+        with patch.object(config, 'esm_k8s_parallelism', self.OBJECTS):
+            self.create(events)
+        self.assertFalse(self.barrier.broken)
+        self.assertEqual(self.states, ['succeeded'])
+
+    def test_ready_once_all_deployments_are(self):
+        names = ['redis-master', 'redis-slave', 'frontend']
+        events = [{'type': 'ADDED', 'object': deployment(name, None)} for name in names] + \
+                 [{'type': 'MODIFIED', 'object': deployment(name, 1)} for name in names] + \
+                 [{'type': 'MODIFIED', 'object': deployment('unrelated', 1)}]
+        self.create(events)
+        self.assertEqual(self.states, ['succeeded'])
+        # one stream for the namespace, stopped as soon as everything is ready
+        self.assertEqual(FakeWatch.streams, 1)
+        self.assertFalse(self.k8s.extensions_api_instance.read_namespaced_deployment.called)
+
+    def test_not_ready_in_time(self):
+        events = [{'type': 'ADDED', 'object': deployment('redis-master', 0)}]
+        with patch.object(config, 'esm_k8s_ready_timeout', 0.2):
+            self.create(events)
+        self.assertEqual(self.states, ['failed'])
+
+    def test_failed_creation_is_reported(self):
+        self.k8s.extensions_api_instance.create_namespaced_deployment.side_effect = Exception('quota exceeded')
+        outcome = self.k8s.create(instance_id=INST_ID, content=self.content, c_type="kubernetes",
+                                  on_state=self.on_state)
+        self.assertFalse(outcome)
+        self.assertEqual(self.states, ['failed'])
+
+
+class TestK8SInfo(TestCase):
+
+    def setUp(self):
+        self.k8s = KubernetesBackend()
+        fake_cluster(self.k8s)
+        path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+        with open(path + "/manifests/k8s_multi.yml", "r") as mani:
+            self.manifests = list(yaml.safe_load_all(mani))
+
+    def test_one_list_call_per_kind(self):
+        info = self.k8s.get_info(self.manifests, INST_ID)
+        self.assertEqual(self.k8s.extensions_api_instance.list_namespaced_deployment.call_count, 1)
+        self.assertEqual(self.k8s.core_api_instance.list_namespaced_service.call_count, 1)
+        self.assertFalse(self.k8s.extensions_api_instance.read_namespaced_deployment.called)
+        self.assertFalse(self.k8s.core_api_instance.read_namespaced_service.called)
+        self.assertEqual(info['srv_inst.state.state'], 'succeeded')
+        for name in ['redis-master', 'redis-slave', 'frontend']:
+            self.assertEqual(info['{}_{}_Ip'.format(INST_ID, name)], 'pending')
+        self.assertEqual(info['environmentslave'], [{'name': 'GET_HOSTS_FROM', 'value': 'dns'}])
+
+    def test_list_items_are_mapped(self):
+        info = self.k8s.get_info([{'kind': 'List', 'items': self.manifests}], INST_ID)
+        self.assertEqual(self.k8s.extensions_api_instance.list_namespaced_deployment.call_count, 1)
+        self.assertEqual(info['srv_inst.state.state'], 'succeeded')
+
+    def test_state_is_the_worst_of_the_deployments(self):
+        self.k8s.extensions_api_instance.list_namespaced_deployment.return_value.items[1] = \
+            deployment('redis-slave', None)
+        info = self.k8s.get_info(self.manifests, INST_ID)
+        self.assertEqual(info['srv_inst.state.state'], 'in progress')
+
+    def test_missing_object(self):
+        self.k8s.core_api_instance.list_namespaced_service.return_value.items = []
+        info = self.k8s.get_info(self.manifests, INST_ID)
+        self.assertNotIn('srv_inst.state.state', info)
+
+
+class TestK8SDelete(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.k8s = KubernetesBackend()
+        self.k8s.manifest_cache = self.tmp_dir
+        self.k8s.reaper.interval = 0.05
+        fake_cluster(self.k8s)
+        path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+        with open(path + "/manifests/k8s_multi.yml", "r") as mani:
+            self.assertTrue(self.k8s.create(instance_id=INST_ID, content=mani.read(), c_type="kubernetes"))
+        self.mani_dir = os.path.join(self.tmp_dir, INST_ID)
+        self.namespace_gone = threading.Event()
+
+        def read_namespace(name):
+            if self.namespace_gone.is_set():
+                raise ApiException(status=404, reason='Not Found')
+            return MagicMock()
+        self.k8s.core_api_instance.read_namespace.side_effect = read_namespace
+
+    def tearDown(self):
+        self.k8s.reaper.shutdown()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def wait_reaped(self, reaped=1):
+        deadline = time.monotonic() + 5
+        while self.k8s.reaper.stats()['reaped'] + self.k8s.reaper.stats()['timed_out'] < reaped \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_deletes_the_namespace_and_reaps_it(self):
+        started = time.monotonic()
+        self.assertTrue(self.k8s.delete(instance_id=INST_ID, c_type="kubernetes"))
+        self.assertLess(time.monotonic() - started, 0.05)
+        self.k8s.core_api_instance.delete_namespace.assert_called_once()
+        self.assertEqual(self.k8s.core_api_instance.delete_namespace.call_args[1]['name'], INST_ID)
+        self.assertFalse(self.k8s.extensions_api_instance.delete_namespaced_deployment.called)
+        # the manifest is kept while the namespace is being deleted
+        time.sleep(0.2)
+        self.assertTrue(os.path.exists(self.mani_dir))
+        self.assertEqual(self.k8s.reaper.stats()['terminating'], [INST_ID])
+
+        self.namespace_gone.set()
+        self.wait_reaped()
+        self.assertFalse(os.path.exists(self.mani_dir))
+        self.assertEqual(self.k8s.reaper.stats(), {'terminating': [], 'reaped': 1, 'timed_out': 0})
+
+    def test_namespace_unknown_to_the_cache(self):
+        # created before namespaces were labelled: a synced cache never had it
+        self.k8s.cluster = MagicMock(synced=True)
+        self.k8s.cluster.has_namespace.return_value = False
+        self.assertTrue(self.k8s.delete(instance_id=INST_ID, c_type="kubernetes"))
+        time.sleep(0.2)
+        self.assertTrue(os.path.exists(self.mani_dir))
+        self.assertTrue(self.k8s.core_api_instance.read_namespace.called)
+
+        self.namespace_gone.set()
+        self.wait_reaped()
+        self.assertFalse(os.path.exists(self.mani_dir))
+        self.assertEqual(self.k8s.uncached_deletions, set())
+
+    def test_namespace_already_gone(self):
+        self.k8s.core_api_instance.delete_namespace.side_effect = ApiException(status=404, reason='Not Found')
+        self.assertFalse(self.k8s.delete(instance_id=INST_ID, c_type="kubernetes"))
+        self.assertFalse(os.path.exists(self.mani_dir))
+
+    def test_namespace_not_gone_in_time(self):
+        self.k8s.reaper.timeout = 0.1
+        self.assertTrue(self.k8s.delete(instance_id=INST_ID, c_type="kubernetes"))
+        self.wait_reaped()
+        self.assertEqual(self.k8s.reaper.stats()['timed_out'], 1)
+        # deleting it again asks for the deletion again
+        self.assertTrue(os.path.exists(self.mani_dir))
+        self.assertTrue(self.k8s.delete(instance_id=INST_ID, c_type="kubernetes"))
+        self.assertEqual(self.k8s.core_api_instance.delete_namespace.call_count, 2)
+
+
+    def test_deletion_is_resumed_after_a_restart(self):
+        store = InMemoryStore()
+        self.k8s.store = store
+        self.assertTrue(self.k8s.delete(instance_id=INST_ID, c_type="kubernetes"))
+        self.assertEqual(store.get_backend_ref(INST_ID, KubernetesBackend.DELETION_REF), [INST_ID])
+        self.k8s.reaper.shutdown()
+
+        restarted = KubernetesBackend(store=store)
+        restarted.manifest_cache = self.tmp_dir
+        restarted.core_api_instance = self.k8s.core_api_instance
+        restarted.reaper.interval = 0.05
+        try:
+            restarted.resume_deletions()
+            self.assertEqual(restarted.reaper.stats()['terminating'], [INST_ID])
+            self.namespace_gone.set()
+            deadline = time.monotonic() + 5
+            while restarted.reaper.stats()['reaped'] < 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(os.path.exists(self.mani_dir))
+            self.assertEqual(store.get_backend_ref(INST_ID, KubernetesBackend.DELETION_REF), [])
+        finally:
+            restarted.reaper.shutdown()
+
+    def test_deletion_not_resumed_once_given_up(self):
+        store = InMemoryStore()
+        self.k8s.store = store
+        self.k8s.reaper.timeout = 0.1
+        self.assertTrue(self.k8s.delete(instance_id=INST_ID, c_type="kubernetes"))
+        self.wait_reaped()
+        self.assertEqual(store.get_backend_refs(KubernetesBackend.DELETION_REF), {})
+
+
+class ReadinessRM:
+    def __init__(self):
+        self.on_state = None
+
+    def create(self, instance_id, content, c_type, **kwargs):
+        self.on_state = kwargs['on_state']
+
+    def reports_readiness_of(self, manifest_type):
+        return manifest_type == 'kubernetes'
+
+
+class TestCreateInstanceReadiness(TestCase):
+
+    @staticmethod
+    def setup_store():
+        store = InMemoryStore()
+        plan = Plan(id='k8s-plan', name='plan', description='plan', free=True, bindable=False)
+        store.add_service(ServiceType(id='k8s-svc', name='svc', description='svc', bindable=False, plans=[plan],
+                                      plan_updateable=False))
+        store.add_manifest(Manifest(id='k8s-mani', plan_id='k8s-plan', service_id='k8s-svc',
+                                    manifest_type='kubernetes', manifest_content=''))
+        return store
+
+    def test_operation_completes_when_backend_reports_ready(self):
+        store, rm = self.setup_store(), ReadinessRM()
+        entity = {'entity_id': INST_ID, 'entity_res': None, 'operation': 'provision-1',
+                  'entity_req': ServiceRequest(service_id='k8s-svc', plan_id='k8s-plan')}
+        CreateInstance(entity, {'STORE': store, 'RM': rm}).start()
+        self.assertEqual(store.get_service_instance(INST_ID)[0].state.state, 'in progress')
+        self.assertEqual(store.get_last_operation(INST_ID)[0].state, 'in progress')
+
+        rm.on_state('succeeded', 'ready')
+        self.assertEqual(store.get_service_instance(INST_ID)[0].state.state, 'succeeded')
+        last_op = store.get_last_operation(INST_ID)[0]
+        self.assertEqual((last_op.state, last_op.operation), ('succeeded', 'provision-1'))
+
+    @patch.object(config, 'esm_k8s_sync_ready_wait', 5)
+    def test_synchronous_create_waits_for_ready(self):
+        store, rm = self.setup_store(), ReadinessRM()
+        entity = {'entity_id': INST_ID, 'entity_res': None,
+                  'entity_req': ServiceRequest(service_id='k8s-svc', plan_id='k8s-plan')}
+        result = dict()
+        creating = threading.Thread(target=lambda: result.update(
+            zip(('entity', 'context'), CreateInstance(entity, {'STORE': store, 'RM': rm}).start())))
+        creating.start()
+        deadline = time.monotonic() + 5
+        while rm.on_state is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertTrue(creating.is_alive())  # not answered while the instance is in progress
+
+        rm.on_state('failed', 'not ready')
+        creating.join(5)
+        self.assertEqual(result['context']['status'][1], 500)
+        self.assertEqual(result['entity']['entity_res'].state.state, 'failed')
+        last_op = store.get_last_operation(INST_ID)[0]
+        self.assertEqual((last_op.state, last_op.operation), ('failed', None))
+
+    def test_synchronous_create_answers_in_progress_by_default(self):
+        store, rm = self.setup_store(), ReadinessRM()
+        entity = {'entity_id': INST_ID, 'entity_res': None,
+                  'entity_req': ServiceRequest(service_id='k8s-svc', plan_id='k8s-plan')}
+        entity, context = CreateInstance(entity, {'STORE': store, 'RM': rm}).start()
+        self.assertEqual(context['status'][1], 200)
+        self.assertEqual(entity['entity_res'].state.state, 'in progress')
+
+        rm.on_state('succeeded', 'ready')
+        self.assertEqual(store.get_service_instance(INST_ID)[0].state.state, 'succeeded')
+
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
@@ -0,0 +1,204 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from adapters.compose import LABEL_INSTANCE
+from adapters.k8s_cache import ClusterCache
+from adapters.resources import KubernetesBackend
+
+WATCH_TIMEOUT = 0.2
+
+
+class FakeApiServer:
+    """Serves lists and watches of namespaces, deployments and services from an in-memory event log."""
+    def __init__(self):
+        self.version = 0
+        self.compacted = 0  # versions up to this one can no longer be watched from
+        self.requests = 0
+        self.changed = threading.Condition()
+        self.namespaces = FakeResource(self)
+        self.deployments = FakeResource(self)
+        self.services = FakeResource(self)
+
+    def core_api(self):
+        return SimpleNamespace(list_namespace=self.namespaces.list,
+                               list_service_for_all_namespaces=self.services.list)
+
+    def extensions_api(self):
+        return SimpleNamespace(list_deployment_for_all_namespaces=self.deployments.list)
+
+    def instance(self, namespace, ready_replicas=1):
+        self.namespaces.put(namespace, None)
+        self.deployments.put('web', namespace, ready_replicas=ready_replicas)
+        self.services.put('web', namespace)
+
+    def compact(self):
+        with self.changed:
+            self.compacted = self.version
+
+
+class FakeResource:
+    def __init__(self, server):
+        self.server = server
+        self.objects = dict()
+        self.log = list()  # (version, event type, object)
+
+    def _change(self, kind, obj):
+        server = self.server
+        with server.changed:
+            server.version += 1
+            obj.metadata.resource_version = str(server.version)
+            if kind == 'DELETED':
+                self.objects.pop((obj.metadata.namespace, obj.metadata.name), None)
+            else:
+                self.objects[(obj.metadata.namespace, obj.metadata.name)] = obj
+            self.log.append((server.version, kind, obj))
+            server.changed.notify_all()
+
+    def put(self, name, namespace, ready_replicas=None):
+        kind = 'MODIFIED' if (namespace, name) in self.objects else 'ADDED'
+        obj = SimpleNamespace(metadata=SimpleNamespace(name=name, namespace=namespace,
+                                                       labels={LABEL_INSTANCE: namespace or name}),
+                              spec=SimpleNamespace(replicas=1,
+                                                   template=SimpleNamespace(spec=SimpleNamespace(containers=[]))),
+                              status=SimpleNamespace(ready_replicas=ready_replicas))
+        self._change(kind, obj)
+
+    def delete(self, name, namespace):
+        self._change('DELETED', self.objects[(namespace, name)])
+
+    def list(self, label_selector=None, **kwargs):
+        with self.server.changed:
+            self.server.requests += 1
+            return SimpleNamespace(items=list(self.objects.values()),
+                                   metadata=SimpleNamespace(resource_version=str(self.server.version)))
+
+    def watch(self, watch, resource_version, timeout_seconds, **kwargs):
+        server = self.server
+        deadline = time.monotonic() + timeout_seconds
+        with server.changed:
+            server.requests += 1
+            version = int(resource_version)
+            if version < server.compacted:
+                yield {'type': 'ERROR', 'raw_object': {'code': 410, 'message': 'too old resource version'}}
+                return
+        while not watch.stopped and time.monotonic() < deadline:
+            with server.changed:
+                events = [(v, k, o) for v, k, o in self.log if v > version]
+                if not events:
+                    server.changed.wait(max(0, deadline - time.monotonic()))
+                    continue
+            for v, kind, obj in events:
+                version = v
+                yield {'type': kind, 'object': obj, 'raw_object': {}}
+
+
+class FakeWatch:
+    def __init__(self):
+        self.stopped = False
+
+    def stream(self, func, **kwargs):
+        return func.__self__.watch(self, **kwargs)
+
+    def stop(self):
+        self.stopped = True
+
+
+def eventually(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestClusterCache(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeApiServer()
+        self.server.instance('inst-1')
+        self.watch = patch('kubernetes.watch.Watch', FakeWatch)
+        self.watch.start()
+        self.cache = ClusterCache(self.server.core_api(), self.server.extensions_api(), watch_timeout=WATCH_TIMEOUT)
+        self.cache.start()
+        self.assertTrue(self.cache.wait_synced(5))
+
+    def tearDown(self):
+        self.cache.stop()
+        self.watch.stop()
+
+    def test_lists_then_follows_changes(self):
+        self.assertTrue(self.cache.has_namespace('inst-1'))
+        self.assertEqual(list(self.cache.deployments.get('inst-1')), ['web'])
+
+        self.server.instance('inst-2', ready_replicas=None)
+        self.assertTrue(eventually(lambda: self.cache.has_namespace('inst-2')))
+        self.server.deployments.put('web', 'inst-2', ready_replicas=1)
+        self.assertTrue(eventually(
+            lambda: self.cache.deployments.find('web', 'inst-2').status.ready_replicas == 1))
+
+        self.server.services.delete('web', 'inst-1')
+        self.server.namespaces.delete('inst-1', None)
+        self.assertTrue(eventually(lambda: not self.cache.has_namespace('inst-1')))
+        self.assertEqual(self.cache.services.get('inst-1'), {})
+
+    def test_streams_resume_from_the_last_version(self):
+        self.assertTrue(eventually(lambda: self.cache.deployments.watches >= 3))
+        self.server.deployments.put('worker', 'inst-1')
+        self.assertTrue(eventually(lambda: self.cache.deployments.find('worker', 'inst-1') is not None))
+        # several streams ended, none of them needed a new list
+        self.assertEqual(self.cache.deployments.lists, 1)
+
+    def test_lists_again_when_the_version_is_gone(self):
+        # changes the cache cannot watch any more, e.g. made while it was disconnected
+        self.cache.stop()
+        time.sleep(WATCH_TIMEOUT * 2)
+        self.cache.namespaces._stopped = False
+        self.server.instance('inst-3')
+        self.server.compact()
+        self.cache.namespaces.start()
+        self.assertTrue(eventually(lambda: self.cache.has_namespace('inst-3')))
+        self.assertEqual(self.cache.namespaces.lists, 2)
+
+    def test_no_requests_between_changes(self):
+        self.assertTrue(eventually(lambda: self.cache.deployments.watches >= 1))
+        k8s = KubernetesBackend()
+        k8s.core_api_instance = MagicMock()
+        k8s.extensions_api_instance = MagicMock()
+        k8s.cluster = self.cache
+        manifests = [{'kind': 'Service', 'metadata': {'name': 'web'}, 'spec': {}},
+                     {'kind': 'Deployment', 'metadata': {'name': 'web'},
+                      'spec': {'template': {'spec': {'containers': []}}}}]
+        requests = self.server.requests
+        for _ in range(100):
+            info = k8s.get_info(manifests, 'inst-1')
+        self.assertEqual(info['srv_inst.state.state'], 'succeeded')
+        self.assertFalse(k8s.extensions_api_instance.list_namespaced_deployment.called)
+        self.assertFalse(k8s.core_api_instance.list_namespaced_service.called)
+        # only the streams that timed out were renewed
+        self.assertLessEqual(self.server.requests - requests, 3 * 2)
+
+        # instances the cache does not know are read from the API server
+        k8s.get_info(manifests, 'unlabelled')
+        self.assertTrue(k8s.extensions_api_instance.list_namespaced_deployment.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
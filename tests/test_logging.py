@@ -0,0 +1,141 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import logging
+import time
+import unittest
+from unittest.mock import patch
+
+import config
+from adapters import log
+from adapters.log import RateLimitFilter
+from adapters.resources import RM, InfoCache
+from adapters.store import InMemoryStore, STORE
+from esm.models import LastOperation, Manifest, Plan, ServiceInstance, ServiceType
+
+from . import BaseTestCase
+
+
+def record(msg, level=logging.INFO, lineno=1):
+    return logging.LogRecord('esm', level, __file__, lineno, msg, None, None)
+
+
+class loggers_at:
+    """Sets all ESM loggers to level for the duration of a with block."""
+    def __init__(self, level):
+        self.level = level
+        self.saved = dict()
+
+    def __enter__(self):
+        for name, logger in logging.Logger.manager.loggerDict.items():
+            if isinstance(logger, logging.Logger) and name.split('.')[0] in ('adapters', 'esm'):
+                self.saved[logger] = logger.level
+                logger.setLevel(self.level)
+
+    def __exit__(self, *exc):
+        for logger, level in self.saved.items():
+            logger.setLevel(level)
+
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    def test_limits_each_call_site(self):
+        limit = RateLimitFilter(rate=1, burst=2)
+        passed = [limit.filter(record('noisy')) for _ in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+        # another call site has its own budget, warnings are never dropped
+        self.assertTrue(limit.filter(record('other', lineno=2)))
+        self.assertTrue(limit.filter(record('important', level=logging.WARNING)))
+
+        time.sleep(1.1)
+        next_one = record('noisy')
+        self.assertTrue(limit.filter(next_one))
+        self.assertEqual(next_one.getMessage(), 'noisy (3 similar messages suppressed)')
+
+    def test_disabled(self):
+        limit = RateLimitFilter(rate=0)
+        self.assertTrue(all(limit.filter(record('noisy')) for _ in range(100)))
+
+
+    @patch.object(config, 'esm_log_rate_burst', 2)
+    @patch.object(config, 'esm_log_rate_limit', 1)
+    @patch.object(config, 'esm_log_async', 'NO')
+    def test_attached_without_async_logging(self):
+        root = logging.getLogger()
+        handlers, level = root.handlers[:], root.level
+        root.handlers = []
+        try:
+            with patch.object(log, '_listener', None):
+                log.setup_logging()
+            self.assertEqual(len(root.handlers), 1)
+            self.assertIsInstance(root.handlers[0], logging.StreamHandler)
+            self.assertTrue(any(isinstance(f, RateLimitFilter) for f in root.handlers[0].filters))
+        finally:
+            root.handlers = handlers
+            root.setLevel(level)
+
+
+class TestLazyFormatting(unittest.TestCase):
+
+    def test_disabled_level_does_not_render_models(self):
+        store = InMemoryStore()
+        instance = ServiceInstance(state=LastOperation(state='succeeded'), context={'id': 'lazy'})
+        with loggers_at(logging.WARNING), patch.object(ServiceInstance, 'to_str') as to_str:
+            store.add_service_instance(instance)
+            store.add_service_instance(instance)
+        self.assertFalse(to_str.called)
+
+
+class TestLoggingLatency(BaseTestCase):
+    """Benchmark: latency of an instance GET, which logs the backend info, with DEBUG on and off."""
+    REQUESTS = 200
+    # the dummy backend's info carries this id, which is merged into the instance context
+    INSTANCE_ID = 'this_is_a_test_instance'
+
+    def setUp(self):
+        super().setUp()
+        plan = Plan(id='log-plan', name='log plan', description='plan', free=True, bindable=False)
+        self.service = ServiceType(id='log-svc', name='log_svc', description='service', bindable=False,
+                                   plans=[plan], plan_updateable=False)
+        STORE.add_service(self.service)
+        STORE.add_manifest(Manifest(id='log-mani', plan_id=plan.id, service_id=self.service.id,
+                                    manifest_type='dummy', manifest_content='', endpoints={}))
+        STORE.add_service_instance(ServiceInstance(
+            service_type=self.service, state=LastOperation(state='succeeded', description='created'),
+            context={'id': self.INSTANCE_ID, 'manifest_id': 'log-mani'}))
+
+    def tearDown(self):
+        STORE.delete_service_instance(self.INSTANCE_ID)
+        STORE.delete_manifest('log-mani')
+        STORE.delete_service(self.service.id)
+
+    def _latency(self, level):
+        with loggers_at(level), patch.object(RM, 'info_cache', InfoCache(ttl=0)):
+            started = time.perf_counter()
+            for _ in range(self.REQUESTS):
+                response = self.client.open('/v2/et/service_instances/{}'.format(self.INSTANCE_ID), method='GET',
+                                            headers=[('X_Broker_Api_Version', '2.12')])
+                self.assert200(response)
+            return (time.perf_counter() - started) / self.REQUESTS
+
+    def test_request_latency_debug_on_and_off(self):
+        self._latency(logging.WARNING)  # warm up
+        debug = self._latency(logging.DEBUG)
+        quiet = self._latency(logging.WARNING)
+        print('GET /v2/et/service_instances/<id>: {:.3f}ms with DEBUG, {:.3f}ms with WARNING'.format(
+            debug * 1000, quiet * 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from adapters.log import SentinelLogHandler
+
+
+def record(msg, args=None):
+    return logging.LogRecord('measurer', logging.WARN, __file__, 1, msg, args, None)
+
+
+class TestSentinelLogHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.backup = os.path.join(tempfile.mkdtemp(), 'backup.log')
+        patcher = patch('adapters.log.KafkaProducer')
+        self.producer_cls = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_producer_for_all_records(self):
+        handler = SentinelLogHandler(backup_file=self.backup, space='space', series='series')
+        for i in range(20):
+            handler.emit(record('instance-{}#down'.format(i)))
+        handler.flush()
+        handler.close()
+
+        self.assertEqual(self.producer_cls.call_count, 1)
+        producer = self.producer_cls.return_value
+        self.assertEqual(producer.send.call_count, 20)
+        self.assertEqual(producer.send.call_args[0][0], 'space')
+        producer.close.assert_called_once()
+
+    def test_sends_the_formatted_message(self):
+        handler = SentinelLogHandler(backup_file=self.backup)
+        handler.emit(record('%s#down for %ds', ('instance-1', 3)))
+        handler.flush()
+        handler.close()
+
+        value = self.producer_cls.return_value.send.call_args[1]['value']
+        self.assertIn('"instance_id": "instance-1"', value)
+        self.assertIn('"msg": "down for 3s"', value)
+
+    def test_failed_delivery_goes_to_backup_file(self):
+        errbacks = []
+        self.producer_cls.return_value.send.return_value.add_errback.side_effect = errbacks.append
+        handler = SentinelLogHandler(backup_file=self.backup)
+        handler.emit(record('undelivered'))
+        handler.flush()
+        # the producer fails the batch after send() returned
+        errbacks[0](Exception('broker down'))
+        handler.close()
+
+        with open(self.backup) as backup:
+            self.assertIn('undelivered', backup.read())
+
+    def test_overflow_goes_to_backup_file(self):
+        sending = threading.Event()
+        release = threading.Event()
+
+        def blocked_send(*args, **kwargs):
+            sending.set()
+            release.wait(5)
+            return MagicMock()
+        self.producer_cls.return_value.send.side_effect = blocked_send
+
+        with patch('config.sen_queue_size', 2):
+            handler = SentinelLogHandler(backup_file=self.backup)
+        handler.emit(record('first'))
+        self.assertTrue(sending.wait(5))
+        # sender is busy with the first record: two fit in the queue, the rest spill
+        for msg in ['second', 'third', 'fourth', 'fifth']:
+            handler.emit(record(msg))
+        release.set()
+        handler.close()
+
+        with open(self.backup) as backup:
+            spilled = backup.read()
+        self.assertIn('fourth', spilled)
+        self.assertIn('fifth', spilled)
+        self.assertNotIn('second', spilled)
+        self.assertEqual(self.producer_cls.return_value.send.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,10 +18,13 @@ from __future__ import absolute_import
 
 import inspect
 import os
+import time
 import unittest
+from unittest.mock import patch
 
 from flask import json
 
+from adapters.generic import EXECUTOR
 from adapters.store import STORE
 from esm.models.manifest import Manifest
 from esm.models.plan import Plan
@@ -29,6 +32,7 @@ from esm.models.service_type import ServiceType
 from esm.models.binding_request import BindingRequest
 from esm.models.service_request import ServiceRequest
 from esm.models.update_request import UpdateRequest
+from esm.controllers.tasks import CreateInstance
 
 from . import BaseTestCase
 
@@ -164,6 +168,19 @@ class TestServiceInstancesController(BaseTestCase):
         self.assert404(response, "Response body is : " + response.data.decode('utf-8'))
         self._send_service_request()
 
+    @patch.object(EXECUTOR, 'submit', return_value=False)
+    def test_async_deprovision_rejected_when_queue_full(self, mock_submit):
+        query_string = [('service_id', self.test_service.id),
+                        ('plan_id', self.test_plan.id),
+                        ('accept_incomplete', True)]
+        response = self.client.open('/v2/service_instances/{instance_id}'.format(instance_id=self.instance_id),
+                                    method='DELETE',
+                                    query_string=query_string,
+                                    headers=[('X_Broker_Api_Version', '2.12')])
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(mock_submit.call_args[1]['backend'], self.test_manifest.manifest_type)
+
     def test_create_service_instance_with_params(self):
         """
         Test case for create_service_instance
@@ -236,6 +253,23 @@ class TestServiceInstancesController(BaseTestCase):
         self.assert200(response, "Response body is : " + resp_body)
         self.assertTrue(len(json.loads(resp_body)) == 1)
 
+    def test_all_instance_info_paged_with_errors(self):
+        headers = [('X_Broker_Api_Version', '2.12')]
+        response = self.client.open('/v2/et/service_instances', method='GET', headers=headers,
+                                    query_string=[('limit', 1), ('offset', 1)])
+        self._assert200(response)
+        self.assertEqual(json.loads(response.data.decode('utf-8')), [])
+        self.assertEqual(response.headers['X-Total-Count'], '1')
+
+        # a failing backend does not fail the listing, the instance carries the error instead
+        with patch('adapters.resources.RM.info', side_effect=Exception('backend down')):
+            response = self.client.open('/v2/et/service_instances', method='GET', headers=headers,
+                                        query_string=[('limit', 1)])
+        self._assert200(response)
+        instances = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(len(instances), 1)
+        self.assertEqual(instances[0]['context']['retrieve_error'], 'backend down')
+
     def test_instance_info(self):
         """
         Test case for instance_info
@@ -275,6 +309,80 @@ class TestServiceInstancesController(BaseTestCase):
                                     query_string=query_string, headers=headers)
         self.assert200(response, "Response body is : " + response.data.decode('utf-8'))
 
+    def test_async_create_last_operation_from_store(self):
+        self._delete_service_instance()
+        service = ServiceRequest(service_id=self.test_service.id, plan_id=self.test_plan.id,
+                                 organization_guid='org', space_guid='space')
+        headers = [('X_Broker_Api_Version', '2.12')]
+        response = self.client.open('/v2/service_instances/{instance_id}'.format(instance_id=self.instance_id),
+                                    method='PUT', data=json.dumps(service), content_type='application/json',
+                                    query_string=[('accept_incomplete', True)], headers=headers)
+        self.assertEqual(response.status_code, 202, "Response body is : " + response.data.decode('utf-8'))
+        operation = json.loads(response.data.decode('utf-8'))['operation']
+
+        deadline = time.time() + 30
+        while EXECUTOR.pending(self.instance_id)[0] and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(EXECUTOR.pending(self.instance_id)[0])
+
+        # the poll is answered from the recorded operation, the backend is not asked
+        with patch('adapters.resources.RM.info') as mock_info:
+            response = self.client.open('/v2/service_instances/{instance_id}/last_operation'.format(
+                instance_id=self.instance_id), method='GET', query_string=[('operation', operation)],
+                headers=headers)
+        self._assert200(response)
+        self.assertFalse(mock_info.called)
+        last_op = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(last_op['state'], 'succeeded')
+        self.assertEqual(last_op['operation'], operation)
+
+    def _send_async_service_request(self, plan_id=None):
+        service = ServiceRequest(service_id=self.test_service.id, plan_id=plan_id or self.test_plan.id,
+                                 organization_guid='org', space_guid='space')
+        return self.client.open('/v2/service_instances/{instance_id}'.format(instance_id=self.instance_id),
+                                method='PUT', data=json.dumps(service), content_type='application/json',
+                                query_string=[('accept_incomplete', True)],
+                                headers=[('X_Broker_Api_Version', '2.12')])
+
+    def test_async_create_is_validated_before_it_is_accepted(self):
+        # the instance of setUp exists already
+        response = self._send_async_service_request()
+        self.assertEqual(response.status_code, 409, "Response body is : " + response.data.decode('utf-8'))
+
+        self._delete_service_instance()
+        response = self._send_async_service_request(plan_id='no-such-plan')
+        self.assertEqual(response.status_code, 404, "Response body is : " + response.data.decode('utf-8'))
+        self.assertFalse(EXECUTOR.pending(self.instance_id)[0])
+        # tearDown deletes the instance
+        self.response = self._send_service_request()
+
+    def test_async_create_records_failure_found_when_run(self):
+        self._delete_service_instance()
+        entity = {'entity_id': self.instance_id, 'operation': 'provision-1',
+                  'entity_req': ServiceRequest(service_id=self.test_service.id, plan_id=self.test_plan.id,
+                                               organization_guid='org', space_guid='space')}
+        # the manifest is gone by the time the accepted operation runs
+        with patch.object(STORE, 'get_manifest', return_value=[]):
+            _, context = CreateInstance(entity, {'STORE': STORE, 'RM': None}).start()
+        self.assertEqual(context['status'][1], 404)
+        last_op = STORE.get_last_operation(self.instance_id)[0]
+        self.assertEqual((last_op.state, last_op.operation), ('failed', 'provision-1'))
+        STORE.delete_last_operation(self.instance_id)
+        self.response = self._send_service_request()
+
+    def test_last_operation_of_another_operation(self):
+        self._delete_service_instance()
+        response = self._send_async_service_request()
+        self.assertEqual(response.status_code, 202, "Response body is : " + response.data.decode('utf-8'))
+        deadline = time.time() + 30
+        while EXECUTOR.pending(self.instance_id)[0] and time.time() < deadline:
+            time.sleep(0.05)
+
+        response = self.client.open('/v2/service_instances/{instance_id}/last_operation'.format(
+            instance_id=self.instance_id), method='GET', query_string=[('operation', 'provision-other')],
+            headers=[('X_Broker_Api_Version', '2.12')])
+        self.assert400(response, "Response body is : " + response.data.decode('utf-8'))
+
     def test_service_bind_unbind(self):
         """
         Test case for service_bind, service_unbind
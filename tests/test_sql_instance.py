@@ -90,9 +90,9 @@ class TestCaseServiceInstance(unittest.TestCase):
         self.assertGreater(len(models), 0)
         self.assertIsInstance(models[0], ServiceInstance)
 
-    @patch.object(Adapter, 'exists_in_db')
-    def test_get_instance_with_id_and_not_found(self, mock_exists_in_db):
-        mock_exists_in_db.return_value = False
+    @patch.object(Adapter, 'find_by_id_name')
+    def test_get_instance_with_id_and_not_found(self, mock_find_by_id_name):
+        mock_find_by_id_name.return_value = None
         models = SQLStore.get_service_instance(self.id_name)
         self.assertEqual(models, [])
 
@@ -100,6 +100,14 @@ class TestCaseServiceInstance(unittest.TestCase):
         models = SQLStore.get_service_instance(instance_id=None)
         self.assertNotEqual(models, [])
 
+    def test_get_all_eager_loads_service_types(self):
+        with patch.object(ServiceTypeAdapter, 'find_by_id_name') as mock_find_by_id_name:
+            models = Adapter.get_all()
+            mock_find_by_id_name.assert_not_called()
+        model = [m for m in models if Adapter.get_id(m) == self.id_name][0]
+        self.assertEqual(model.service_type.id, self.service.id)
+        self.assertEqual(len(model.service_type.plans), len(self.service.plans))
+
     def test_instance_created(self):
         self.assertEqual(self.result, 200, msg='Assert Successful Add')
         exists = Adapter.exists_in_db(self.id_name)
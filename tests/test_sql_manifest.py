@@ -117,9 +117,9 @@ class TestCaseManifest(unittest.TestCase):
     #     self.assertGreater(len(result), 0)
     #     self.assertIsInstance(result[0], Manifest)
 
-    @patch.object(ManifestAdapter, 'exists_in_db')
-    def test_get_manifest_with_id_and_not_found(self, mock_exists_in_db):
-        mock_exists_in_db.return_value = False
+    @patch.object(ManifestAdapter, 'find_by_id_name')
+    def test_get_manifest_with_id_and_not_found(self, mock_find_by_id_name):
+        mock_find_by_id_name.return_value = None
         manifests = SQLStore.get_manifest(self.test_model.id)
         self.assertEqual(manifests, [])
 
@@ -149,6 +149,21 @@ class TestCaseManifest(unittest.TestCase):
         _, result = SQLStore.add_manifest(self.test_model)
         self.assertEqual(result, 409, msg='Assert Manifest Already Exists')
 
+    def test_add_manifest_unknown_plan(self):
+        model = ManifestAdapter.sample_model('manifest2')
+        model.service_id = self.service.id
+        model.plan_id = 'unknown-plan'
+        text, result = SQLStore.add_manifest(model)
+        self.assertEqual(result, 500)
+        self.assertIn('Plan and Service don\'t exist', text)
+
+    @patch.object(ManifestAdapter, 'save')
+    def test_add_manifest_db_error(self, mock_save):
+        mock_save.side_effect = QueryException('INSERT', [], Exception('Lost connection'))
+        model = ManifestAdapter.sample_model('manifest2')
+        with self.assertRaises(QueryException):
+            SQLStore.add_manifest(model)
+
     def test_delete_manifest_nonexistent(self):
         _, result = SQLStore.delete_manifest(self.test_model.id)
         _, result = SQLStore.delete_manifest(self.test_model.id)
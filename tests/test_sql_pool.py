@@ -0,0 +1,105 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+import unittest
+
+from adapters.sql_store import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise Exception('lost connection')
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = []
+
+        def creator():
+            conn = FakeConnection()
+            self.raw.append(conn)
+            return conn
+
+        self.pool = ConnectionPool(creator, size=2, wait_timeout=0.2, idle_timeout=60, max_lifetime=600)
+
+    def test_connection_is_reused(self):
+        conn = self.pool.acquire()
+        conn.close()
+        conn = self.pool.acquire()
+        conn.close()
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertFalse(self.raw[0].closed)
+
+    def test_double_close_releases_once(self):
+        conn = self.pool.acquire()
+        conn.close()
+        conn.close()
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    def test_pool_is_bounded(self):
+        first = self.pool.acquire()
+        self.pool.acquire()
+        with self.assertRaises(Exception):
+            self.pool.acquire()
+        self.assertEqual(self.pool.stats()['created'], 2)
+
+        threading.Timer(0.05, first.close).start()
+        conn = self.pool.acquire()
+        self.assertIsNotNone(conn)
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 2)
+        self.assertGreater(stats['wait_time'], 0)
+
+    def test_unhealthy_connection_is_replaced(self):
+        self.pool.PING_AFTER = 0
+        conn = self.pool.acquire()
+        conn.close()
+        self.raw[0].alive = False
+        self.pool.acquire()
+        self.assertTrue(self.raw[0].closed)
+        self.assertEqual(self.pool.stats()['created'], 2)
+
+    def test_idle_and_lifetime_expiry(self):
+        self.pool.idle_timeout = 0.01
+        conn = self.pool.acquire()
+        conn.close()
+        time.sleep(0.02)
+        self.pool.acquire().close()
+        self.assertTrue(self.raw[0].closed)
+
+        self.pool.idle_timeout = 60
+        self.pool.max_lifetime = 0
+        self.pool.acquire().close()
+        self.assertEqual(self.pool.stats()['idle'], 0)
+        self.assertEqual(self.pool.stats()['closed'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -77,14 +77,29 @@ class TestCaseServiceType(unittest.TestCase):
         exists = ServiceTypeAdapter.exists_in_db(model_sql.id_name)
         self.assertTrue(exists)
 
+    def test_adapter_save_with_the_name_of_another_service(self):
+        other = ServiceTypeAdapter.sample_model('service2')
+        other.name = self.test_model.name
+        with self.assertRaises(Exception):
+            ServiceTypeAdapter.save(other)
+        self.assertEqual(ServiceTypeAdapter.find_by_id_name(self.test_model.id).name, self.test_model.name)
+        self.assertFalse(ServiceTypeAdapter.exists_in_db(other.id))
+
+    def test_adapter_save_unlinks_dropped_plans(self):
+        kept = self.test_model.plans[0]
+        self.test_model.plans = [kept]
+        model_sql = ServiceTypeAdapter.save(self.test_model)
+        model_sql = ServiceTypeAdapter.find_by_id_name(model_sql.id_name)
+        self.assertEqual([plan.id_name for plan in model_sql.plans], [kept.id])
+
     def test_get_service_with_id(self):
         services = SQLStore.get_service(service_id=self.test_model.id)
         self.assertGreater(len(services), 0)
         self.assertIsInstance(services[0], ServiceType)
 
-    @patch.object(ServiceTypeAdapter, 'exists_in_db')
-    def test_get_service_with_id_and_not_found(self, mock_exists_in_db):
-        mock_exists_in_db.return_value = False
+    @patch.object(ServiceTypeAdapter, 'find_by_id_name')
+    def test_get_service_with_id_and_not_found(self, mock_find_by_id_name):
+        mock_find_by_id_name.return_value = None
         services = SQLStore.get_service(self.test_model.id)
         self.assertEqual(services, [])
 
@@ -0,0 +1,91 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+from unittest import skipIf
+from unittest.mock import patch
+import unittest
+import os
+
+if os.getenv('MYSQL_TESTS', 'NO') == 'YES':
+    from pymysql.cursors import Cursor
+    from adapters.sql_store import ManifestAdapter, PlanAdapter, PlanServiceTypeAdapter, ServiceInstanceAdapter, \
+        ServiceTypeAdapter, LastOperationAdapter
+    from adapters.store import SQLStore
+
+
+class StatementCounter:
+    """Counts the SQL statements sent to MySQL while active."""
+    def __enter__(self):
+        self.count = 0
+        original = Cursor.execute
+
+        def execute(cursor, query, args=None):
+            self.count += 1
+            return original(cursor, query, args)
+
+        self._patch = patch.object(Cursor, 'execute', execute)
+        self._patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._patch.stop()
+
+
+@skipIf(os.getenv('MYSQL_TESTS', 'NO') != 'YES', "MYSQL_TESTS not set in environment variables")
+class TestCaseStatementsPerOperation(unittest.TestCase):
+    """
+    Upper bounds on the statements issued per broker operation, with the tables already in place.
+    A failure here means a change added DB round-trips to that operation.
+    """
+    def setUp(self):
+        PlanAdapter.create_table()
+        ServiceTypeAdapter.create_table()
+        PlanServiceTypeAdapter.create_table()
+        ManifestAdapter.create_table()
+        ServiceInstanceAdapter.create_table()
+        LastOperationAdapter.create_table()
+        self.service = ServiceTypeAdapter.sample_model('statements1')
+        self.manifest = ManifestAdapter.sample_model('statements1')
+        self.instance = ServiceInstanceAdapter.sample_model('statements1')
+        self.instance.context = {'id': 'statements1-instance'}
+        self.instance_id = ServiceInstanceAdapter.get_id(self.instance)
+
+    def tearDown(self):
+        SQLStore.delete_service_instance(self.instance_id)
+        SQLStore.delete_manifest(self.manifest.id)
+        SQLStore.delete_service(self.service.id)
+
+    def assertStatements(self, budget, operation, *args):
+        with StatementCounter() as counter:
+            operation(*args)
+        self.assertLessEqual(counter.count, budget, msg='{} issued {} statements, budget is {}'.format(
+            operation.__name__, counter.count, budget))
+
+    def test_broker_operations(self):
+        # catalog: exists check, name check, service upsert, one upsert per plan, one pivot insert
+        self.assertStatements(3 + len(self.service.plans) + 1, SQLStore.add_service, self.service)
+        self.assertStatements(2, SQLStore.get_service, self.service.id)
+        self.assertStatements(2, SQLStore.get_service)
+        self.assertStatements(4, SQLStore.add_manifest, self.manifest)
+        self.assertStatements(1, SQLStore.get_manifest, self.manifest.id)
+        # provision
+        self.assertStatements(3, SQLStore.add_service_instance, self.instance)
+        self.assertStatements(3, SQLStore.add_service_instance, self.instance)
+        self.assertStatements(3, SQLStore.get_service_instance, self.instance_id)
+        self.assertStatements(3, SQLStore.get_service_instance)
+        # last operation
+        self.assertStatements(3, SQLStore.add_last_operation, self.instance_id, self.instance.state)
+        self.assertStatements(1, SQLStore.get_last_operation, self.instance_id)
+        # deprovision
+        self.assertStatements(3, SQLStore.delete_service_instance, self.instance_id)
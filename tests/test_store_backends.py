@@ -16,9 +16,12 @@
 import os
 import inspect
 import json
+import logging
+import timeit
 from unittest import TestCase
 from unittest import skipIf
 
+from adapters.log import get_logger
 from adapters.store import InMemoryStore
 from adapters.store import MongoDBStore
 from adapters.store import Store
@@ -29,6 +32,8 @@ from esm.models.service_instance import ServiceInstance
 from esm.models.manifest import Manifest
 from esm.models.last_operation import LastOperation
 
+LOG = get_logger(__name__)
+
 
 class TestInMemoryStore(TestCase):
     def setUp(self):
@@ -113,6 +118,23 @@ class TestInMemoryStore(TestCase):
         self.store.add_last_operation(self.test_svc_instance.context['id'], self.test_last_op)
         self.assertIsNotNone(self.store.get_last_operation(self.test_svc_instance.context['id']))
 
+    def test_get_manifest_by_plan(self):
+        self.store.add_service(self.test_service)
+        self.store.add_manifest(self.test_manifest)
+        manifests = self.store.get_manifest(plan_id=self.test_plan.id)
+        self.assertEqual(len(manifests), 1)
+        self.assertEqual(manifests[0].id, self.test_manifest.id)
+        self.assertEqual(self.store.get_manifest(plan_id='no-such-plan'), [])
+
+    def test_get_manifest_by_plan_with_several(self):
+        self.store.add_service(self.test_service)
+        self.store.add_manifest(self.test_manifest)
+        other = Manifest(id='test-mani-2', plan_id=self.test_plan.id, service_id=self.test_service.id,
+                         manifest_type='dummy', manifest_content='', endpoints={})
+        self.store.add_manifest(other)
+        manifests = self.store.get_manifest(plan_id=self.test_plan.id)
+        self.assertEqual(sorted(m.id for m in manifests), ['test-mani', 'test-mani-2'])
+
     def test_get_all(self):
         self.store.add_service(self.test_service)
         services = self.store.get_service()
@@ -166,6 +188,19 @@ class TestInMemoryStore(TestCase):
         self.store.delete_last_operation()
         self.assertGreaterEqual(len(self.store.get_last_operation()), 0)
 
+    def test_backend_ref(self):
+        _, result = self.store.add_backend_ref('inst-1', 'epm', 'rg-1')
+        self.assertEqual(result, 200)
+        _, result = self.store.add_backend_ref('inst-1', 'epm', 'rg-2')
+        self.assertEqual(result, 200)
+        self.store.add_backend_ref('inst-1', 'other', 'ref')
+        self.assertEqual(self.store.get_backend_ref('inst-1', 'epm'), ['rg-2'])
+        self.assertEqual(self.store.get_backend_ref('inst-2', 'epm'), [])
+        self.assertEqual(self.store.get_backend_refs('epm'), {'inst-1': 'rg-2'})
+        self.store.delete_backend_ref('inst-1', 'epm')
+        self.assertEqual(self.store.get_backend_ref('inst-1', 'epm'), [])
+        self.assertEqual(self.store.get_backend_ref('inst-1', 'other'), ['ref'])
+
 
 @skipIf(os.getenv('MONGODB_TESTS', 'NO') != 'YES', "MONGODB_TESTS not set in environment variables")
 class TestMongoDBStore(TestInMemoryStore):
@@ -194,6 +229,61 @@ class TestMongoDBStore(TestInMemoryStore):
     def test_add(self):
         super().test_add()
 
+    def test_get_manifest_by_plan(self):
+        super().test_get_manifest_by_plan()
+
+
+@skipIf(os.getenv('BENCHMARK_TESTS', 'NO') != 'YES', "BENCHMARK_TESTS not set in environment variables")
+class TestInMemoryStoreLookupBenchmark(TestCase):
+    """
+    Micro-benchmark: the cost of a lookup by id must not grow with the number of stored entities.
+    """
+    SIZES = [10, 100, 1000, 10000, 100000]
+    LOOKUPS = 2000
+    # generous bound to absorb timer noise; a linear scan would be ~10000x slower at 100k
+    MAX_GROWTH = 10
+
+    def setUp(self):
+        self.store_log = logging.getLogger('adapters.store')
+        self.store_log_level = self.store_log.level
+        self.store_log.setLevel(logging.ERROR)
+
+    def tearDown(self):
+        self.store_log.setLevel(self.store_log_level)
+
+    def _populate(self, size):
+        store = InMemoryStore()
+        for i in range(size):
+            plan = Plan(id='plan-{}'.format(i), name='plan', description='plan')
+            svc = ServiceType(id='svc-{}'.format(i), name='svc', description='svc', bindable=False, plans=[plan])
+            store.add_service(svc)
+            store.add_manifest(Manifest(id='mani-{}'.format(i), plan_id=plan.id, service_id=svc.id,
+                                        manifest_type='dummy', manifest_content='version: "2"'))
+            store.add_service_instance(ServiceInstance(service_type=svc, context={'id': 'inst-{}'.format(i)}))
+            store.add_last_operation('inst-{}'.format(i), LastOperation(state='succeeded', description='bench'))
+        return store
+
+    def _lookup_cost(self, store, size):
+        key = size // 2
+
+        def lookups():
+            store.get_service('svc-{}'.format(key))
+            store.get_manifest(plan_id='plan-{}'.format(key))
+            store.get_manifest(manifest_id='mani-{}'.format(key))
+            store.get_service_instance('inst-{}'.format(key))
+            store.get_last_operation('inst-{}'.format(key))
+
+        return min(timeit.repeat(lookups, number=self.LOOKUPS, repeat=5)) / self.LOOKUPS
+
+    def test_lookup_cost_is_flat(self):
+        costs = dict()
+        for size in self.SIZES:
+            costs[size] = self._lookup_cost(self._populate(size), size)
+            LOG.info('InMemoryStore lookups N={size:>6}: {cost:.2f} us'.format(size=size, cost=costs[size] * 1e6))
+
+        smallest, largest = self.SIZES[0], self.SIZES[-1]
+        self.assertLess(costs[largest], costs[smallest] * self.MAX_GROWTH)
+
 
 class TestStore(TestCase):
     def setUp(self):
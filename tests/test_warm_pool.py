@@ -0,0 +1,231 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from adapters.pool import WarmPool
+from adapters.store import InMemoryStore
+from esm.controllers.tasks import CreateInstance, DeleteInstance
+from esm.models import LastOperation, Manifest, Plan, ServiceInstance, ServiceRequest, ServiceType
+
+CREATE_TIME = 0.05
+
+
+class FakeRM:
+    def __init__(self, readiness=False):
+        self.created = []
+        self.deleted = []
+        self.readiness = readiness
+        self.on_state = dict()  # instance id -> on_state callback, of backends that report readiness
+        self.lock = threading.Lock()
+
+    def create(self, instance_id, content, c_type, **kwargs):
+        time.sleep(CREATE_TIME)
+        with self.lock:
+            self.created.append(instance_id)
+            if self.readiness:
+                self.on_state[instance_id] = kwargs['on_state']
+
+    def delete(self, instance_id, **kwargs):
+        with self.lock:
+            self.deleted.append(instance_id)
+
+    def reports_readiness_of(self, manifest_type):
+        return self.readiness
+
+
+def manifest(content='services: {}', **warm_pool):
+    return Manifest(id='pool-mani', plan_id='pool-plan', service_id='pool-svc', manifest_type='dummy',
+                    manifest_content=content, config={'warm_pool': warm_pool} if warm_pool else None)
+
+
+class TestWarmPool(unittest.TestCase):
+
+    def setUp(self):
+        self.rm = FakeRM()
+        self.store = InMemoryStore()
+        self.pool = WarmPool(self.rm, workers=4, store=self.store)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def fill(self, mani):
+        self.pool.maintain([mani])
+        deadline = time.monotonic() + 5
+        while any(self.pool.creating.values()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def idle(self):
+        return [p.backend_id for p in self.pool.idle.get('pool-mani', [])]
+
+    def test_hand_out_and_replenish(self):
+        mani = manifest(size=2)
+        self.assertIsNone(self.pool.acquire(manifest()))  # no pool configured
+        self.fill(mani)
+        self.assertEqual(len(self.idle()), 2)
+
+        first = self.idle()[0]
+        self.assertEqual(self.pool.acquire(mani), first)
+        self.assertEqual(len(self.idle()), 1)
+        self.fill(mani)
+        self.assertEqual(len(self.idle()), 2)
+        self.assertNotIn(first, self.idle())
+        self.assertEqual(len(self.rm.created), 3)
+        self.assertEqual((self.pool.stats()['hits'], self.pool.stats()['misses']), (1, 0))
+
+    def test_changed_manifest_is_not_handed_out(self):
+        self.fill(manifest(size=1))
+        old = self.idle()
+        changed = manifest('services: {a: {image: b}}', size=1)
+        self.assertIsNone(self.pool.acquire(changed))
+        self.fill(changed)
+        self.pool.executor.submit(lambda: None).result()
+        self.assertEqual(self.rm.deleted, old)
+        self.assertEqual(len(self.idle()), 1)
+
+    def test_ttl_eviction(self):
+        replace = manifest(size=1, ttl=0.1)
+        self.fill(replace)
+        expired = self.idle()
+        time.sleep(0.15)
+        self.fill(replace)
+        self.assertEqual(len(self.idle()), 1)
+        self.assertNotEqual(self.idle(), expired)
+
+        drain = manifest(size=1, ttl=0.1, eviction='drain')
+        time.sleep(0.15)
+        self.fill(drain)
+        self.assertEqual(self.idle(), [])  # not replaced: nothing was handed out
+
+        self.pool.acquire(drain)
+        self.fill(drain)
+        self.assertEqual(len(self.idle()), 1)
+
+    def recorded(self):
+        return self.store.get_backend_refs(WarmPool.BACKEND_REF)
+
+    def test_pooled_instances_are_recorded_until_handed_out(self):
+        mani = manifest(size=2)
+        self.fill(mani)
+        self.assertEqual(sorted(self.recorded()), sorted(self.idle()))
+        self.assertEqual(set(self.recorded().values()), {'dummy'})
+
+        backend_id = self.pool.acquire(mani)
+        self.assertIn(backend_id, self.recorded())
+        self.pool.claim(backend_id)
+        self.assertNotIn(backend_id, self.recorded())
+
+        self.pool.shutdown()
+        self.assertEqual(self.recorded(), {})
+
+    def test_reap_deletes_the_instances_of_an_earlier_run(self):
+        self.fill(manifest(size=2))
+        left = self.idle()
+        self.pool.idle.clear()  # as if the run was killed
+        # handed out, but the run ended before the pool forgot it
+        self.store.add_backend_ref('pool-in-use', WarmPool.BACKEND_REF, 'dummy')
+        self.store.add_service_instance(ServiceInstance(context={'id': 'inst', 'backend_id': 'pool-in-use'}))
+
+        WarmPool(self.rm, workers=1, store=self.store).reap()
+        self.assertEqual(sorted(self.rm.deleted), sorted(left))
+        self.assertEqual(self.recorded(), {})
+
+    def test_instances_join_the_pool_once_ready(self):
+        self.rm.readiness = True
+        self.pool.maintain([manifest(size=2)])
+        deadline = time.monotonic() + 5
+        while len(self.rm.on_state) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.idle(), [])
+        self.assertIsNone(self.pool.acquire(manifest(size=2)))
+
+        ready, failed = sorted(self.rm.on_state)
+        self.rm.on_state[ready]('succeeded', 'ready')
+        self.rm.on_state[failed]('failed', 'not ready in time')
+        self.assertEqual(self.idle(), [ready])
+        self.assertEqual(self.rm.deleted, [failed])
+        self.assertEqual(self.pool.creating['pool-mani'], 0)
+
+    def test_removed_pool_is_deleted(self):
+        self.fill(manifest(size=2))
+        pooled = self.idle()
+        self.fill(manifest())
+        self.pool.executor.submit(lambda: None).result()
+        self.assertEqual(sorted(self.rm.deleted), sorted(pooled))
+        self.assertEqual(self.idle(), [])
+
+
+class TestProvisionFromPool(unittest.TestCase):
+
+    def setUp(self):
+        self.rm = FakeRM()
+        self.pool = WarmPool(self.rm, workers=2)
+        self.store = InMemoryStore()
+        plan = Plan(id='pool-plan', name='plan', description='plan', free=True, bindable=False)
+        self.store.add_service(ServiceType(id='pool-svc', name='svc', description='svc', bindable=False,
+                                           plans=[plan], plan_updateable=False))
+        self.mani = manifest(size=1)
+        self.store.add_manifest(self.mani)
+        self.pool.maintain([self.mani])
+        while any(self.pool.creating.values()):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def provision(self, instance_id, parameters=None):
+        entity = {'entity_id': instance_id, 'entity_res': None,
+                  'entity_req': ServiceRequest(service_id='pool-svc', plan_id='pool-plan', parameters=parameters)}
+        context = {'STORE': self.store, 'RM': self.rm, 'POOL': self.pool}
+        started = time.monotonic()
+        entity, context = CreateInstance(entity, context).start()
+        self.assertEqual(context['status'][1], 200)
+        return time.monotonic() - started
+
+    def test_provision_hands_out_a_pooled_instance(self):
+        pooled = self.pool.idle['pool-mani'][0].backend_id
+        latency = self.provision('from-pool')
+        self.assertLess(latency, CREATE_TIME)
+        instance = self.store.get_service_instance('from-pool')[0]
+        self.assertEqual(instance.context['backend_id'], pooled)
+        self.assertEqual(instance.state.state, 'succeeded')
+        self.assertNotIn('from-pool', self.rm.created)
+
+        entity = {'entity_id': 'from-pool', 'entity_req': {}, 'entity_res': None}
+        DeleteInstance(entity, {'STORE': self.store, 'RM': self.rm}).start()
+        self.assertIn(pooled, self.rm.deleted)
+
+    def test_pooled_instance_is_kept_when_the_store_fails(self):
+        pooled = self.pool.idle['pool-mani'][0].backend_id
+        entity = {'entity_id': 'from-pool', 'entity_res': None,
+                  'entity_req': ServiceRequest(service_id='pool-svc', plan_id='pool-plan')}
+        context = {'STORE': self.store, 'RM': self.rm, 'POOL': self.pool}
+        with patch.object(self.store, 'add_service_instance', side_effect=Exception('store down')):
+            with self.assertRaises(Exception):
+                CreateInstance(entity, context).start()
+        self.assertEqual(self.pool.idle['pool-mani'][0].backend_id, pooled)
+        self.assertEqual(self.pool.acquired, {})
+        self.assertNotIn(pooled, self.rm.deleted)
+
+    def test_parameters_need_a_new_instance(self):
+        self.provision('with-params', parameters={'KEY': 'value'})
+        self.assertIn('with-params', self.rm.created)
+        self.assertNotIn('backend_id', self.store.get_service_instance('with-params')[0].context)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# Copyright © 2017-2019 Zuercher Hochschule fuer Angewandte Wissenschaften.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import asyncio
+import threading
+import time
+import os
+import unittest
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+from tornado.wsgi import WSGIContainer
+
+import runesm
+from adapters.log import get_logger
+from adapters.wsgi import ThreadedWSGIContainer
+
+LOG = get_logger(__name__)
+
+SLOW = 0.2  # seconds a slow request takes, e.g. a backend call
+REQUESTS = 8
+
+
+def slow_app(environ, start_response):
+    if environ['PATH_INFO'] == '/slow':
+        time.sleep(SLOW)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+class Server:
+    def __init__(self, container):
+        self.container = container
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.started.wait(5)
+
+    def _run(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.loop = IOLoop.current()
+        sock, self.port = bind_unused_port()
+        self.server = HTTPServer(self.container)
+        self.server.add_sockets([sock])
+        self.loop.add_callback(self.started.set)
+        self.loop.start()
+
+    def get(self, path):
+        with urllib.request.urlopen('http://127.0.0.1:{}{}'.format(self.port, path), timeout=10) as response:
+            return response.status
+
+    def load(self, path, requests=REQUESTS):
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=requests) as clients:
+            codes = list(clients.map(self.get, [path] * requests))
+        return codes, time.monotonic() - started
+
+    def stop(self):
+        self.loop.add_callback(self.loop.stop)
+        self.thread.join(5)
+
+
+class TestThreadedWSGIContainer(unittest.TestCase):
+
+    @unittest.skipIf(os.getenv('BENCHMARK_TESTS', 'NO') != 'YES', "BENCHMARK_TESTS not set in environment variables")
+    def test_throughput(self):
+        serial = Server(WSGIContainer(slow_app))
+        codes, serial_time = serial.load('/slow')
+        serial.stop()
+        self.assertEqual(codes, [200] * REQUESTS)
+
+        threaded = Server(ThreadedWSGIContainer(slow_app, workers=REQUESTS))
+        codes, threaded_time = threaded.load('/slow')
+        threaded.stop()
+        self.assertEqual(codes, [200] * REQUESTS)
+
+        LOG.info('{} requests of {}s: {:.1f} req/s on the IOLoop thread, {:.1f} req/s on {} workers'.format(
+            REQUESTS, SLOW, REQUESTS / serial_time, REQUESTS / threaded_time, REQUESTS))
+        self.assertGreaterEqual(serial_time, REQUESTS * SLOW)
+        self.assertLess(threaded_time, REQUESTS * SLOW / 2)
+
+    def test_slow_request_does_not_block_others(self):
+        server = Server(ThreadedWSGIContainer(slow_app, workers=2))
+        slow = threading.Thread(target=server.get, args=('/slow',))
+        slow.start()
+        time.sleep(SLOW / 4)
+        started = time.monotonic()
+        self.assertEqual(server.get('/health'), 200)
+        self.assertLess(time.monotonic() - started, SLOW / 2)
+        slow.join()
+        server.stop()
+
+    def test_drain_answers_requests_in_flight(self):
+        server = Server(ThreadedWSGIContainer(slow_app, workers=2))
+        codes = []
+        slow = threading.Thread(target=lambda: codes.append(server.get('/slow')))
+        slow.start()
+        time.sleep(SLOW / 4)
+        runesm.SERVERS['test'] = (server.server, server.container)
+        try:
+            server.loop.add_callback(runesm.drain, 5)
+            server.thread.join(5)
+        finally:
+            del runesm.SERVERS['test']
+        slow.join()
+        self.assertFalse(server.thread.is_alive())
+        self.assertEqual(codes, [200])
+        self.assertEqual(server.container.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()